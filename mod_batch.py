@@ -0,0 +1,118 @@
+"""
+Static batching of settled tiles. Left as they are, each tile is a NodePath of its own,
+instancing its prototype prism, so every tile is a draw call of its own, and once
+cumulative_dups has multiplied the inner group there are thousands of them.
+
+Instead the tiles under a parent (border_tiles_np or inner_tiles_np) are binned in square
+chunks of floor by their position, and each chunk is drawn by a batch: a copy of its
+tiles' geometry, flattened so that the tiles of each material (texture) are merged into
+a single Geom. The tiles themselves are stashed under the parent, so that they still
+have their positions (for stashing the layout, say) but aren't drawn. The batches are under the parent too, so shifting the
+parent, as MyApp.move does the inner tiles, shifts them as well.
+
+A chunk's batch is only rebuilt when a tile in it is added, removed, moved or trimmed.
+"""
+
+import math
+
+
+class TileBatches:
+    def __init__(self, parent_np, chunk_size=8.0):
+        self.parent_np = parent_np
+        self.chunk_size = chunk_size
+        # chunk -> tile NodePaths in it
+        self.chunk_tiles = {}
+        # tile node -> the chunk it is in
+        self.chunk_of = {}
+        # chunk -> its batch NodePath
+        self.batch_nps = {}
+        self.dirty = set()
+
+    def chunk(self, tile_np):
+        pos = tile_np.getPos(self.parent_np)
+        return math.floor(pos.x / self.chunk_size), math.floor(pos.y / self.chunk_size)
+
+    def add(self, tile_nps):
+        """ Batches tile_nps, which must be under the parent, unless already batched """
+        for tile_np in tile_nps:
+            if tile_np.node() in self.chunk_of:
+                continue
+            chunk = self.chunk(tile_np)
+            self.chunk_tiles.setdefault(chunk, []).append(tile_np)
+            self.chunk_of[tile_np.node()] = chunk
+            self.dirty.add(chunk)
+            tile_np.stash()
+        self.flush()
+
+    def remove(self, tile_nps):
+        """ Unbatches tile_nps, leaving them stashed """
+        for tile_np in tile_nps:
+            chunk = self.chunk_of.pop(tile_np.node())
+            self.chunk_tiles[chunk].remove(tile_np)
+            self.dirty.add(chunk)
+        self.flush()
+
+    def update(self, tile_nps):
+        """
+        Rebatches tile_nps after they have been moved or trimmed, and unbatches those
+        removed from the scene graph since (as clip_tiles drops tiles). Tiles not batched
+        are passed over.
+        """
+        if any(tile_np.isEmpty() for tile_np in tile_nps):
+            self.drop_removed()
+        for tile_np in tile_nps:
+            if tile_np.isEmpty() or tile_np.node() not in self.chunk_of:
+                continue
+            old_chunk = self.chunk_of[tile_np.node()]
+            chunk = self.chunk(tile_np)
+            if chunk != old_chunk:
+                self.chunk_tiles[old_chunk].remove(tile_np)
+                self.chunk_tiles.setdefault(chunk, []).append(tile_np)
+                self.chunk_of[tile_np.node()] = chunk
+            self.dirty.update([old_chunk, chunk])
+        self.flush()
+
+    def drop_removed(self):
+        # The removed tiles' NodePaths are empty by now, but their nodes, kept by
+        # chunk_of, are left without a parent (a stashed tile keeps its)
+        for node in [node for node, chunk in self.chunk_of.items() if not node.getNumParents()]:
+            chunk = self.chunk_of.pop(node)
+            self.chunk_tiles[chunk] = [tile_np for tile_np in self.chunk_tiles[chunk] if not tile_np.isEmpty()]
+            self.dirty.add(chunk)
+
+    def flush(self):
+        # Rebuilds the batches of the chunks whose tiles have changed
+        for chunk in self.dirty:
+            if chunk in self.batch_nps:
+                self.batch_nps.pop(chunk).removeNode()
+            tile_nps = self.chunk_tiles.get(chunk)
+            if tile_nps:
+                self.batch_nps[chunk] = self.build_batch(chunk, tile_nps)
+            else:
+                self.chunk_tiles.pop(chunk, None)
+        self.dirty.clear()
+
+    def build_batch(self, chunk, tile_nps):
+        batch_np = self.parent_np.attachNewNode('batch_%d_%d' % chunk)
+        for tile_np in tile_nps:
+            copy_np = tile_np.copyTo(batch_np)
+            copy_np.unstash()
+        # merges the geometry of each material into one Geom, with the tiles' transforms
+        # applied to its vertices
+        batch_np.flattenStrong()
+        return batch_np
+
+    def unbatch(self):
+        """ Unstashes all the tiles, and removes the batches """
+        for tile_nps in self.chunk_tiles.values():
+            for tile_np in tile_nps:
+                tile_np.unstash()
+        for batch_np in self.batch_nps.values():
+            batch_np.removeNode()
+        self.chunk_tiles.clear()
+        self.chunk_of.clear()
+        self.batch_nps.clear()
+        self.dirty.clear()
+
+    def __len__(self):
+        return len(self.batch_nps)
@@ -0,0 +1,424 @@
+"""
+Benchmarks each stage of laying a floor on its own, headless, over synthetic scenarios
+scaled from tens to tens of thousands of tiles, and saves the wall times, peak memory and
+tile counts as JSON, so that a change can be checked for regressions against the results
+of an earlier release.
+
+    tile_poly         building n prism TilePolys (the geometry only, no textures)
+    layout_pusher     laying the border of a rectangular outline of about n tiles, as
+    layout_analytic   compiled by OutlineDispenser, with each engine, on a floor made
+                      tall enough for it, up to 100 tiles for the pusher, which takes
+                      about 0.15 s a tile. The inner schedule is fixed, so isn't laid,
+                      and the textures are loaded beforehand.
+    prism_wall        Surface.prism_wall for 100 tiles, among n cushions
+    settle            SettleSolver.rest_position of 10 tiles flung into the corner of
+                      the front path, with n cushions walling tiles laid further off
+    repeat_shift      calc_repeat_shift, East then South, of a diamond group of n tiles
+    cumulative_dups   cumulative_dups of a diamond group of n tiles, making 18 n
+    detect_intrusion  Border_Occluder.detect_intrusion on a border trace of n records
+    dispense          popping up the n tiles of a schedule, the border's over and over,
+                      each collider given back as settling the tile does, once each kind
+                      of tile has been made, and its texture loaded
+    traverse          100 frames of a tile flung across n settled tiles, walled by their
+                      cushions, traversing the collision root as MyApp does
+
+Each case is timed in a fresh process, over a few runs, and then run once more in another
+process under tracemalloc, for the peak of the memory allocated by Python. The maximum
+resident set size of the timed process is given too, which includes Panda3D's own.
+
+    python mod_bench.py [output.json] [repeat]
+    python mod_bench.py --compare old.json new.json
+"""
+import contextlib
+import functools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+from panda3d.core import loadPrcFileData, PandaSystem, Point3, TexturePool
+
+try:
+    import resource
+except ImportError:
+    # not on Windows
+    resource = None
+
+
+BENCH_VERSION = 2
+
+SCALES = [10, 100, 1000, 10000]
+# the outline laid is at most this wide, and as tall as it takes
+OUTLINE_WIDTH = 12
+TEXTURES = ['tex/black_front.jpg', 'tex/white_front.jpg', 'tex/cement.jpg']
+# Ratio of new to old wall time above which --compare calls a case slower
+REGRESSION_RATIO = 1.1
+
+
+def quiet_debug_prints():
+    # they would swamp the timings, as would the telemetry
+    import mod_key_move
+    import mod_surface
+    import mod_border_occluder
+    import mod_duplicator
+    from mod_telemetry import telemetry
+    for module in [mod_key_move, mod_surface, mod_border_occluder, mod_duplicator]:
+        module.DBP = False
+    telemetry.enabled = False
+
+
+def diamond_group(n, parent_np):
+    """
+    About n tile NodePaths under parent_np, in whole rows laid out as the inner tiles are,
+    each row shifted by half a tile from the row before
+    """
+    dx, dy = 2.8818, 1.4252
+    cols = max(1, round(math.sqrt(n)))
+    rows = max(2, round(n / cols))
+    tile_nps = []
+    for r in range(rows):
+        for c in range(cols):
+            tile_np = parent_np.attachNewNode("prism")
+            tile_np.setPos(c * dx + (r % 2) * dx / 2, -r * dy, 0)
+            tile_np.setH(45)
+            tile_np.setTag('kind', 'edge_diamond')
+            tile_nps.append(tile_np)
+    return tile_nps
+
+
+def square_xys(x, y, side):
+    return [Point3(x, y, 0), Point3(x + side, y, 0), Point3(x + side, y + side, 0), Point3(x, y + side, 0)]
+
+
+def tile_poly_case(n):
+    from mod_tiles import Tiles
+    from tile_poly import TilePoly
+
+    shapes = [Tiles.square, Tiles.triangle, Tiles.rectangle, Tiles.short_rect]
+
+    def run(_):
+        for i in range(n):
+            TilePoly(shapes[i % len(shapes)], (1, 1, 1, 1))
+    return dict(tiles=n), lambda: None, run
+
+
+def rect_outline(n, grout_wd):
+    """
+    A rectangular outline whose border is about n tiles (strips, mostly), as OutlineDispenser
+    takes it, and the top of the floor it needs, where it starts
+    """
+    side = n * (2 + grout_wd) / 4
+    width = min(side, OUTLINE_WIDTH)
+    height = 2 * side - width
+    top = math.ceil(height) + 1
+    return [(0, top), (0, top - height), (width, top - height), (width, top)], top
+
+
+def layout_case(engine, n):
+    from mod_key_move import MyApp
+
+    layout_dir = tempfile.mkdtemp()
+    # with MyApp's grout
+    outline, top = rect_outline(n, 2 / 75)
+
+    class OutlineApp(MyApp):
+        # the border only, on a floor as tall as the outline
+        top_limit = top
+
+        def lay_inner_tiles(self, task):
+            self.lift_border()
+            self.laid = True
+
+    def prepare():
+        for path in TEXTURES:
+            TexturePool.loadTexture(path)
+
+    def run(_):
+        app = OutlineApp(headless=True, layout_path=os.path.join(layout_dir, 'bench.npz'), engine=engine,
+                         cache_path=None, checkpoint_path=None, outline=outline)
+        while not app.laid:
+            app.taskMgr.step()
+        return dict(tiles=len(app.border_tile_nps))
+    return dict(), prepare, run
+
+
+def prism_wall_case(n):
+    from mod_surface import Surface
+    from mod_tiles import Tiles
+
+    # n cushions walling a lattice of squares, and tiles to wall among them
+    side, pitch = 2.0, 3.0
+    per_row = math.ceil(math.sqrt(n / 4))
+    floor = Surface(per_row * pitch, per_row * pitch, 2 / 75, Tiles.tip_rad)
+    cushion_list = []
+    for k in range(math.ceil(n / 4)):
+        xys = square_xys((k % per_row) * pitch, (k // per_row) * pitch, side)
+        for i in range(4):
+            p1, p2 = xys[i], xys[(i + 1) % 4]
+            cushion_list.append(('path_tile', p1, p2, floor.cushion_rad))
+    cushion_list = cushion_list[:n]
+    probes = [square_xys((k % per_row) * pitch + 0.5, (k // per_row) * pitch + 0.5, side)
+              for k in np.linspace(0, math.ceil(n / 4) - 1, 100).astype(int)]
+
+    def prepare():
+        floor.restore_cushions(cushion_list)
+
+    def run(_):
+        for xys in probes:
+            floor.prism_wall(xys, False)
+    return dict(tiles=len(probes), cushions=len(cushion_list)), prepare, run
+
+
+def settle_case(n):
+    from panda3d.core import Vec3
+    from mod_settle import SettleSolver
+    from mod_surface import Surface
+    from mod_tiles import Tiles
+
+    floor = Surface(20, 20, 2 / 75, Tiles.tip_rad)
+    per_row = math.ceil(math.sqrt(n / 4))
+    cushion_list = floor.cushion_list()
+    for k in range(math.ceil(n / 4)):
+        xys = square_xys(30 + (k % per_row), 30 + (k // per_row), 2 / 3)
+        for i in range(4):
+            cushion_list.append(('path_tile', xys[i], xys[(i + 1) % 4], floor.cushion_rad))
+    floor.restore_cushions(cushion_list[:n + 2])
+    solver = SettleSolver(50, 0.94)
+    trajectory = [Vec3(-0.18, 0, -0.24), Vec3(0, 0.12, -0.12)]
+
+    def prepare():
+        return [Tiles.edge_square((1.5, 18, 1), 'tile%d' % k, 0) for k in range(10)]
+
+    def run(tiles):
+        for tile in tiles:
+            solver.rest_position(tile, trajectory, floor.cushions)
+    return dict(tiles=10, cushions=len(floor.cushions)), prepare, run
+
+
+def repeat_shift_case(n):
+    from mod_duplicator import calc_repeat_shift
+    from mod_tiles import T_Evt
+
+    def prepare():
+        render.node().removeAllChildren()
+        return diamond_group(n, render)
+
+    def run(tile_nps):
+        calc_repeat_shift(T_Evt.EAST, tile_nps)
+        calc_repeat_shift(T_Evt.SOUTH, tile_nps)
+        return dict(tiles=len(tile_nps))
+    return dict(), prepare, run
+
+
+def cumulative_dups_case(n):
+    from mod_duplicator import cumulative_dups
+
+    def prepare():
+        render.node().removeAllChildren()
+        return diamond_group(n, render)
+
+    def run(tile_nps):
+        group = len(tile_nps)
+        cumulative_dups(tile_nps)
+        return dict(tiles=len(tile_nps), group_tiles=group)
+    return dict(), prepare, run
+
+
+def detect_intrusion_case(n):
+    from mod_border_occluder import Border_Occluder
+    from mod_tiles import T_Evt
+
+    # A border laid anti-clockwise from the top left, whose right side steps in and out
+    # again, throwing up an intrusion at each step, to make up n trace records
+    u, width, side = 2.0, 10.0, 0.66
+    steps = max(1, (n - 4) // 4)
+    height = 3 * u * steps + u
+    trace = [(T_Evt.START, 0, height), (T_Evt.SOUTH, 0, 0), (T_Evt.EAST, width, 0)]
+    for k in range(steps):
+        y = k * 3 * u
+        trace += [(T_Evt.NORTH, width, y + u), (T_Evt.WEST, width - u, y + u),
+                  (T_Evt.NORTH, width - u, y + 2 * u), (T_Evt.EAST, width, y + 2 * u)]
+    trace.append((T_Evt.NORTH, width, height))
+    border_tile_trace = [dict(to_dir=to_dir, xys=square_xys(x, y, side)) for to_dir, x, y in trace]
+
+    def prepare():
+        render.node().removeAllChildren()
+        bord_occl = Border_Occluder(render.attachNewNode("border"), 2 / 75)
+        bord_occl.border_tile_trace = border_tile_trace
+        return bord_occl
+
+    def run(bord_occl):
+        bord_occl.detect_intrusion()
+        return dict(occluders=len(bord_occl.occluder_polys))
+    return dict(tiles=len(border_tile_trace)), prepare, run
+
+
+def dispense_case(n):
+    from mod_tiles import ResumedDispenser, TileDispenser
+    from tile_poly import collider_pool
+
+    records = np.resize(TileDispenser(0).schedule, n)
+
+    def prepare():
+        # one of each kind of tile, so that their prototypes are made, and their textures
+        # loaded, before the popping up is timed
+        _, firsts = np.unique(records[['kind', 'phase']], return_index=True)
+        dispenser = ResumedDispenser(records[firsts], 0)
+        while dispenser.tiles_left():
+            collider_pool.recycle(dispenser.popup()[0])
+        render.node().removeAllChildren()
+        return ResumedDispenser(records, 0)
+
+    def run(dispenser):
+        while dispenser.tiles_left():
+            collider_pool.recycle(dispenser.popup()[0])
+    return dict(tiles=n), prepare, run
+
+
+def traverse_case(n):
+    from panda3d.core import CollisionHandlerPusher, CollisionTraverser, Vec3
+    from mod_surface import Surface, ROLE_MASKS, FLYING_FROM_MASK
+    from mod_tiles import Tiles
+    from tile_poly import collider_pool
+
+    # n settled squares on a lattice, each walled by its 4 cushions, as prism_wall would
+    side, pitch = 2 / 3, 1.0
+    per_row = math.ceil(math.sqrt(n))
+    collision_np = render.attachNewNode('collision')
+    floor = Surface(per_row * pitch, per_row * pitch, 2 / 75, Tiles.tip_rad, collision_np)
+    cushion_list = []
+    for k in range(n):
+        x, y = (k % per_row) * pitch, (k // per_row) * pitch
+        collider_pool.recycle(Tiles.edge_square((x, y, 0), 'settled', 0))
+        xys = square_xys(x - side / 2, y - side / 2, side)
+        for i in range(4):
+            cushion_list.append(('path_tile', xys[i], xys[(i + 1) % 4], floor.cushion_rad))
+    floor.restore_cushions(floor.cushion_list() + cushion_list)
+    middle = (per_row // 2) * pitch + pitch / 2
+
+    def prepare():
+        # flung diagonally among them from the middle, a frame at a time, as fast as the
+        # border tiles are
+        flying = Tiles.edge_square((middle, middle, 0), 'flying', 0)
+        flying.np.reparentTo(collision_np)
+        flying.collider.node().setFromCollideMask(FLYING_FROM_MASK)
+        flying.collider.node().setIntoCollideMask(ROLE_MASKS['flying_tile'])
+        trav, pusher = CollisionTraverser(), CollisionHandlerPusher()
+        trav.setRespectPrevTransform(True)
+        pusher.addCollider(flying.collider, flying.np)
+        trav.addCollider(flying.collider, pusher)
+        return flying, trav
+
+    def run(args):
+        flying, trav = args
+        for _ in range(100):
+            flying.np.setFluidPos(flying.np.getPos() + Vec3(0.06, 0.08, 0))
+            trav.traverse(collision_np)
+        flying.np.removeNode()
+    return dict(tiles=n, cushions=len(cushion_list)), prepare, run
+
+
+# stage: (case, scales, whether each run needs a fresh process, as only one ShowBase can)
+STAGES = {'tile_poly': (tile_poly_case, SCALES, False),
+          'layout_pusher': (functools.partial(layout_case, 'pusher'), SCALES[:2], True),
+          'layout_analytic': (functools.partial(layout_case, 'analytic'), SCALES[:3], True),
+          'prism_wall': (prism_wall_case, SCALES, False),
+          'settle': (settle_case, SCALES, False),
+          'repeat_shift': (repeat_shift_case, SCALES, False),
+          'cumulative_dups': (cumulative_dups_case, SCALES, False),
+          'detect_intrusion': (detect_intrusion_case, SCALES, False),
+          'dispense': (dispense_case, SCALES, False),
+          'traverse': (traverse_case, SCALES, False)}
+
+
+def measure(stage, scale, runs, traced):
+    """
+    Worker: times runs of one case, or traces the memory allocated by one, returning
+    the times, the peak memory and the counts
+    """
+    # No sound either, so that no audio device is needed
+    loadPrcFileData('bench', 'audio-library-name null')
+    case, _, own_showbase = STAGES[stage]
+    times = []
+    python_peak = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if not own_showbase:
+            from direct.showbase.ShowBase import ShowBase
+            ShowBase(windowType='none')
+        quiet_debug_prints()
+        counts, prepare, run = case(scale)
+        for _ in range(runs):
+            args = prepare()
+            if traced:
+                tracemalloc.start()
+            start = time.perf_counter()
+            counts.update(run(args) or {})
+            times.append(time.perf_counter() - start)
+            if traced:
+                python_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    return dict(times=times, counts=counts, max_rss_kb=max_rss_kb,
+                python_peak_kb=None if python_peak is None else python_peak / 1024)
+
+
+def run_benchmarks(repeat=3, stages=None):
+    """ Runs every case of stages (default, all), timing each repeat times """
+    results = []
+    # one case at a time, so that they don't compete, each in a fresh process
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for stage in stages or STAGES:
+            _, scales, own_showbase = STAGES[stage]
+            for scale in scales:
+                if own_showbase:
+                    timed = [pool.apply(measure, (stage, scale, 1, False)) for _ in range(repeat)]
+                else:
+                    timed = [pool.apply(measure, (stage, scale, repeat, False))]
+                traced = pool.apply(measure, (stage, scale, 1, True))
+                times = [t for result in timed for t in result['times']]
+                max_rss = [result['max_rss_kb'] for result in timed if result['max_rss_kb'] is not None]
+                results.append(dict(stage=stage, scale=scale, **timed[-1]['counts'],
+                                    wall_s=dict(min=min(times), mean=sum(times) / len(times), runs=times),
+                                    python_peak_kb=traced['python_peak_kb'],
+                                    max_rss_kb=max(max_rss) if max_rss else None))
+                print('%-16s %-8s %10.4f s' % (stage, scale, min(times)))
+    return dict(version=BENCH_VERSION, created=datetime.now(timezone.utc).isoformat(),
+                python=platform.python_version(), panda3d=PandaSystem.getVersionString(),
+                numpy=np.__version__, platform=platform.platform(), repeat=repeat,
+                results=results)
+
+
+def compare(old, new):
+    """ Lines comparing the fastest wall time of each case in both benchmark results """
+    old_results = {(result['stage'], str(result['scale'])): result for result in old['results']}
+    lines = []
+    for result in new['results']:
+        key = (result['stage'], str(result['scale']))
+        if key not in old_results:
+            continue
+        old_s, new_s = old_results[key]['wall_s']['min'], result['wall_s']['min']
+        ratio = new_s / old_s if old_s else math.inf
+        verdict = 'SLOWER' if ratio > REGRESSION_RATIO else 'faster' if ratio < 1 / REGRESSION_RATIO else ''
+        lines.append('%-16s %-8s %10.4f s -> %10.4f s  x%.2f %s' % (key + (old_s, new_s, ratio, verdict)))
+    return lines
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--compare']:
+        with open(sys.argv[2]) as old_file, open(sys.argv[3]) as new_file:
+            for line in compare(json.load(old_file), json.load(new_file)):
+                print(line)
+        sys.exit()
+    output_path = sys.argv[1] if len(sys.argv) > 1 else 'bench.json'
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    report = run_benchmarks(repeat)
+    with open(output_path, 'w') as output:
+        json.dump(report, output, indent=1)
@@ -1,5 +1,8 @@
 from panda3d.core import *
+import numpy as np
 from mod_tiles import T_Evt
+from mod_telemetry import telemetry
+from mod_clip import signed_area, subtract
 
 
 UNHIDE = True
@@ -7,30 +10,64 @@ UNHIDE = True
 DBP = True
 # DBP = False
 
+# occluder corners closer than this are welded into one vertex
+WELD_TOL = 1e-6
+# side of the square buckets the occluders are hashed in, to find those overlapping
+OCCLUDER_BUCKET = 8.0
+
 
 class Border_Occluder:
+    # intrusion sequences, anti-clockwise only
+    INTR_SEQS = {T_Evt.SOUTH: [T_Evt.EAST, T_Evt.SOUTH],
+                 T_Evt.NORTH: [T_Evt.WEST, T_Evt.NORTH],
+                 T_Evt.EAST: [T_Evt.NORTH, T_Evt.EAST],
+                 T_Evt.WEST: [T_Evt.SOUTH, T_Evt.WEST]}
+
     def __init__(self, border_np, grout_width):
         self.border_np = border_np
         self.border_tile_trace = []
-        self.unoccluded_ixs = []
+        self.occluder_np = None
         self.margin_wd = 4.0
         self.z_off = -0.01
         # self.z_off = 2
         self.grout_width = grout_width
+        self.reset_detection()
+
+    def reset_detection(self):
+        # Occluders are staked out as the border tiles register (see advance), so this is
+        # the state of the intrusion sequence matcher between records, and of what it has
+        # staked out so far.
+        # At most 2 parallel sequences to match, not 3, because the 3rd event that completes
+        # a sequence (a) results in the removal of that sequence, and (b) must never
+        # simultaneously begin a new sequence.
+        self.poss_matched_seq = {}
+        self.ix_for_seq = {0: None, 1: None}
+        # the start and direction of an intrusion matched, to be staked out with the next record
+        self.pending_intrusion = None
+        self.last_margin_ix = None
+        self.unoccluded_ixs = set()
+        # the polygon of each occluder, as its x, y corners, which are all drawn by a
+        # single mesh (and used for clipping, see mod_clip)
+        self.occluder_polys = []
+        # each occluder's polygon anti-clockwise, hashed in buckets, and the vertex of each
+        # welded corner of the mesh
+        self.drawn_polys = []
+        self.occluder_buckets = {}
+        self.welded = {}
+        if self.occluder_np is not None:
+            self.occluder_np.removeNode()
+        self.occluder_np = self.empty_mesh()
 
     def get_tile_trace(self):
         return self.border_tile_trace
 
     def register_occlusion(self, to_dir, on_tile):
-        corners = on_tile.corner_nodes()
-        xys = [np.getPos(self.border_np) for np in corners]
+        xys = on_tile.corners_in(self.border_np)
         self.border_tile_trace.append(dict(to_dir=to_dir, xys=xys))
-        if DBP:
-            print("border_tile_trace")
-            for rec in self.border_tile_trace:
-                print(rec['to_dir'])
-                for p in rec['xys']:
-                    print(p)
+        # only the record added, not the whole trace again
+        if DBP and telemetry.enabled:
+            telemetry.debug("border_tile_trace", len(self.border_tile_trace) - 1, to_dir, *xys)
+        self.advance(len(self.border_tile_trace) - 1)
 
     def margin_occluder(self, i0, no_tail):
 
@@ -73,13 +110,11 @@ class Border_Occluder:
         last_ix = len(self.border_tile_trace) - 1
         wrap_ix = 0 if i0 == last_ix else i0 + 1
 
-        if DBP:
-            print('---margin occluder using indices incl in range [', i0, ',', wrap_ix, ')')
+        if DBP and telemetry.enabled:
+            telemetry.debug('---margin occluder using indices incl in range [', i0, ',', wrap_ix, ')')
             for i in [i0, wrap_ix]:
                 rec = self.border_tile_trace[i]
-                print(rec['to_dir'])
-                for p in rec['xys']:
-                    print(p)
+                telemetry.debug(rec['to_dir'], *rec['xys'])
 
         from_rec = self.border_tile_trace[i0]
         to_rec = self.border_tile_trace[wrap_ix]
@@ -97,23 +132,15 @@ class Border_Occluder:
         start_pt = self.point_facing(from_rec['xys'], ordinal['from'])
         end_pt = self.point_facing(to_rec['xys'], ordinal['to'])
 
-        if DBP: print('start_pt', start_pt, 'end_pt', end_pt)
+        if DBP and telemetry.enabled: telemetry.debug('start_pt', start_pt, 'end_pt', end_pt)
 
         margin_stakes = self.stake_out_margin(to_dir, start_pt, end_pt, no_tail)
-        if DBP:
-            print('margin_stakes')
-            for stake in margin_stakes: print(stake)
-
-        occluder_name = 'margin_' + str(i0)
-        occluder = CardMaker(occluder_name)
-        occluder.setFrame(*margin_stakes)
-        occluder_node = occluder.generate()
-        occluder_nodepath = self.border_np.attachNewNode(occluder_node)
-
-        return occluder_nodepath
+        if DBP and telemetry.enabled: telemetry.debug('margin_stakes', *margin_stakes)
+        self.add_occluder(margin_stakes)
+        return margin_stakes
 
     def stake_out_margin(self, to_dir, start_pt, end_pt, no_tail):
-        if DBP: print(to_dir, start_pt, end_pt, no_tail)
+        if DBP and telemetry.enabled: telemetry.debug(to_dir, start_pt, end_pt, no_tail)
         x_grout = Vec3(self.grout_width, 0, 0)
         y_grout = Vec3(0, self.grout_width, 0)
         if to_dir == T_Evt.EAST:
@@ -182,39 +209,29 @@ class Border_Occluder:
                     T_Evt.SOUTH: {'entry':'NE', 'exit':'SE'}}
 
 
-        for j in range(i0, i0+3):
-            self.unoccluded_ixs.remove(j)
-        if DBP: print('---intrusion occluder using indices incl in range [', i0, ',', i0+3, ')',
-                      self.unoccluded_ixs)
+        if DBP and telemetry.enabled:
+            telemetry.debug('---intrusion occluder using indices incl in range [', i0, ',', i0+3, ')',
+                            self.unoccluded_ixs)
         occluder_name = 'intrusion_' + str(i0) + '_' + str(i0+3)
-        if DBP: print(occluder_name)
+        if DBP and telemetry.enabled: telemetry.debug(occluder_name)
 
         # establish the points
         intrusion_pts = []
         ordinal = ordinals[matched_dir]
         for int_ix in range(4):
-            occl_rec = self.border_tile_trace[i0 + int_ix]
+            # the record after the sequence wraps round to the first, if it was the last
+            occl_rec = self.border_tile_trace[(i0 + int_ix) % len(self.border_tile_trace)]
             ord_key = 'exit' if int_ix // 2 == 1 else 'entry'
             pt = self.point_facing(occl_rec['xys'], ordinal[ord_key])
             intrusion_pts.append(pt)
 
-        if DBP:
-            print('intrusion_pts')
-            for pt in intrusion_pts:
-                print(pt)
+        if DBP and telemetry.enabled: telemetry.debug('intrusion_pts', *intrusion_pts)
 
         intrusion_stakes = self.stake_out_intrusion(matched_dir, intrusion_pts)
 
-        if DBP:
-            print('intrusion_stakes')
-            for stake in intrusion_stakes: print(stake)
-
-        occluder = CardMaker(occluder_name)
-        occluder.setFrame(*intrusion_stakes)
-        occluder_node = occluder.generate()
-        occluder_nodepath = self.border_np.attachNewNode(occluder_node)
-
-        return occluder_nodepath
+        if DBP and telemetry.enabled: telemetry.debug('intrusion_stakes', *intrusion_stakes)
+        self.add_occluder(intrusion_stakes)
+        return intrusion_stakes
 
     def stake_out_intrusion(self, matched_dir, intrusion_pts):
         # apply the margin to the intrusion opening
@@ -256,63 +273,191 @@ class Border_Occluder:
                     intrusion_pts[1] + x_grout + y_grout,
                     entry_pt + y_grout]
 
-    def detect_intrusion(self):
-        detected_occluder_nps = []
-        # intrusion sequences, anti-clockwise only
-        intr_seqs = {T_Evt.SOUTH: [T_Evt.EAST, T_Evt.SOUTH],
-                     T_Evt.NORTH: [T_Evt.WEST, T_Evt.NORTH],
-                     T_Evt.EAST: [T_Evt.NORTH, T_Evt.EAST],
-                     T_Evt.WEST: [T_Evt.SOUTH, T_Evt.WEST]}
-
-        poss_matched_seq = {}
-        # At most 2 parallel sequences to match, not 3, because the 3rd event that completes
-        # a sequence (a) results in the removal of that sequence, and (b) must never
-        # simultaneously begin a new sequence.
-        ix_for_seq = {0: None, 1: None}
-        self.unoccluded_ixs = list(range(len(self.border_tile_trace)))
-        for i, rec in enumerate(self.border_tile_trace):
-            to_dir = rec['to_dir']
-            if DBP: print(i, to_dir)
-            # Look for in progress sequences first
-            complete_ix = None
+    def advance(self, i):
+        """
+        Advances the intrusion sequence matcher by record i of the trace, and stakes out
+        the occluders whose records it closes
+        """
+        self.unoccluded_ixs.add(i)
+        if self.pending_intrusion is not None:
+            # an intrusion's occluder takes in the record after its sequence too
+            self.intrusion_occluder(*self.pending_intrusion)
+            self.pending_intrusion = None
+
+        rec = self.border_tile_trace[i]
+        to_dir = rec['to_dir']
+        if DBP and telemetry.enabled: telemetry.debug(i, to_dir)
+        poss_matched_seq = self.poss_matched_seq
+        ix_for_seq = self.ix_for_seq
+        # Look for in progress sequences first
+        complete_ix = None
+        for ix in ix_for_seq:
+            if ix_for_seq[ix] is not None:
+                # A possible matched sequence is in progress
+                seq = poss_matched_seq[ix]
+                if to_dir == seq[ix_for_seq[ix]]:
+                    # continued match
+                    ix_for_seq[ix] += 1
+                    # test seq for completion and mark it complete if achieved
+                    if ix_for_seq[ix] == 2:
+                        # There will only ever be one completed sequence
+                        complete_ix = ix
+                    if DBP and telemetry.enabled:
+                        telemetry.debug('poss cont seq', ix, to_dir, poss_matched_seq, ix_for_seq)
+                else:
+                    # aborted match attempt so clear out this aborted sequence
+                    poss_matched_seq[ix] = None
+                    ix_for_seq[ix] = None
+                    if DBP and telemetry.enabled:
+                        telemetry.debug('aborted del key', ix, to_dir, poss_matched_seq, ix_for_seq)
+        if complete_ix is not None:
+            # got a match, so clear out this matched sequence
+            poss_matched_seq[complete_ix] = None
+            ix_for_seq[complete_ix] = None
+            if DBP and telemetry.enabled:
+                telemetry.debug('matched all', complete_ix, to_dir, poss_matched_seq, ix_for_seq)
+            # intrusion which started 2 events back, staked out with the next record
+            self.unoccluded_ixs.difference_update(range(i - 2, i + 1))
+            self.pending_intrusion = (i - 2, to_dir)
+        else:
+            # An event that completes a match will never simultaneously start a new seq
+            # but others could. Look for slots to start a new sequence
             for ix in ix_for_seq:
-                if ix_for_seq[ix] is not None:
-                    # A possible matched sequence is in progress
-                    seq = poss_matched_seq[ix]
-                    if to_dir == seq[ix_for_seq[ix]]:
-                        # continued match
-                        ix_for_seq[ix] += 1
-                        # test seq for completion and mark it complete if achieved
-                        if ix_for_seq[ix] == 2:
-                            # There will only ever be one completed sequence
-                            complete_ix = ix
-                        if DBP: print('poss cont seq', ix, to_dir, poss_matched_seq, ix_for_seq)
-                    else:
-                        # aborted match attempt so clear out this aborted sequence
-                        poss_matched_seq[ix] = None
-                        ix_for_seq[ix] = None
-                        if DBP: print('aborted del key', ix, to_dir, poss_matched_seq, ix_for_seq)
-            if complete_ix is not None:
-                # got a match, so clear out this matched sequence
-                poss_matched_seq[complete_ix] = None
-                ix_for_seq[complete_ix] = None
-                if DBP: print('matched all', complete_ix, to_dir, poss_matched_seq, ix_for_seq)
-                # intrusion which started 2 events back
-                detected_occluder_nps.append(self.intrusion_occluder(i - 2, to_dir))
-            else:
-                # An event that completes a match will never simultaneously start a new seq
-                # but others could. Look for slots to start a new sequence
-                for ix in ix_for_seq:
-                    if ix_for_seq[ix] is None:
-                        if to_dir in intr_seqs:
-                            poss_matched_seq[ix] = intr_seqs[to_dir]
-                            ix_for_seq[ix] = 0
-                            if DBP: print('poss new', ix, to_dir, poss_matched_seq, ix_for_seq)
-                            # only want one slot for the new sequence
-                            break
-        last_ix = None
-        for ix in self.unoccluded_ixs:
-            no_tail = True if last_ix is not None and last_ix < ix - 1 else False
-            last_ix = ix
-            detected_occluder_nps.append(self.margin_occluder(ix, no_tail))
-        return detected_occluder_nps
\ No newline at end of file
+                if ix_for_seq[ix] is None:
+                    if to_dir in self.INTR_SEQS:
+                        poss_matched_seq[ix] = self.INTR_SEQS[to_dir]
+                        ix_for_seq[ix] = 0
+                        if DBP and telemetry.enabled:
+                            telemetry.debug('poss new', ix, to_dir, poss_matched_seq, ix_for_seq)
+                        # only want one slot for the new sequence
+                        break
+        # An intrusion taking a record completes at most 2 records later, so by now
+        # the record 2 back either has been taken or needs a margin occluder
+        if i >= 2:
+            self.add_margin(i - 2)
+
+    def add_margin(self, ix):
+        # A margin occluder for record ix, unless an intrusion occluder took it
+        if ix not in self.unoccluded_ixs:
+            return
+        no_tail = True if self.last_margin_ix is not None and self.last_margin_ix < ix - 1 else False
+        self.margin_occluder(ix, no_tail)
+        self.last_margin_ix = ix
+
+    def resume_trace(self, border_tile_trace):
+        """
+        Takes up a trace laid so far, as from a checkpoint, staking out the occluders of
+        the records it closes, so that registering more records carries on from it
+        """
+        self.reset_detection()
+        self.border_tile_trace = border_tile_trace
+        for i in range(len(border_tile_trace)):
+            self.advance(i)
+
+    def close_trace(self):
+        """
+        Stakes out the occluders of the last records, once the border is finished, the last
+        margin occluder wrapping round to the first record, returning the occluder NodePaths
+        """
+        if self.pending_intrusion is not None:
+            self.intrusion_occluder(*self.pending_intrusion)
+            self.pending_intrusion = None
+        for ix in range(max(0, len(self.border_tile_trace) - 2), len(self.border_tile_trace)):
+            self.add_margin(ix)
+        return [self.occluder_np]
+
+    def inner_outline(self):
+        """
+        The outline of the floor inside the border, the inner edge of the trace, as the x, y
+        corners of a closed polygon, or None if the trace doesn't go round. The edges
+        either side of a record's tile each run along the side of it facing into the
+        floor, which, the trace going anti-clockwise, is on the left, so the outline's
+        corner at the record is where those sides meet.
+        """
+        if len(self.border_tile_trace) < 4:
+            return None
+        lows = np.array([[min(p.x for p in rec['xys']), min(p.y for p in rec['xys'])]
+                         for rec in self.border_tile_trace])
+        highs = np.array([[max(p.x for p in rec['xys']), max(p.y for p in rec['xys'])]
+                          for rec in self.border_tile_trace])
+        centres = (lows + highs) / 2
+        arriving = centres - np.roll(centres, 1, axis=0)
+        leaving = np.roll(arriving, -1, axis=0)
+        corners = []
+        for i in range(len(centres)):
+            # the axis each edge runs along, and the way
+            axis_in, axis_out = np.abs(arriving[i]).argmax(), np.abs(leaving[i]).argmax()
+            if axis_in == axis_out:
+                # no turn here
+                continue
+            corner = [0.0, 0.0]
+            for axis, heading in [(axis_in, arriving[i]), (axis_out, leaving[i])]:
+                # heading along x, the left is north, or south heading west; along y, the
+                # left is west, or east heading south
+                across = 1 - axis
+                facing_max = (heading[axis] > 0) == (axis == 0)
+                corner[across] = float(highs[i, across] if facing_max else lows[i, across])
+            corners.append(tuple(corner))
+        return corners if len(corners) >= 4 else None
+
+    def detect_intrusion(self):
+        """
+        Stakes out all the occluders of a finished trace, as one loaded rather than laid,
+        returning the occluder NodePaths
+        """
+        self.resume_trace(self.border_tile_trace)
+        return self.close_trace()
+
+    def empty_mesh(self):
+        # The mesh the occluders are added to, under border_np
+        vertex_data = GeomVertexData('occluders', GeomVertexFormat.getV3n3(), Geom.UHStatic)
+        geom = Geom(vertex_data)
+        geom.addPrimitive(GeomTriangles(Geom.UHStatic))
+        occluder_node = GeomNode('occluders')
+        occluder_node.addGeom(geom)
+        return self.border_np.attachNewNode(occluder_node)
+
+    def add_occluder(self, stakes):
+        """
+        Adds the occluder staked out to the single mesh drawing them all, only where no
+        earlier one already covers, so where margins overlap nothing is drawn twice, and
+        with the corners it shares with them welded into one vertex
+        """
+        self.occluder_polys.append([(p.x, p.y) for p in stakes])
+        poly = np.array(self.occluder_polys[-1])
+        poly = poly if signed_area(poly) > 0 else poly[::-1]
+        low, high = poly.min(axis=0), poly.max(axis=0)
+        buckets = [(bx, by) for bx in range(*self.bucket_range(low[0], high[0]))
+                   for by in range(*self.bucket_range(low[1], high[1]))]
+        pieces = [poly]
+        for j in sorted({j for bucket in buckets for j in self.occluder_buckets.get(bucket, ())}):
+            earlier = self.drawn_polys[j]
+            if (earlier.min(axis=0) < high).all() and (earlier.max(axis=0) > low).all():
+                pieces = [piece for part in pieces for piece in subtract(part, earlier)]
+        for bucket in buckets:
+            self.occluder_buckets.setdefault(bucket, []).append(len(self.drawn_polys))
+        self.drawn_polys.append(poly)
+
+        # a triangle fan of each (convex) piece, over the welded corners
+        geom = self.occluder_np.node().modifyGeom(0)
+        vertex_data = geom.modifyVertexData()
+        vertex = GeomVertexWriter(vertex_data, 'vertex')
+        normal = GeomVertexWriter(vertex_data, 'normal')
+        vertex.setRow(vertex_data.getNumRows())
+        normal.setRow(vertex_data.getNumRows())
+        triangles = geom.modifyPrimitive(0)
+        for piece in pieces:
+            corners = []
+            for x, y in piece:
+                key = (round(x / WELD_TOL), round(y / WELD_TOL))
+                if key not in self.welded:
+                    self.welded[key] = len(self.welded)
+                    vertex.addData3(x, y, self.z_off)
+                    normal.addData3(0, 0, 1)
+                corners.append(self.welded[key])
+            for t in range(1, len(corners) - 1):
+                triangles.addVertices(corners[0], corners[t], corners[t + 1])
+
+    @staticmethod
+    def bucket_range(low, high):
+        return int(np.floor(low / OCCLUDER_BUCKET)), int(np.floor(high / OCCLUDER_BUCKET)) + 1
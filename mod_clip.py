@@ -0,0 +1,231 @@
+"""
+Clipping of the inner tiles against the outline of the border. Inner tiles, the
+duplicated ones especially, run under the border and beyond, where the occluder cards
+staked out from the border tile trace (see Border_Occluder) hide them by overdraw, so
+tiles entirely under the cards are still stored and drawn, as are those beyond them.
+
+Instead, each tile's footprint is tested against the outline, the closed polygon along
+the inner edge of the border trace (see Border_Occluder.inner_outline). Tiles wholly
+outside it are dropped, and those wholly inside kept as they are. Only the tiles across
+it have the occluders' polygons taken off their footprint: tiles left with nothing are
+dropped, and tiles left with part of their footprint have their prism replaced by
+prisms of what is left, convex pieces, as the tiles and the occluders are convex.
+
+    clipper = BorderClip(bord_occl.occluder_polys, bord_occl.inner_outline())
+    clip_tiles(inner_tile_nps, clipper)
+"""
+
+import numpy as np
+from tile_poly import TilePoly
+
+
+# pieces left smaller than this are just slivers
+MIN_AREA = 1e-4
+# where a footprint is, for the outline
+INSIDE, ACROSS, OUTSIDE = 0, 1, 2
+# footprints tested against the outline at once, to bound the memory of the tests
+SIDES_CHUNK = 8192
+
+
+def signed_area(poly):
+    x, y = poly[:, 0], poly[:, 1]
+    return (x * np.roll(y, -1) - np.roll(x, -1) * y).sum() / 2
+
+
+def cross_2D(o, a, b):
+    # z of (a - o) x (b - o), over the leading axes of o, a and b
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+
+def points_inside(points, poly):
+    """ Whether each of points ((..., 2) array) is inside the polygon poly, by the even-odd rule """
+    a, b = poly, np.roll(poly, -1, axis=0)
+    px, py = points[..., None, 0], points[..., None, 1]
+    straddles = (a[:, 1] > py) != (b[:, 1] > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = a[:, 0] + (py - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+    return (straddles & (px < x_cross)).sum(axis=-1) % 2 == 1
+
+
+def footprint_sides(corners, outline):
+    """
+    INSIDE, ACROSS or OUTSIDE the polygon outline, for each footprint of corners, an
+    (n, k, 2) array of them, padded by repeating their last corner
+    """
+    a, b = outline, np.roll(outline, -1, axis=0)
+    sides = np.empty(len(corners), dtype=int)
+    for start in range(0, len(corners), SIDES_CHUNK):
+        chunk = corners[start:start + SIDES_CHUNK]
+        inside = points_inside(chunk, outline)
+        # the edges of the footprints properly crossing edges of the outline
+        p, q = chunk[:, :, None], np.roll(chunk, -1, axis=1)[:, :, None]
+        crossing = ((cross_2D(a, b, p) * cross_2D(a, b, q) < 0) &
+                    (cross_2D(p, q, a) * cross_2D(p, q, b) < 0)).any(axis=(1, 2))
+        sides[start:start + SIDES_CHUNK] = np.where(
+            crossing | (inside.any(axis=1) & ~inside.all(axis=1)), ACROSS,
+            np.where(inside.all(axis=1), INSIDE, OUTSIDE))
+    return sides
+
+
+def clip_half_plane(poly, p, normal):
+    """ The part of the convex polygon poly on the side of the line through p which normal points to """
+    side = (poly - p) @ normal
+    if (side >= 0).all():
+        return poly
+    clipped = []
+    for i in range(len(poly)):
+        j = (i + 1) % len(poly)
+        if side[i] >= 0:
+            clipped.append(poly[i])
+        if (side[i] >= 0) != (side[j] >= 0):
+            t = side[i] / (side[i] - side[j])
+            clipped.append(poly[i] + t * (poly[j] - poly[i]))
+    clipped = np.array(clipped).reshape(-1, 2)
+    # without the repeated corners left where the line passes through one
+    if len(clipped):
+        repeated = (np.abs(clipped - np.roll(clipped, 1, axis=0)) < 1e-9).all(axis=1)
+        clipped = clipped[~repeated]
+    return clipped
+
+
+def subtract(poly, occluder):
+    """ Convex pieces of the convex polygon poly outside the convex, anti-clockwise, occluder """
+    pieces = []
+    for p, q in zip(occluder, np.roll(occluder, -1, axis=0)):
+        # the interior of an anti-clockwise polygon is left of each edge
+        outward = np.array([q[1] - p[1], p[0] - q[0]])
+        piece = clip_half_plane(poly, p, outward)
+        if len(piece) >= 3 and signed_area(piece) > MIN_AREA:
+            pieces.append(piece)
+        poly = clip_half_plane(poly, p, -outward)
+        if len(poly) < 3:
+            break
+    return pieces
+
+
+class BorderClip:
+    def __init__(self, occluder_polys, outline=None):
+        # Without an outline, as of a border not yet closed, every tile is taken to be
+        # across it, and only the occluders are taken off
+        self.outline = None if outline is None else np.asarray(outline, dtype=float)[:, :2]
+        # anti-clockwise, whichever way they were staked out
+        polys = [np.asarray(poly, dtype=float)[:, :2] for poly in occluder_polys]
+        self.polys = [poly if signed_area(poly) > 0 else poly[::-1] for poly in polys]
+        self.lows = np.array([poly.min(axis=0) for poly in self.polys]).reshape(-1, 2)
+        self.highs = np.array([poly.max(axis=0) for poly in self.polys]).reshape(-1, 2)
+
+    def overlapping(self, lows, highs):
+        """ For each of the bounds lows, highs ((n, 2) arrays), the occluders whose bounds it overlaps """
+        overlaps = [[] for _ in range(len(lows))]
+        for o, (low, high) in enumerate(zip(self.lows, self.highs)):
+            for ix in np.flatnonzero((lows < high).all(axis=1) & (highs > low).all(axis=1)):
+                overlaps[ix].append(o)
+        return overlaps
+
+    def sides(self, corners):
+        """ INSIDE, ACROSS or OUTSIDE the outline, for each footprint (see footprint_sides) """
+        if self.outline is None:
+            return np.full(len(corners), ACROSS)
+        return footprint_sides(corners, self.outline)
+
+    def clip(self, footprint, occluder_ixs):
+        """
+        The convex pieces of footprint, a convex polygon, left outside the occluders, or
+        None if none of them cuts it
+        """
+        pieces = [footprint]
+        for o in occluder_ixs:
+            pieces = [rest for piece in pieces for rest in subtract(piece, self.polys[o])]
+            if not pieces:
+                break
+        if len(pieces) == 1 and abs(signed_area(pieces[0]) - signed_area(footprint)) < MIN_AREA:
+            return None
+        return pieces
+
+
+def tile_footprints(tile_nps):
+    """ The footprint of each tile, its prism's polygon placed on the floor """
+    footprints = []
+    for tile_np in tile_nps:
+        xys = np.array(tile_np.find('+GeomNode').getPythonTag('xys'), dtype=float)
+        mat = tile_np.getMat(tile_np.getTop())
+        affine = np.array([[mat[i][j] for j in range(2)] for i in (0, 1, 3)])
+        footprints.append(np.column_stack([xys, np.ones(len(xys))]) @ affine)
+    return footprints
+
+
+def padded(footprints):
+    # the footprints as one (n, k, 2) array, each padded by repeating its last corner
+    k = max([len(footprint) for footprint in footprints], default=3)
+    return np.array([np.vstack([footprint, np.repeat(footprint[-1:], k - len(footprint), axis=0)])
+                     for footprint in footprints]).reshape(-1, k, 2)
+
+
+def bounds(footprints):
+    return (np.array([footprint.min(axis=0) for footprint in footprints]).reshape(-1, 2),
+            np.array([footprint.max(axis=0) for footprint in footprints]).reshape(-1, 2))
+
+
+def trim(tile_np, pieces):
+    # Replaces the tile's instance of its prototype prism by prisms of the pieces
+    prism_np = tile_np.find('+GeomNode')
+    mat = tile_np.getMat(tile_np.getTop())
+    affine = np.array([[mat[i][j] for j in range(2)] for i in (0, 1)])
+    origin = np.array([mat[3][0], mat[3][1]])
+    for piece in pieces:
+        local_xys = (piece - origin) @ np.linalg.inv(affine)
+        poly = TilePoly([tuple(xy) for xy in local_xys], prism_np.getPythonTag('face_color'))
+        piece_np = tile_np.attachNewNode(poly.node)
+        # the prototype's texture, if it has one
+        piece_np.node().setState(prism_np.node().getState())
+    prism_np.detachNode()
+
+
+def clip_tiles(tile_nps, clipper):
+    """
+    Drops the tiles of tile_nps entirely outside the border outline, removing them from
+    the list and the scene graph, and trims those crossing it. Returns those dropped or
+    trimmed.
+    """
+    footprints = tile_footprints(tile_nps)
+    sides = clipper.sides(padded(footprints))
+    kept, changed = [], []
+    for tile_np, footprint, side, occluder_ixs in zip(tile_nps, footprints, sides,
+                                                      clipper.overlapping(*bounds(footprints))):
+        if side == OUTSIDE:
+            pieces = []
+        elif side == ACROSS and occluder_ixs:
+            pieces = clipper.clip(footprint, occluder_ixs)
+        else:
+            pieces = None
+        if pieces is None:
+            kept.append(tile_np)
+            continue
+        if pieces:
+            trim(tile_np, pieces)
+            kept.append(tile_np)
+        else:
+            tile_np.removeNode()
+        changed.append(tile_np)
+    tile_nps[:] = kept
+    return changed
+
+
+def visible_copies(tile_nps, copies, clipper):
+    """
+    The copies (arrays of their indices into tile_nps and their offsets, as from
+    cumulative_copies) which aren't entirely outside the border outline. Copies drawn
+    instanced can't be trimmed, so those across it are kept whole, unless the occluders
+    cover them.
+    """
+    ixs, offsets = copies
+    footprints = tile_footprints(tile_nps)
+    sides = clipper.sides(padded(footprints)[ixs] + offsets[:, None, :2])
+    keep = sides != OUTSIDE
+    across = np.flatnonzero(sides == ACROSS)
+    lows, highs = bounds(footprints)
+    overlaps = clipper.overlapping(lows[ixs[across]] + offsets[across, :2], highs[ixs[across]] + offsets[across, :2])
+    for k, occluder_ixs in zip(across, overlaps):
+        if occluder_ixs:
+            keep[k] = clipper.clip(footprints[ixs[k]] + offsets[k, :2], occluder_ixs) != []
+    return ixs[keep], offsets[keep]
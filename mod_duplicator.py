@@ -1,136 +1,317 @@
 """
 Functions used to duplicate a group of tiles with inter-group spacing the same
-as the inter-tile spcing within the group.
+as the inter-tile spcing within the group, which is found from the periodic lattice
+the group's tiles are laid out on.
 """
 
-import math
+import numpy as np
+from panda3d.core import Vec3
 
 # from mod_key_move import DBP
 from mod_tiles import T_Evt
+from mod_layout import TILE_REACH
+from mod_telemetry import telemetry
 
 
 DBP = True
 # DBP = False
 
 
-def coord_fn(point, shift_dir, aligned):
+# Unit vector, in the floor's x and y, of each direction a group can be shifted in
+SHIFT_DIRS = {T_Evt.NORTH: (0, 1), T_Evt.SOUTH: (0, -1), T_Evt.EAST: (1, 0), T_Evt.WEST: (-1, 0)}
+
+
+class BucketIndex:
     """
-    Sort function which orders 2D property (tile position) in a 1D linear order
-    according to the desired shift direction, and whether or not the tiles are
-    aligned in the shift direction.
+    Tile positions hashed by the square bucket of side tol they fall in, so that whether
+    there are tiles within about tol of many points can be looked up at once. Each point
+    is looked up in its own bucket and the 8 around it, so as not to miss a tile just
+    across a bucket's edge.
     """
-    if shift_dir in [T_Evt.SOUTH, T_Evt.NORTH]:
-        if aligned:
-            return point.y
-        else:
-            return point.x
-    elif shift_dir in [T_Evt.EAST, T_Evt.WEST]:
-        if aligned:
-            return point.x
-        else:
-            return point.y
-    assert('Invalid shift direction')
+    # bits of each bucket coordinate, once offset to be positive
+    BITS = 24
+
+    def __init__(self, positions, tol):
+        self.tol = tol
+        self.keys = np.unique(self.encode(np.round(positions / tol).astype(np.int64)))
+
+    def encode(self, buckets):
+        offset = 1 << (self.BITS - 1)
+        return ((buckets[..., 0] + offset) << self.BITS) | (buckets[..., 1] + offset)
+
+    def contains(self, points):
+        buckets = np.round(points / self.tol).astype(np.int64)
+        found = np.zeros(points.shape[:-1], dtype=bool)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = self.encode(buckets + (dx, dy))
+                ixs = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+                found |= self.keys[ixs] == keys
+        return found
+
+
+def convex_hull(points):
+    """ Corners of the convex hull of points, anti-clockwise (Andrew's monotone chain) """
+    points = sorted(set(map(tuple, points)))
+    if len(points) < 3:
+        return np.array(points)
+
+    def half(points):
+        chain = []
+        for p in points:
+            while len(chain) >= 2 and ((chain[-1][0] - chain[-2][0]) * (p[1] - chain[-2][1]) -
+                                       (chain[-1][1] - chain[-2][1]) * (p[0] - chain[-2][0])) <= 0:
+                chain.pop()
+            chain.append(p)
+        return chain[:-1]
+    return np.array(half(points) + half(points[::-1]))
+
+
+def inside_hull(hull, points, margin):
+    """ Whether each of points is inside the convex hull by more than margin """
+    if len(hull) < 3:
+        return np.zeros(points.shape[:-1], dtype=bool)
+    edges = np.roll(hull, -1, axis=0) - hull
+    lengths = np.hypot(edges[:, 0], edges[:, 1])
+    rel = points[..., None, :] - hull
+    # distance of each point to the left of each edge
+    left = (edges[:, 0] * rel[..., 1] - edges[:, 1] * rel[..., 0]) / lengths
+    return (left > margin).all(axis=-1)
+
+
+class Lattice:
+    """
+    A 2D periodic lattice fitted to a group of tile positions: its origin, its basis (the
+    rows a and b), the motif (the offsets of the tiles within each cell, the first being
+    0) and each tile's cell, as (u, v, motif index) rows, so that tile k is at
+    origin + u a + v b + motif[m]
+    """
+    def __init__(self, origin, basis, motif, cells):
+        self.origin = origin
+        self.basis = basis
+        self.motif = motif
+        self.cells = cells
+
+    def vector(self, shift):
+        """ The lattice vector of shift, (u, v) whole cells, as a Vec3 """
+        x, y = np.asarray(shift[:2]) @ self.basis
+        return Vec3(x, y, 0)
+
+    def candidate_shifts(self, cells, shift_dir, tol):
+        """
+        Shifts, in whole cells, which move the group of cells forward in the direction
+        shift_dir, straying across it by no more than the lattice's own step across it
+        (as a diamond group of an odd number of rows must to the South), with how far
+        each moves along and across the direction
+        """
+        d = np.array(SHIFT_DIRS[shift_dir], dtype=float)
+        reach = int(np.ptp(cells[:, 0]) + np.ptp(cells[:, 1])) + 2
+        steps = np.arange(-reach, reach + 1)
+        shifts = np.stack(np.meshgrid(steps, steps), axis=-1).reshape(-1, 2)
+        vectors = shifts @ self.basis
+        along = vectors @ d
+        across = vectors @ (-d[1], d[0])
+        off_line = np.abs(across) > tol
+        step = np.abs(across[off_line]).min() if off_line.any() else 0.0
+        forward = (along > tol) & (np.abs(across) <= step + tol)
+        return shifts[forward], np.round(along[forward] / tol), np.round(across[forward] / tol)
+
+    def tiling_shifts(self, cells, first_dir, second_dir, tol=1e-2):
+        """
+        The shifts, in whole cells, in the directions first_dir and second_dir, repeated
+        by which the group of cells tiles the floor seamlessly, each as straight and then
+        as short as can be, or None if the group can't tile the floor
+        """
+        motifs = cells[:, 2].max() + 1
+        area, rest = divmod(len(cells), motifs)
+        if rest:
+            return None
+        keys = np.sort(self.cell_keys(cells))
+        firsts, along, across = self.candidate_shifts(cells, first_dir, tol)
+        firsts = firsts[np.lexsort((across, along, np.abs(across)))]
+        seconds, along, across = self.candidate_shifts(cells, second_dir, tol)
+        seconds = seconds[np.lexsort((across, along, np.abs(across)))]
+        for first in firsts:
+            if not self.clears(keys, first):
+                continue
+            dets = first[0] * seconds[:, 1] - first[1] * seconds[:, 0]
+            for second in seconds[np.abs(dets) == area]:
+                if self.tiles(cells, first, second):
+                    return first, second
+        return None
+
+    @staticmethod
+    def tiles(cells, first, second):
+        # The cells tile the floor, repeated by first and second, if they fill the cell of
+        # the two shifts, holding as many of them as the group does, without overlapping,
+        # as no two of the same motif are the same modulo the shifts. (u, v) = x first +
+        # y second, and the fractions of x and y, times the determinant, tell them apart.
+        det = abs(first[0] * second[1] - first[1] * second[0])
+        xs = cells[:, 0] * second[1] - cells[:, 1] * second[0]
+        ys = first[0] * cells[:, 1] - first[1] * cells[:, 0]
+        cosets = np.column_stack([xs % det, ys % det, cells[:, 2]])
+        return len(np.unique(cosets, axis=0)) == len(cells)
+
+    def shift(self, cells, shift_dir, tol=1e-2):
+        """
+        The shortest shift, in whole cells, in the direction shift_dir, which moves the
+        group of cells clear of itself, for a group which can't tile the floor
+        """
+        shifts, along, across = self.candidate_shifts(cells, shift_dir, tol)
+        keys = np.sort(self.cell_keys(cells))
+        for shift in shifts[np.lexsort((across, np.abs(across), along))]:
+            if self.clears(keys, shift):
+                return shift
+        raise ValueError('no %s shift clears the group' % shift_dir.name)
+
+    @staticmethod
+    def clears(keys, shift):
+        """ Whether shift moves the group of cells, whose sorted keys are keys, clear of itself """
+        # keys are linear in the cells, so shifting the cells just adds to their keys
+        moved = keys + (int(shift[0]) << 42) + (int(shift[1]) << 22)
+        found = np.searchsorted(keys, moved).clip(max=len(keys) - 1)
+        return not (keys[found] == moved).any()
+
+    @staticmethod
+    def cell_keys(cells):
+        # cells are small integers, well within 20 bits each
+        offset = 1 << 19
+        return ((cells[:, 0] + offset) << 42) | ((cells[:, 1] + offset) << 22) | cells[:, 2]
+
+
+def infer_lattice(positions, tol=1e-2, refs=4, neighbours=12, consistency=0.9, stray=0.1, refits=4):
+    """
+    Infers the 2D periodic lattice of the tiles at positions (rows of x, y and
+    optionally z). Candidate lattice vectors are the shortest differences between the
+    tiles nearest the middle of the group and the rest. A candidate is a lattice vector if
+    it moves nearly all the tiles (consistency) that it doesn't move out of the group
+    onto tiles, as found by hashing the positions in buckets of side tol. The basis is
+    the shortest of them and the shortest not parallel to it. The tiles are then given
+    cells, and the motif and basis are fitted to their positions by least squares, leaving
+    out the tiles which settled further than stray off the lattice, as the pusher can
+    leave one, in at most refits passes.
+    """
+    points = np.asarray(positions, dtype=float)[:, :2]
+    index = BucketIndex(points, tol)
+    # enough of the tiles to tell lattice vectors from the rest
+    sample = points[::max(1, len(points) // 2000)]
+    hull = convex_hull(sample)
+
+    middle = np.argsort(np.hypot(*(points - points.mean(axis=0)).T))[:refs]
+    diffs = (points[None, :, :] - points[middle, None, :]).reshape(-1, 2)
+    lengths = np.hypot(*diffs.T)
+    diffs, lengths = diffs[lengths > tol], lengths[lengths > tol]
+    nearest = np.argsort(lengths)[:refs * neighbours]
+    # the same difference, found from several tiles, only once
+    _, first = np.unique(np.round(diffs[nearest] / tol), axis=0, return_index=True)
+    candidates = diffs[nearest[np.sort(first)]]
+
+    moved = sample[None, :, :] + candidates[:, None, :]
+    hits = index.contains(moved).sum(axis=1)
+    misses = (~index.contains(moved) & inside_hull(hull, moved, tol)).sum(axis=1)
+    vectors = candidates[(hits > 0) & (hits >= consistency * (hits + misses))]
+    vectors = vectors[np.argsort(np.hypot(*vectors.T), kind='stable')]
+    if not len(vectors):
+        raise ValueError('no lattice among %d tiles' % len(points))
+    a = vectors[0]
+    crosses = a[0] * vectors[:, 1] - a[1] * vectors[:, 0]
+    not_parallel = np.abs(crosses) > tol * np.hypot(*a)
+    if not not_parallel.any():
+        raise ValueError('the %d tiles are in a line, not a 2D lattice' % len(points))
+    b = vectors[np.argmax(not_parallel)] * np.sign(crosses[np.argmax(not_parallel)])
+    basis = np.array([a, b])
+
+    # Cells, rounding to the nearest, and motif, clustering what is left over within half
+    # the distance between the nearest tiles. Rounding tolerates the error in the basis
+    # building up across the group, which fitting both to all the tiles then removes.
+    nearest_tile = lengths.min()
+    fracs = (points - points[middle[0]]) @ np.linalg.inv(basis)
+    uvs = np.round(fracs)
+    offsets = (fracs - uvs) @ basis
+    motif_ixs = np.full(len(points), -1)
+    for k in range(len(points)):
+        if motif_ixs[k] < 0:
+            close = np.hypot(*(offsets - offsets[k]).T) <= nearest_tile / 2
+            motif_ixs[close & (motif_ixs < 0)] = motif_ixs.max() + 1
+    motifs = motif_ixs.max() + 1
+    on_lattice = np.ones(len(points), dtype=bool)
+    for _ in range(refits):
+        origin, basis, motif = fit_lattice(points[on_lattice], uvs[on_lattice], motif_ixs[on_lattice], motifs)
+        # again, with each tile's cell found from its own motif offset, leaving out all
+        # the tiles further off the lattice than stray, whose error least squares would
+        # otherwise spread over the rest, until none left in are. A tile well off can
+        # pull the fit far enough to put others off too, so if leaving them all out
+        # would leave out more than a quarter of the tiles, just the furthest is.
+        fracs = (points - origin - motif[motif_ixs]) @ np.linalg.inv(basis)
+        uvs = np.round(fracs)
+        off = np.hypot(*((fracs - uvs) @ basis).T) * on_lattice
+        strays = off > stray
+        if not strays.any():
+            break
+        if (on_lattice & ~strays).sum() < 3 * len(points) / 4:
+            if on_lattice.sum() - 1 < 3 * len(points) / 4:
+                break
+            strays = off == off.max()
+        on_lattice &= ~strays
+    origin, basis, motif = fit_lattice(points[on_lattice], uvs[on_lattice], motif_ixs[on_lattice], motifs)
+    return Lattice(origin, basis, motif, np.column_stack([uvs.astype(np.int64), motif_ixs]))
+
+
+def fit_lattice(points, uvs, motif_ixs, motifs):
+    # origin, basis and motif, by least squares, of points = origin + u a + v b + motif offset
+    design = np.column_stack([np.ones(len(points)), uvs] +
+                             [motif_ixs == m for m in range(1, motifs)]).astype(float)
+    fit = np.linalg.lstsq(design, points, rcond=None)[0]
+    return fit[0], fit[1:3], np.vstack([np.zeros(2), fit[3:]])
+
+
+def tile_positions(tile_nps):
+    return np.array([tuple(tile_np.getPos()) for tile_np in tile_nps])
 
 
 def calc_repeat_shift(shift_dir, settled_tile_nps):
     """
     Calculates the shift to apply to a group of tiles in the desired direction,
-    North, South, East, or West
-    Able to work both with groups which are aligned in the shift direction, like this
+    North, South, East, or West, from the lattice they are laid out on (see
+    infer_lattice). Able to work both with groups which are aligned in the shift
+    direction, like this
     [ ][ ][ ]
     [ ][ ][ ]
     or not aligned, but in a diamond pattern, like this
     X  X  X  X
      X  X  X  X
     """
-    rvs_sort = False if shift_dir in [T_Evt.SOUTH, T_Evt.WEST] else True
-
-    shift_aligned = sorted(settled_tile_nps,
-                           key=lambda tile: coord_fn(tile.getPos(), shift_dir, aligned=False),
-                           reverse=rvs_sort)
-
-    grid_rank_list = []
-    matched_rank_ix = None
-    final_rank_ix = None
-    last_tile_sort = None
-    close_sort_ix = None
-    # There are two types of search going on in this loop. The first is just
-    # a close grouped sequence where the tiles start off all aligned in the
-    # shift direction. If that is observed it takes priority and the loop
-    # breaks as soon as the alignment ceases. The second is where they're
-    # never aligned in the shift direction but typically zig-zag. Then the
-    # loop breaks when a tile is found whose co-ordinate in the shift
-    # direction, its grid_rank, matches an earlier tile.
-    for i, tile in enumerate(shift_aligned):
-        if DBP: print(i, tile.getPos())
-
-        # Search for close grouped sequence
-        tile_sort = coord_fn(tile.getPos(), shift_dir, aligned=False)
-        if last_tile_sort is not None:
-            if math.isclose(tile_sort, last_tile_sort, abs_tol=1e-02):
-                # Looking for a close grouped sequence at the start
-                close_sort_ix = i
-            else:
-                if close_sort_ix is not None:
-                    # A close grouped sequence began but has now terminated.
-                    # If it exists then this takes priority and we stop looking
-                    # for a matched rank.
-                    break
-        last_tile_sort = tile_sort
-
-        # Search for matching grid rank
-        tile_rank = coord_fn(tile.getPos(), shift_dir, aligned=True)
-        for rank_ix, rank in enumerate(grid_rank_list):
-            if DBP: print(rank_ix, rank, tile_rank, matched_rank_ix, grid_rank_list)
-            if math.isclose(tile_rank, rank, abs_tol=1e-02):
-                matched_rank_ix = rank_ix
-                break
-        grid_rank_list.append(tile_rank)
-        if matched_rank_ix is not None:
-            final_rank_ix = i
-            break
+    lattice = infer_lattice(tile_positions(settled_tile_nps))
+    across_dir = T_Evt.SOUTH if shift_dir in [T_Evt.EAST, T_Evt.WEST] else T_Evt.EAST
+    tiling = lattice.tiling_shifts(lattice.cells, shift_dir, across_dir)
+    shift = tiling[0] if tiling is not None else lattice.shift(lattice.cells, shift_dir)
+    return lattice.vector(shift)
+
 
-    if close_sort_ix is not None:
-        # Just use the in-line points in the initial close grouped sequence
-        # which should pre-empt any matching grid rank
-        final_rank_ix = close_sort_ix + 1
-        matched_rank_ix = 0
-
-    # We expect to terminate on one or the other types of search
-    reduced_aligned = shift_aligned[:final_rank_ix]
-
-    # Order the points so we can create a chain of consecutive vectors whose sum,
-    # head to toe, amounts to the last point minus the first point
-    rear_most = sorted(reduced_aligned,
-                       key=lambda tile: coord_fn(tile.getPos(), shift_dir, aligned=True),
-                       reverse=(not rvs_sort))
-    if DBP:
-        print('first', rear_most[0].getPos())
-        print('last', rear_most[-1].getPos())
-        print('matched', shift_aligned[final_rank_ix].getPos())
-        print('common', rear_most[matched_rank_ix + 1].getPos())
-
-    # Generate a preliminary shift vector in the desired direction
-    forward = rear_most[-1].getPos() - rear_most[0].getPos()
-    # Test if it is aligned to the shift direction
-    if math.isclose(coord_fn(forward, shift_dir, aligned=False), 0.0, abs_tol=1e-02):
-        # rectilinear pattern, or in-line diagonals: ignore matched point
-        matched_origin = rear_most[matched_rank_ix].getPos()
+def repeat_shifts(positions, east_times=1):
+    """
+    The shift of the group of tiles at positions to the East, and the shift to the South
+    of the group it makes repeated east_times to the East, as cumulative_dups repeats it,
+    from a single inference of their lattice. If the group tiles the floor, the two are
+    found together, so that repeating it by both leaves no gaps.
+    """
+    lattice = infer_lattice(positions)
+    tiling = lattice.tiling_shifts(lattice.cells, T_Evt.EAST, T_Evt.SOUTH)
+    if tiling is not None:
+        east, south = tiling
     else:
-        # non-rectilinear, probably diagonal: use matched point
-        matched_origin = shift_aligned[final_rank_ix].getPos()
-    common = rear_most[matched_rank_ix + 1].getPos()
-    delta = common - matched_origin
-    shift = forward + delta
-    return shift
+        # the group can't tile the floor, so each repeat just clears the last
+        east = lattice.shift(lattice.cells, T_Evt.EAST)
+        repeated = np.concatenate([lattice.cells + (*(east * i), 0) for i in range(east_times + 1)])
+        south = lattice.shift(repeated, T_Evt.SOUTH)
+    return lattice.vector(east), lattice.vector(south)
 
 
-def repeat_tiles(num_times, dir, settled_tile_nps):
+def repeat_tiles(num_times, shift, settled_tile_nps):
     """
-    Duplicates a group of tiles num_times over in direction dir.
+    Duplicates a group of tiles num_times over, shifted by shift each time.
     """
-    shift = calc_repeat_shift(dir, settled_tile_nps)
-    print('shift', shift)
+    if DBP and telemetry.enabled: telemetry.debug('shift', shift)
     repeated_tiles = []
     for tile in settled_tile_nps:
         for i in range(num_times):
@@ -141,14 +322,88 @@ def repeat_tiles(num_times, dir, settled_tile_nps):
     return repeated_tiles
 
 
-def cumulative_dups(settled_tile_nps):
+def cumulative_dups(settled_tile_nps, east_times=1, south_times=8):
     """
     Duplicates the group settled_tile_nps 1 times to the East to form a new
     group which itself is then duplicated 8 times to the South. Hence the
     original supplied group is duplicated a total of (1 + 1) x (1 + 8) = 18
     times.
     """
-    repeated_tile_nps = repeat_tiles(1, T_Evt.EAST, settled_tile_nps)
+    east_shift, south_shift = repeat_shifts(tile_positions(settled_tile_nps), east_times)
+    repeated_tile_nps = repeat_tiles(east_times, east_shift, settled_tile_nps)
+    settled_tile_nps.extend(repeated_tile_nps)
+    repeated_tile_nps = repeat_tiles(south_times, south_shift, settled_tile_nps)
+    settled_tile_nps.extend(repeated_tile_nps)
+
+
+def repeat_copies(num_times, shift, ixs, offsets):
+    """
+    Like repeat_tiles, but of copies, as arrays of their indices into the group and
+    their offsets, and only returning the arrays of the repeated copies rather than
+    making them.
+    """
+    if DBP and telemetry.enabled: telemetry.debug('shift', shift)
+    steps = np.arange(1, num_times + 1)
+    repeated = offsets[:, None, :] + steps[None, :, None] * np.array(shift)
+    return np.repeat(ixs, num_times), repeated.reshape(-1, 3)
+
+
+def cumulative_copies(settled_tile_nps, east_times=1, south_times=8):
+    """
+    The copies cumulative_dups would make of the group settled_tile_nps, in the
+    order it would make them, as arrays of their indices into settled_tile_nps and
+    their offsets, for drawing instanced rather than as copied tiles (see
+    mod_instancing).
+    """
+    east_shift, south_shift = repeat_shifts(tile_positions(settled_tile_nps), east_times)
+    ixs, offsets = np.arange(len(settled_tile_nps)), np.zeros((len(settled_tile_nps), 3))
+    east_ixs, east_offsets = repeat_copies(east_times, east_shift, ixs, offsets)
+    south_ixs, south_offsets = repeat_copies(south_times, south_shift, np.concatenate([ixs, east_ixs]),
+                                             np.concatenate([offsets, east_offsets]))
+    return np.concatenate([east_ixs, south_ixs]), np.concatenate([east_offsets, south_offsets])
+
+
+def fill_copies(settled_tile_nps, floor, reach=TILE_REACH):
+    """
+    The copies of the group settled_tile_nps, repeated over the lattice of its East and
+    South shifts, which reach onto the floor, a Surface, as arrays of their indices into
+    settled_tile_nps and their offsets. Only the repeats whose bounds reach onto it are
+    looked at, so the work goes with the area of the floor, rather than a repeat count.
+    """
+    positions = tile_positions(settled_tile_nps)
+    shifts = np.array(repeat_shifts(positions))[:, :2]
+    points = positions[:, :2]
+    low, high = points.min(axis=0) - reach, points.max(axis=0) + reach
+    # The offsets which bring the group's bounds onto the floor make a box, whose
+    # corners, in repeats of the shifts, bound the repeats needed
+    corners = np.array([[x, y] for x in (floor.x0 - high[0], floor.x1 - low[0])
+                        for y in (floor.y0 - high[1], floor.y1 - low[1])])
+    repeats = corners @ np.linalg.inv(shifts)
+    first, last = np.floor(repeats.min(axis=0)).astype(int), np.ceil(repeats.max(axis=0)).astype(int)
+    ks, ls = np.meshgrid(np.arange(first[0], last[0] + 1), np.arange(first[1], last[1] + 1))
+    kls = np.column_stack([ks.ravel(), ls.ravel()])
+    kls = kls[(kls != 0).any(axis=1)]
+    offsets = kls @ shifts
+
+    # just the copies of tiles reaching onto the floor
+    moved = points[None, :, :] + offsets[:, None, :]
+    onto = ((moved[..., 0] + reach >= floor.x0) & (moved[..., 0] - reach <= floor.x1) &
+            (moved[..., 1] + reach >= floor.y0) & (moved[..., 1] - reach <= floor.y1))
+    repeat_ixs, ixs = np.nonzero(onto)
+    if DBP and telemetry.enabled: telemetry.debug('fill', len(kls), 'repeats', len(ixs), 'copies')
+    return ixs, np.column_stack([offsets[repeat_ixs], np.zeros(len(ixs))])
+
+
+def fill_dups(settled_tile_nps, floor):
+    """
+    Duplicates the group settled_tile_nps just as many times, and just where, needed
+    to cover the floor, a Surface (see fill_copies).
+    """
+    ixs, offsets = fill_copies(settled_tile_nps, floor)
+    repeated_tile_nps = []
+    for ix, offset in zip(ixs, offsets):
+        tile = settled_tile_nps[ix]
+        copy_np = tile.copyTo(render)
+        copy_np.setPos(tile.getPos() + Vec3(*offset))
+        repeated_tile_nps.append(copy_np)
     settled_tile_nps.extend(repeated_tile_nps)
-    repeated_tile_nps = repeat_tiles(8, T_Evt.SOUTH, settled_tile_nps)
-    settled_tile_nps.extend(repeated_tile_nps)
\ No newline at end of file
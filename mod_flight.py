@@ -0,0 +1,188 @@
+"""
+Per-tile laying state for the tiles in flight in MyApp.spinPrismTask, and a scheduler
+which releases the next tiles of a TileDispenser schedule while earlier ones are still
+in flight, as long as they can't interact.
+
+A flung tile travels along each leg of its trajectory until it hits something. Where it
+comes to rest, and the box its collision spheres sweep on the way, is worked out before
+it is released by the analytic solver (see mod_settle), among the cushions up then. The
+tiles still in flight haven't put up their cushions yet, but as long as the box (plus
+FLIGHT_MARGIN) keeps clear of theirs, it couldn't meet them anyway. So tiles whose boxes
+don't overlap can't collide with each other, nor with the cushions each other leaves
+behind when settling, and can be flung at the same time.
+
+A tile passed over, as it isn't clear, may not end up where it was worked out to, so the
+tiles after it must keep clear of anywhere it could go, in the directions it travels in.
+Tiles with an event put up, or take down, an internal border across the whole surface,
+so their boxes are widened across it too, and they are released in their order.
+"""
+
+import numpy as np
+
+from mod_settle import tile_spheres
+from mod_tiles import KINDS, T_Evt, Tiles
+from tile_poly import collider_pool
+
+
+# Allowance around the box a tile's spheres sweep, for the cushions it puts up round
+# itself when it settles, and for the pusher not quite following the solver
+FLIGHT_MARGIN = 0.5
+INF = float('inf')
+
+# the internal borders events put up, across the surface in y, or in x
+ACROSS_Y = [T_Evt.EAST, T_Evt.EA_PT, T_Evt.WEST, T_Evt.WE_PT]
+ACROSS_X = [T_Evt.NORTH, T_Evt.NO_PT, T_Evt.SOUTH, T_Evt.SO_PT]
+
+
+class FlungTile:
+    """
+    A tile in flight, with its trajectory and how far through it it has got,
+    which used to be held on MyApp for the one tile that could be in flight
+    """
+    def __init__(self, tile, trajectory, use_short_cushion, event, region=None):
+        self.tile = tile
+        self.trajectory = trajectory
+        self.use_short_cushion = use_short_cushion
+        self.event = event
+        # boxes (x_lo, x_hi, y_lo, y_hi) of what it can reach
+        self.region = region
+
+        # hit threshold before deceleration starts depends on number of velocity changes
+        self.hit_threshold = len(trajectory)
+        self.velocity = None
+        self.hit_count = 0
+        self.trigger = True
+        self.sunk = False
+        self.count_down = 0
+        # come to rest, but waiting for the tiles released before it to settle
+        self.at_rest = False
+
+        # for the telemetry: frames flown, and the traverser time spent on it
+        self.frames = 0
+        self.traverse_s = 0.0
+
+    def launch(self, count_threshold):
+        # Velocity defined in units per frame intervals (of 1 /60 th second)
+        self.velocity = self.trajectory.pop(0)
+        self.count_down = count_threshold
+
+    def hit(self):
+        if self.trajectory:
+            self.velocity = self.trajectory.pop(0)
+        self.hit_count += 1
+
+
+def unbounded_region(tile_spec, box):
+    """ box, unbounded in the directions a scheduled tile travels in """
+    x_lo, x_hi, y_lo, y_hi = box
+    for leg_x, leg_y, _ in tile_spec['traj'][:tile_spec['n']]:
+        if leg_x < 0: x_lo = -INF
+        if leg_x > 0: x_hi = INF
+        if leg_y < 0: y_lo = -INF
+        if leg_y > 0: y_hi = INF
+    return x_lo, x_hi, y_lo, y_hi
+
+
+def overlapping(region1, region2):
+    return any(box1[0] < box2[1] and box2[0] < box1[1] and box1[2] < box2[3] and box2[2] < box1[3]
+               for box1 in region1 for box2 in region2)
+
+
+class FlightScheduler:
+    """
+    Releases tiles from a TileDispenser schedule for as long as each can't interact with
+    any tile still in flight, nor with any tile ahead of it in the schedule, so that a
+    later stretch of the schedule can be flown alongside an earlier one. Looks at most
+    lookahead tiles ahead, and releases up to max_in_flight at a time. The paths are
+    worked out by solver, among the cushions of floor.
+    """
+    def __init__(self, solver, floor, max_in_flight=4, lookahead=8):
+        self.solver = solver
+        self.floor = floor
+        self.max_in_flight = max_in_flight
+        self.lookahead = lookahead
+        # (kind, phase) -> offsets and radii of its tiles' collision spheres
+        self.spheres = {}
+        # schedule record -> the cushions' version and the box its tile's path was worked
+        # out among, which holds until a cushion changes in it
+        self.boxes = {}
+        self.tile_dispatcher = None
+
+    def tile_spheres(self, kind, phase):
+        # Offsets from a tile made just for them, as they only depend on its kind and phase
+        if (kind, phase) not in self.spheres:
+            probe = getattr(Tiles, KINDS[kind])((0, 0, 0), 'probe', phase)
+            self.spheres[kind, phase] = tile_spheres(probe)
+            collider_pool.recycle(probe)
+            probe.np.removeNode()
+        return self.spheres[kind, phase]
+
+    def path_box(self, tile_dispatcher, ix, unsettled):
+        # The box a scheduled tile sweeps (x_lo, x_hi, y_lo, y_hi), plus the margin. One
+        # worked out before cushions changed in it still holds while it meets a tile yet
+        # to settle, as it would have to be worked out again once that one has anyway.
+        cushions = self.floor.cushions
+        i = tile_dispatcher.record_ix(ix)
+        if i in self.boxes:
+            version, box = self.boxes[i]
+            if not cushions.changed_within(version, box[0], box[2], box[1], box[3]):
+                return box
+            if any(overlapping([box], other) for other in unsettled):
+                return box
+        kind, phase, xyz, n, traj, _, _, _ = tile_dispatcher.schedule[i].item()
+        offsets, radii = self.tile_spheres(kind, phase)
+        legs = [np.array(leg) for leg in traj[:n].tolist()]
+        _, (low, high) = self.solver.solve(np.array(xyz.tolist()), legs, offsets, radii, cushions)
+        box = (low[0] - FLIGHT_MARGIN, high[0] + FLIGHT_MARGIN, low[1] - FLIGHT_MARGIN, high[1] + FLIGHT_MARGIN)
+        self.boxes[i] = (cushions.version(), box)
+        return box
+
+    def event_boxes(self, event, box):
+        # The internal border an event puts up, or takes down, as boxes
+        floor = self.floor
+        pad = floor.grout_wd + abs(floor.offset) + floor.cushion_rad
+        if event in ACROSS_Y:
+            return [(box[0] - pad, box[1] + pad, -INF, INF)]
+        if event in ACROSS_X:
+            return [(-INF, INF, box[2] - pad, box[3] + pad)]
+        if event == T_Evt.REMOVE and floor.last_attached_node:
+            # the last one put up, as no event is released before those ahead of it settle
+            solid = floor.last_attached_node.node().getSolid(0)
+            a, b, r = solid.point_a, solid.point_b, solid.radius
+            return [(min(a.x, b.x) - r, max(a.x, b.x) + r, min(a.y, b.y) - r, max(a.y, b.y) + r)]
+        return []
+
+    def release(self, tile_dispatcher, in_flight):
+        if tile_dispatcher is not self.tile_dispatcher:
+            self.tile_dispatcher = tile_dispatcher
+            self.boxes = {}
+        # regions of the tiles in flight and of those passed over, which released
+        # tiles must keep clear of
+        unsettled = [flight.region for flight in in_flight]
+        event_unsettled = any(flight.event != T_Evt.NONE for flight in in_flight)
+        release_ixs = []
+        regions = []
+        for ix in range(min(self.lookahead, tile_dispatcher.tiles_left())):
+            if len(in_flight) + len(release_ixs) >= self.max_in_flight:
+                break
+            tile_spec = tile_dispatcher.peek(ix)
+            event = T_Evt(int(tile_spec['event']))
+            box = self.path_box(tile_dispatcher, ix, unsettled)
+            region = [box] + self.event_boxes(event, box)
+            clear = not any(overlapping(region, other) for other in unsettled)
+            if event != T_Evt.NONE:
+                # each may take down the last internal border the one before put up
+                clear = clear and not event_unsettled
+                event_unsettled = True
+            if clear:
+                release_ixs.append(ix)
+                regions.append(region)
+                unsettled.append(region)
+            else:
+                unsettled.append([unbounded_region(tile_spec, box)] + region[1:])
+
+        released = []
+        for popped, (ix, region) in enumerate(zip(release_ixs, regions)):
+            self.boxes.pop(tile_dispatcher.record_ix(ix - popped), None)
+            released.append(FlungTile(*tile_dispatcher.popup(ix - popped), region=region))
+        return released
@@ -0,0 +1,34 @@
+"""
+Lays the border and inner tiles without a window, for regenerating layouts where there is
+no display (CI, render farm). Tiles are flung, pushed and settled by exactly the same
+tasks as in mod_key_move, but the task manager is stepped back to back rather than at the
+frame rate, and the finished layout is stashed as soon as the inner tiles have been laid.
+With the analytic engine the tiles aren't flung at all, but placed where mod_settle
+solves that they would come to rest. With --resume, a run which died carries on from its
+last checkpoint.
+
+    python mod_headless.py [layout_path] [pusher|analytic] [--resume]
+"""
+import sys
+from panda3d.core import loadPrcFileData
+
+
+def lay_headless(layout_path='zoo.npz', engine='pusher', resume=False):
+    # No sound either, so that no audio device is needed
+    loadPrcFileData('headless', 'audio-library-name null')
+    from mod_key_move import MyApp
+
+    app = MyApp(headless=True, layout_path=layout_path, engine=engine, resume=resume)
+    while not app.laid:
+        app.taskMgr.step()
+    return app
+
+
+if __name__ == '__main__':
+    resume = '--resume' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--resume']
+    layout_path = args[0] if len(args) > 0 else 'zoo.npz'
+    engine = args[1] if len(args) > 1 else 'pusher'
+    app = lay_headless(layout_path, engine, resume)
+    print('laid', len(app.border_tile_nps), 'border tiles and', len(app.inner_tile_nps),
+          'inner tiles into', layout_path)
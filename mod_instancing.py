@@ -0,0 +1,168 @@
+"""
+Hardware instanced drawing of a group of tiles and the copies of it that cumulative_dups
+would make (or that fill_copies finds cover the floor). Rather than copying every
+tile's NodePath, instancing its prototype prism, 18 times, only the offsets of the
+copies are found (cumulative_copies), and each prototype prism in the group is drawn
+once per tile of it, original or copy, by a single instanced draw call.
+
+Each instance's transform, the tile's own transform relative to the parent followed by
+its copy's offset, is a row of 4 texels in a buffer texture, which the shader fetches
+by gl_InstanceID. So the memory and draw calls don't grow with the repeat counts, only
+the buffers do, by 64 bytes an instance. A buffer texture holds at least 65536 texels,
+so at least 16384 instances, or as many more as the GSG says it can hold; a prototype
+with more instances than that is drawn by several instanced nodes, each with its own
+buffer.
+
+The tiles of the group itself are stashed, so that they still have their positions (for
+stashing the layout, say) but aren't drawn twice.
+"""
+
+import numpy as np
+from panda3d.core import BoundingBox, GeomEnums, Point3, Shader, Texture
+
+
+# Texels every buffer texture can hold (GL_MAX_TEXTURE_BUFFER_SIZE is at least this)
+MIN_BUFFER_TEXELS = 65536
+
+INSTANCE_VERT = """
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+uniform samplerBuffer instances;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec4 p3d_Color;
+
+out vec3 eye_pos;
+out vec3 eye_normal;
+out vec4 color;
+
+void main() {
+    int row = gl_InstanceID * 4;
+    mat4 instance = mat4(texelFetch(instances, row), texelFetch(instances, row + 1),
+                         texelFetch(instances, row + 2), texelFetch(instances, row + 3));
+    vec4 pos = instance * p3d_Vertex;
+    gl_Position = p3d_ModelViewProjectionMatrix * pos;
+    eye_pos = vec3(p3d_ModelViewMatrix * pos);
+    // tiles are only ever scaled alike in x and y, and their normals are either
+    // horizontal or vertical, so the instance's own rotation and scale will do
+    eye_normal = normalize(p3d_NormalMatrix * normalize(mat3(instance) * p3d_Normal));
+    color = p3d_Color;
+}
+"""
+
+INSTANCE_FRAG = """
+#version 150
+
+uniform sampler2D p3d_Texture0;
+uniform struct {
+    vec4 ambient;
+} p3d_LightModel;
+uniform struct {
+    vec4 color;
+    vec4 position;
+} p3d_LightSource[1];
+
+in vec3 eye_pos;
+in vec3 eye_normal;
+in vec4 color;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    // the prisms have no texture coordinates, so are tinted by the texture's first texel
+    vec4 base = color * texture(p3d_Texture0, vec2(0, 0));
+    vec4 light = p3d_LightSource[0].position;
+    vec3 to_light = normalize(light.xyz - eye_pos * light.w);
+    float diffuse = max(dot(normalize(eye_normal), to_light), 0.0);
+    vec3 lit = p3d_LightModel.ambient.rgb + p3d_LightSource[0].color.rgb * diffuse;
+    p3d_FragColor = vec4(base.rgb * lit, base.a);
+}
+"""
+
+
+def buffer_texels(gsg):
+    """ Texels a buffer texture can hold on gsg, if there is one to ask """
+    if gsg is None:
+        return MIN_BUFFER_TEXELS
+    return max(gsg.getMaxBufferTextureSize(), MIN_BUFFER_TEXELS)
+
+
+class InstancedTiles:
+    def __init__(self, parent_np, tile_nps, copies, reach=2.0, max_texels=MIN_BUFFER_TEXELS):
+        """
+        Draws tile_nps, and copies of them (arrays of their indices into tile_nps and
+        their offsets, as from cumulative_copies), instanced under parent_np. reach
+        bounds how far a tile's geometry extends from its origin, and max_texels how
+        many texels a buffer texture can hold (see buffer_texels).
+        """
+        self.parent_np = parent_np
+        self.tile_nps = tile_nps
+        self.shader = Shader.make(Shader.SL_GLSL, INSTANCE_VERT, INSTANCE_FRAG)
+        # prototype node -> the NodePaths drawing its instances, as many as its buffers
+        self.instanced_nps = {}
+
+        tile_mats = np.array([self.mat_rows(tile_np, parent_np) for tile_np in tile_nps], dtype=np.float32)
+        copy_ixs, copy_offsets = copies
+        ixs = np.concatenate([np.arange(len(tile_nps)), copy_ixs])
+        offsets = np.concatenate([np.zeros((len(tile_nps), 3)), copy_offsets]).astype(np.float32)
+        # the rows are for row vectors, so an offset just adds to the translation row
+        instance_mats = tile_mats[ixs]
+        instance_mats[:, 3, :3] += offsets
+
+        # the instances grouped by prototype, in order of the prototype's first tile
+        prototype_of = [tile_np.find('+GeomNode') for tile_np in tile_nps]
+        numbers = {}
+        number_of = np.array([numbers.setdefault(prototype_np.node(), len(numbers))
+                              for prototype_np in prototype_of], dtype=np.int64)
+        first_tiles = np.unique(number_of, return_index=True)[1]
+        instance_numbers = number_of[ixs]
+        order = np.argsort(instance_numbers, kind='stable')
+        starts = np.searchsorted(instance_numbers[order], np.arange(len(numbers) + 1))
+        per_buffer = max_texels // 4
+        for number, tile_ix in enumerate(first_tiles):
+            prototype_np = prototype_of[tile_ix]
+            kind = tile_nps[tile_ix].getTag('kind')
+            mats = instance_mats[order[starts[number]:starts[number + 1]]]
+            self.instanced_nps[prototype_np.node()] = [
+                self.instance(prototype_np, kind, mats[start:start + per_buffer], reach)
+                for start in range(0, len(mats), per_buffer)]
+        for tile_np in tile_nps:
+            tile_np.stash()
+
+    @staticmethod
+    def mat_rows(tile_np, parent_np):
+        mat = tile_np.getMat(parent_np)
+        return [tuple(mat.getRow(i)) for i in range(4)]
+
+    def instance(self, prototype_np, kind, mats, reach):
+        # One node, instancing the prototype, drawn len(mats) times
+        instanced_np = self.parent_np.attachNewNode('instanced_' + kind)
+        prototype_np.instanceTo(instanced_np)
+        buffer = Texture('instances_' + kind)
+        buffer.setupBufferTexture(len(mats) * 4, Texture.T_float, Texture.F_rgba32, GeomEnums.UH_static)
+        buffer.setRamImage(np.ascontiguousarray(mats).tobytes())
+        instanced_np.setShader(self.shader)
+        instanced_np.setShaderInput('instances', buffer)
+        instanced_np.setInstanceCount(len(mats))
+        # culling only sees the prototype's own bounds, so bound all the instances instead
+        low, high = mats[:, 3, :3].min(axis=0) - reach, mats[:, 3, :3].max(axis=0) + reach
+        instanced_np.node().setBounds(BoundingBox(Point3(*low), Point3(*high)))
+        instanced_np.node().setFinal(True)
+        return instanced_np
+
+    def remove(self):
+        """ Removes the instanced nodes, and unstashes the tiles """
+        for instanced_nps in self.instanced_nps.values():
+            for instanced_np in instanced_nps:
+                instanced_np.removeNode()
+        self.instanced_nps.clear()
+        for tile_np in self.tile_nps:
+            tile_np.unstash()
+
+    def __len__(self):
+        return sum(instanced_np.getInstanceCount()
+                   for instanced_nps in self.instanced_nps.values() for instanced_np in instanced_nps)
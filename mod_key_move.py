@@ -1,13 +1,23 @@
+import os
 import sys
 from direct.showbase.ShowBase import ShowBase
 from direct.task import Task
-from mod_duplicator import cumulative_dups
+from mod_duplicator import cumulative_dups, cumulative_copies, fill_dups, fill_copies
 from panda3d.core import *
-from direct.stdpy.pickle import Pickler, load
 
-from mod_tiles import T_Evt, Tiles, TileDispenser, TileDispenser2
-from mod_surface import Surface
+from mod_tiles import T_Evt, Tiles, TileDispenser, TileDispenser2, ResumedDispenser
+from mod_outline import OutlineDispenser
+from mod_surface import Surface, ROLE_MASKS, FLYING_FROM_MASK
 from mod_border_occluder import Border_Occluder
+from mod_settle import SettleSolver
+from mod_flight import FlungTile, FlightScheduler
+import mod_layout
+from mod_batch import TileBatches
+from mod_instancing import InstancedTiles, buffer_texels
+from mod_clip import BorderClip, clip_tiles, visible_copies
+from mod_settle_cache import SettleCache
+from mod_telemetry import telemetry
+from tile_poly import SettledTile, collider_pool
 
 UNHIDE = True
 # UNHIDE = False
@@ -27,40 +37,87 @@ np2.reparentTo(np1)
 
 
 class MyApp(ShowBase):
-    def __init__(self):
-        ShowBase.__init__(self)
+    # also needed to build the schedules before there is an app (see mod_parallel)
+    top_limit = 22
 
-        self.disableMouse() # if you leave mouse mode enabled camera position will be governed by Panda mouse control
+    def __init__(self, headless=False, layout_path='zoo.npz', engine='pusher', cache_path=None,
+                 checkpoint_path='checkpoint.npz', resume=False, telemetry_path=None,
+                 instanced_dups=False, fill_floor=False, clip_inner=False, outline=None):
+        # Headless, there is no window, so no frame pacing either, and the tiles are laid
+        # as fast as the task manager can be stepped (see mod_headless)
+        self.headless = headless
+        self.layout_path = layout_path
+        ShowBase.__init__(self, windowType='none' if headless else None)
 
-        properties = WindowProperties()
-        properties.setSize(1000, 750)
-        self.win.requestProperties(properties)
+        if not self.headless:
+            self.disableMouse() # if you leave mouse mode enabled camera position will be governed by Panda mouse control
 
-        # Enable fast exit
-        self.accept("escape", sys.exit)
+            properties = WindowProperties()
+            properties.setSize(1000, 750)
+            self.win.requestProperties(properties)
+
+            # Enable fast exit
+            self.accept("escape", sys.exit)
 
         self.mm_per_unit = 75
         # self.grout_wd = 0.05
         # self.grout_wd = 2.5 / self.mm_per_unit
         self.grout_wd = 2 / self.mm_per_unit
 
-        self.flung_tile, self.trajectory, self.use_short_cushion, self.event = (None, None, None, None)
+        # tiles flung and not yet settled, in the order they were released
+        self.in_flight = []
+
+        # set once the finished layout has been stashed
+        self.laid = False
 
-        self.top_limit = 22
+        # Each tile's statistics, and the DBP output, are recorded in the telemetry (see
+        # mod_telemetry), if a telemetry_path is given, or it has been enabled already, with
+        # the traverser timed by tasks either side of traverse_collisions
+        if telemetry_path:
+            telemetry.enabled = True
+            telemetry.open_sink(telemetry_path)
+        if telemetry.enabled:
+            self.taskMgr.add(self.start_traverse_clock, "startTraverseClock", sort=29)
+            self.taskMgr.add(self.stop_traverse_clock, "stopTraverseClock", sort=31)
 
-        self.setup_lighting()
+        if not self.headless:
+            self.setup_lighting()
 
         intr_top = 16/3
         intr_ht = 23/3 - 0.1
+        # The cushions and the tiles in flight, all there is to collide, are under a root
+        # of their own, so that traversing it doesn't walk the settled tiles, nor the
+        # occluders, batches and instances
+        self.collision_np = self.render.attachNewNode("collision")
         self.floor = Surface(1350 / self.mm_per_unit, self.top_limit,
-                             self.grout_wd, Tiles.tip_rad)
+                             self.grout_wd, Tiles.tip_rad, self.collision_np)
         self.border_tiles_np = self.render.attachNewNode("border")
         self.bord_occl = Border_Occluder(self.border_tiles_np, self.grout_wd)
         self.inner_tiles_np = self.render.attachNewNode("inner")
+        # Settled tiles are drawn in batches, a chunk of floor at a time (see mod_batch)
+        self.border_batches = TileBatches(self.border_tiles_np)
+        self.inner_batches = TileBatches(self.inner_tiles_np)
+        # Or the inner group and its duplicates are drawn instanced, rather than the
+        # group being copied (see mod_instancing)
+        self.instanced_dups = instanced_dups
+        # and either repeated a fixed number of times, or just enough to fill the floor
+        self.fill_floor = fill_floor
+        self.inner_copies = None
+        self.inner_instances = None
+        # Inner tiles entirely outside the border outline are dropped, and those crossing
+        # it trimmed, rather than hidden by the occluders (see mod_clip). The clipped
+        # tiles are then final, and can't be shifted.
+        self.clip_inner = clip_inner
+        # The border is laid along the front path's hand coded schedule, or one compiled
+        # for this rectilinear outline, starting where path_end and path_bord meet (see
+        # mod_outline)
+        self.outline = outline
 
         self.pusher = CollisionHandlerPusher()
-        self.cTrav = CollisionTraverser()
-        self.cTrav.setRespectPrevTransform(True)
+        # not ShowBase's cTrav, which its collisionLoop would traverse the whole of render with
+        self.collision_trav = CollisionTraverser()
+        self.collision_trav.setRespectPrevTransform(True)
+        self.taskMgr.add(self.traverse_collisions, "traverseCollisions", sort=30)
 
         self.pusher.addInPattern('into')
 
@@ -69,10 +126,40 @@ class MyApp(ShowBase):
 
         self.count_threshold = 50
         self.veloc_attn_ratio = 0.94  # minimum that works for tile13
+        # works out where tiles will go, so that those which can't interact fly together
+        self.flight_scheduler = FlightScheduler(SettleSolver(self.count_threshold, self.veloc_attn_ratio),
+                                                self.floor)
+
+        # The pusher engine flings each tile frame by frame, while the analytic one
+        # solves for where it would come to rest (see mod_settle)
+        if engine == 'analytic':
+            self.settler = SettleSolver(self.count_threshold, self.veloc_attn_ratio)
+            self.layTask = self.solvePrismTask
+        else:
+            self.layTask = self.spinPrismTask
+
+        # Poses of tiles settled in earlier runs, which are replayed rather than flung again
+        # (see mod_settle_cache), if a cache_path is given. The parameters are everything
+        # else they depend on.
+        if cache_path:
+            floor = self.floor
+            self.settle_cache = SettleCache(cache_path, dict(
+                engine=engine, count_threshold=self.count_threshold, veloc_attn_ratio=self.veloc_attn_ratio,
+                surface=(floor.x0, floor.x1, floor.y0, floor.y1, floor.grout_wd, floor.tip_rad,
+                         floor.cushion_rad, floor.offset, floor.closeness_tol)))
+            self.cache_chain_key = self.settle_cache.base_key
+        else:
+            self.settle_cache = None
 
         self.border_tile_nps = []
         self.inner_tile_nps = []
 
+        # The laying is checkpointed every so many tiles settled, once none are in flight,
+        # so that a run which dies can be resumed from the last checkpoint (see mod_layout)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = 20
+        self.settled_since_checkpoint = 0
+
         # self.lastTime = 0
         self.init_new_sched()
 
@@ -80,25 +167,29 @@ class MyApp(ShowBase):
 
         # Try to reopen the file
         try:
-            # input = open('zoo.pkl', 'rb')
-            input = open('zoo-not.pkl', 'rb')
+            if self.headless:
+                # Headless runs always lay from scratch
+                raise FileNotFoundError
+            # input = open('zoo.npz', 'rb')
+            input = open('zoo-not.npz', 'rb')
 
-            # Loading from pickle, so do not stash
+            # Loading a saved layout, so do not stash
             self.stash = False
         except:
-            # Stashing to pickle after tiling from scratch
+            # Stashing the layout after tiling from scratch
             self.stash = True
 
         if not self.stash:
-            # Load the pickled data into the relevant lists / dicts
+            # Load the saved layout into the relevant lists / dicts
             self.load_layout(input)
             self.lift_border()
             self.activate_shifting(None)
+        elif resume and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            self.resume_laying()
         else:
-            self.taskMgr.add(self.spinPrismTask, "spinPrismTask", extraArgs=[
-                TileDispenser(self.top_limit), self.border_tile_nps, None],
-                             appendTask=True, uponDeath=self.lay_inner_tiles)
-        self.re_enable_mouse_camera()
+            self.lay_border_tiles()
+        if not self.headless:
+            self.re_enable_mouse_camera()
 
     def re_enable_mouse_camera(self):
         mat = Mat4(camera.getMat())
@@ -107,10 +198,7 @@ class MyApp(ShowBase):
         base.enableMouse()
 
     def init_new_sched(self):
-        self.hit_count = 0
-        self.trigger = True
-        self.sunk = False
-        self.count_down = self.count_threshold
+        self.in_flight = []
         self.hit_bottom_row = False
 
     def lift_border(self):
@@ -122,52 +210,187 @@ class MyApp(ShowBase):
         # height = 1
         self.border_tiles_np.setZ(self.border_tiles_np.getZ() + height)
 
+        # nothing to draw headless
+        if not self.headless:
+            self.border_batches.add(self.border_tile_nps)
+
+    def lay_border_tiles(self):
+        if self.outline:
+            tile_dispatcher = OutlineDispenser(self.outline, self.grout_wd, (self.floor.x1, self.floor.y1))
+        else:
+            tile_dispatcher = TileDispenser(self.top_limit)
+        self.lay_schedule(tile_dispatcher, self.border_tile_nps, None, self.lay_inner_tiles)
+
     def lay_inner_tiles(self, task):
         self.lift_border()
 
         self.init_new_sched()
-        self.taskMgr.add(self.spinPrismTask, "spinPrismTask", extraArgs=[
-            TileDispenser2(self.top_limit), self.inner_tile_nps, cumulative_dups],
-                         appendTask=True, uponDeath=self.stash_then_shift)
+        tile_dispatcher = TileDispenser2(self.top_limit)
+        self.lay_schedule(tile_dispatcher, self.inner_tile_nps, self.inner_duplicator(), self.stash_then_shift)
+
+    def inner_duplicator(self):
+        if self.instanced_dups:
+            return self.instance_dups
+        return self.fill_dups if self.fill_floor else cumulative_dups
+
+    def fill_dups(self, settled_tile_nps):
+        fill_dups(settled_tile_nps, self.floor)
+
+    def instance_dups(self, settled_tile_nps):
+        # Finds the copies the duplicator would make, and draws them and the group instanced
+        if self.fill_floor:
+            self.inner_copies = fill_copies(settled_tile_nps, self.floor)
+        else:
+            self.inner_copies = cumulative_copies(settled_tile_nps)
+        if self.clip_inner:
+            self.inner_copies = visible_copies(settled_tile_nps, self.inner_copies, self.border_clip())
+        self.inner_instances = InstancedTiles(self.inner_tiles_np, settled_tile_nps, self.inner_copies,
+                                              max_texels=buffer_texels(None if self.headless else self.win.getGsg()))
+
+    def clip_inner_tiles(self, tile_nps):
+        # Trims the tiles of tile_nps across the border outline and drops those beyond it,
+        # then rebuilds the batches of any of them already batched (see mod_clip and mod_batch)
+        self.inner_batches.update(clip_tiles(tile_nps, self.border_clip()))
+
+    def border_clip(self):
+        return BorderClip(self.bord_occl.occluder_polys, self.bord_occl.inner_outline())
+
+    def lay_schedule(self, tile_dispatcher, settled_tile_nps, duplicator, then):
+        self.replay_cached(tile_dispatcher, settled_tile_nps, duplicator)
+        self.taskMgr.add(self.layTask, "spinPrismTask", extraArgs=[
+            tile_dispatcher, settled_tile_nps, duplicator],
+                         appendTask=True, uponDeath=then)
+
+    def resume_laying(self):
+        # Carries on laying from the last checkpoint, rebuilding the tiles settled before
+        # it rather than laying them again
+        checkpoint = mod_layout.load_checkpoint(self.checkpoint_path)
+        tiles = checkpoint['tiles']
+        inner = tiles['inner']
+
+        self.floor.restore_cushions(mod_layout.build_cushion_list(checkpoint['cushions']),
+                                    checkpoint['last_attached_ix'])
+        # the occluders of the trace so far, which the border tiles still to lay carry on
+        self.bord_occl.resume_trace(mod_layout.build_trace(checkpoint['trace']))
+        if self.settle_cache and checkpoint['chain_key']:
+            self.cache_chain_key = checkpoint['chain_key']
+
+        tile_dispatcher = ResumedDispenser(checkpoint['schedule'], checkpoint['count'])
+        if not checkpoint['inner']:
+            # border tiles are only put under border when it is lifted
+            self.border_tile_nps = mod_layout.build_tiles(tiles[~inner], self.render)
+            self.lay_schedule(tile_dispatcher, self.border_tile_nps, None, self.lay_inner_tiles)
+        else:
+            self.border_tile_nps = mod_layout.build_tiles(tiles[~inner], self.border_tiles_np)
+            self.lift_border()
+            self.detected_occluder_nps = self.bord_occl.close_trace()
+            self.inner_tile_nps = mod_layout.build_tiles(tiles[inner], self.render)
+            self.lay_schedule(tile_dispatcher, self.inner_tile_nps, self.inner_duplicator(), self.stash_then_shift)
+
+    def checkpoint_if_due(self, tile_dispatcher, duplicator):
+        # Only called when no tiles are in flight, so there is nothing but settled tiles
+        # and the rest of the schedule to save
+        if not self.checkpoint_path or self.settled_since_checkpoint < self.checkpoint_every:
+            return
+        mod_layout.save_checkpoint(self.checkpoint_path, duplicator is not None,
+                                   self.border_tile_nps, self.inner_tile_nps, self.floor,
+                                   self.bord_occl.get_tile_trace(), tile_dispatcher,
+                                   self.cache_chain_key if self.settle_cache else None)
+        self.settled_since_checkpoint = 0
+        if DBP and telemetry.enabled:
+            telemetry.debug('checkpointed with', tile_dispatcher.tiles_left(), 'tiles left')
+
+    def replay_cached(self, tile_dispatcher, settled_tile_nps, duplicator):
+        # Settles the tiles at the head of the schedule whose poses were cached by an
+        # earlier run straight into them, leaving the rest to be flung
+        if not self.settle_cache:
+            return
+        # a resumed schedule's tiles keep the keys they were given before it was checkpointed
+        if not tile_dispatcher.resumed:
+            self.cache_chain_key = self.settle_cache.key_schedule(tile_dispatcher.schedule, self.cache_chain_key)
+        for _ in range(self.settle_cache.cached_length(tile_dispatcher.schedule)):
+            flight = FlungTile(*tile_dispatcher.popup())
+            flight.tile.np.setPosHpr(*self.settle_cache.pose(flight.tile.spec['cache_key']))
+            self.settle_flung_tile(flight, settled_tile_nps, duplicator)
 
     def stash_then_shift(self, task):
         self.stash_layout()
-        self.activate_shifting(task)
+        # the layout supersedes any checkpoint of it
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.laid = True
+        if not self.headless:
+            self.activate_shifting(task)
 
     def activate_shifting(self, task):
-        # This step is required to make the tiles shiftable
-        for tile in self.inner_tile_nps:
-            tile.reparentTo(self.inner_tiles_np)
+        # This step is required to make the tiles shiftable, unless they are drawn
+        # instanced, under inner already
+        if self.inner_instances is None:
+            for tile in self.inner_tile_nps:
+                tile.reparentTo(self.inner_tiles_np)
+            self.inner_batches.add(self.inner_tile_nps)
 
-        self.taskMgr.add(self.move, "moveTask")
-        self.accept_arrow_keys()
+        if not self.clip_inner:
+            self.taskMgr.add(self.move, "moveTask")
+            self.accept_arrow_keys()
 
     def load_layout(self, input):
-        tiled_floor = load(input)
+        tiled_floor = mod_layout.load_layout(input)
+        inner = tiled_floor['tiles']['inner']
 
-        self.floor = tiled_floor['floor']
+        self.floor.restore_cushions(mod_layout.build_cushion_list(tiled_floor['cushions']))
 
-        self.border_tile_nps = tiled_floor['border_tiles']
-        for tile in self.border_tile_nps:
-            tile.reparentTo(self.border_tiles_np)
+        self.border_tile_nps = mod_layout.build_tiles(tiled_floor['tiles'][~inner], self.border_tiles_np)
+        self.inner_tile_nps = mod_layout.build_tiles(tiled_floor['tiles'][inner], self.inner_tiles_np)
 
-        self.inner_tile_nps = tiled_floor['inner_tiles']
-        for tile in self.inner_tile_nps:
-            tile.reparentTo(self.inner_tiles_np)
-
-        self.bord_occl.border_tile_trace = tiled_floor['border_tile_trace']
+        self.bord_occl.border_tile_trace = mod_layout.build_trace(tiled_floor['trace'])
         self.detected_occluder_nps = self.bord_occl.detect_intrusion()
+        if self.clip_inner:
+            self.clip_inner_tiles(self.inner_tile_nps)
 
-    def stash_layout(self):
-        output = open('zoo.pkl', 'wb')
-        p = Pickler(output)
+    def open_layout_store(self, path):
+        # Only the cushions and trace are loaded now, the tiles as their chunks are attached
+        self.layout_store = mod_layout.LayoutStore(path)
+        self.attached_chunks = {}
 
-        tiled_floor = dict(floor=self.floor,
-                           inner_tiles=self.inner_tile_nps,
-                           border_tiles=self.border_tile_nps,
-                           border_tile_trace=self.bord_occl.get_tile_trace())
-        p.dump(tiled_floor)
+        self.floor.restore_cushions(mod_layout.build_cushion_list(self.layout_store.cushions))
 
+        self.bord_occl.border_tile_trace = mod_layout.build_trace(self.layout_store.trace)
+        self.detected_occluder_nps = self.bord_occl.detect_intrusion()
+
+    def attach_chunks(self, x0, y0, x1, y1):
+        # Attaches the tiles of the open layout store which may reach into the box, if not already
+        for chunk in self.layout_store.chunks_in(x0, y0, x1, y1):
+            if chunk in self.attached_chunks:
+                continue
+            tiles = self.layout_store.chunk_tiles(chunk)
+            inner = tiles['inner']
+            border_nps = mod_layout.build_tiles(tiles[~inner], self.border_tiles_np)
+            inner_nps = mod_layout.build_tiles(tiles[inner], self.inner_tiles_np)
+            if self.clip_inner:
+                self.clip_inner_tiles(inner_nps)
+            self.border_tile_nps.extend(border_nps)
+            self.inner_tile_nps.extend(inner_nps)
+            self.border_batches.add(border_nps)
+            self.inner_batches.add(inner_nps)
+            self.attached_chunks[chunk] = (border_nps, inner_nps)
+
+    def detach_chunks(self, x0, y0, x1, y1):
+        # Detaches the tiles of the attached chunks which can't reach into the box
+        keep = set(self.layout_store.chunks_in(x0, y0, x1, y1))
+        for chunk in [chunk for chunk in self.attached_chunks if chunk not in keep]:
+            border_nps, inner_nps = self.attached_chunks.pop(chunk)
+            self.border_batches.remove(border_nps)
+            self.inner_batches.remove(inner_nps)
+            for tile_np in border_nps + inner_nps:
+                tile_np.removeNode()
+        self.border_tile_nps = [tile_np for tile_np in self.border_tile_nps if not tile_np.isEmpty()]
+        self.inner_tile_nps = [tile_np for tile_np in self.inner_tile_nps if not tile_np.isEmpty()]
+
+    def stash_layout(self):
+        output = open(self.layout_path, 'wb')
+        mod_layout.save_layout(output, self.border_tile_nps, self.inner_tile_nps,
+                               self.floor, self.bord_occl.get_tile_trace(), self.inner_copies)
         output.close()
 
     def setup_lighting(self):
@@ -221,18 +444,18 @@ class MyApp(ShowBase):
         self.keyMap[key] = value
 
     def ouch(self, collEntry):
-        tile_name = collEntry.getFromNodePath().getPythonTag("owner").name
+        owner = collEntry.getFromNodePath().getPythonTag("owner")
+        flight = next(flight for flight in self.in_flight if flight.tile is owner)
+        tile_name = owner.name
         tile_num = int(tile_name.split("tile")[1])
 
-        if DBP: print(tile_name, tile_num, self.hit_threshold)
-        if DBP:
+        if DBP and telemetry.enabled: telemetry.debug(tile_name, tile_num, flight.hit_threshold)
+        if DBP and telemetry.enabled:
             if collEntry.getIntoNodePath().hasPythonTag("owner"):
-                print(collEntry.getIntoNodePath().getPythonTag("owner").name)
-        if DBP: print('hit by', collEntry, 'solid', collEntry.getFrom())
+                telemetry.debug(collEntry.getIntoNodePath().getPythonTag("owner").name)
+        if DBP and telemetry.enabled: telemetry.debug('hit by', collEntry, 'solid', collEntry.getFrom())
 
-        if self.trajectory:
-            self.velocity = self.trajectory.pop(0)
-        self.hit_count += 1
+        flight.hit()
 
     def zoomIn(self):
         self.camera.setPos(9, 16, 40)
@@ -244,112 +467,176 @@ class MyApp(ShowBase):
 
     def spinPrismTask(self, tile_dispatcher, settled_tile_nps, duplicator, task):
         # Appears to be called 60 times a second
-        print('flung_tile', self.flung_tile)
+        if DBP and telemetry.enabled:
+            telemetry.debug('flung_tiles', [flight.tile for flight in self.in_flight])
+
+        for flight in self.in_flight:
+            if not flight.at_rest:
+                self.fly(flight)
+                flight.frames += 1
+
+        # Settle the tiles which have come to rest, in the order they were released, so
+        # that a tile which comes to rest early waits for those released before it
+        while self.in_flight and self.in_flight[0].at_rest:
+            # first tile settled
+            if DBP and telemetry.enabled: telemetry.debug('tile has arrived and settled')
+            self.settle_flung_tile(self.in_flight.pop(0), settled_tile_nps, duplicator)
+        if not self.in_flight:
+            self.checkpoint_if_due(tile_dispatcher, duplicator)
 
         # Initialise, within the cyclic task, not within MyApp's __init__, otherwise the initial position
         # of the first tile gets pickled, as well as its final position
-        if not self.flung_tile:
-            self.flung_tile, self.trajectory, self.use_short_cushion, self.event = tile_dispatcher.popup()
-
+        for flight in self.flight_scheduler.release(tile_dispatcher, self.in_flight):
+            if DBP and telemetry.enabled: telemetry.debug('initial heading', flight.tile.np.getH())
             # Both of these required to stop tile going through the side
-            base.pusher.addCollider(self.flung_tile.collider, self.flung_tile.np)
-            base.cTrav.addCollider(self.flung_tile.collider, self.pusher)
+            base.pusher.addCollider(flight.tile.collider, flight.tile.np)
+            self.collision_trav.addCollider(flight.tile.collider, self.pusher)
+            # in flight, it is only tested against the cushions
+            flight.tile.np.reparentTo(self.collision_np)
+            flight.tile.collider.node().setFromCollideMask(FLYING_FROM_MASK)
+            flight.tile.collider.node().setIntoCollideMask(ROLE_MASKS['flying_tile'])
+            flight.launch(self.count_threshold)
+            self.in_flight.append(flight)
+
+        if not self.in_flight:
+            if DBP and telemetry.enabled: telemetry.debug('--E')
+            if DBP and telemetry.enabled: telemetry.debug('all tiles have arrived')
+            # self.zoomIn()
+            self.all_tiles_settled(settled_tile_nps, duplicator)
+            return Task.done
+
+        return Task.cont
+
+    def traverse_collisions(self, task):
+        self.collision_trav.traverse(self.collision_np)
+        return Task.cont
 
-            # hit threshold before deceleration starts depends on number of velocity changes
-            self.hit_threshold = len(self.trajectory)
+    def start_traverse_clock(self, task):
+        self.traverse_start = globalClock.getRealTime()
+        return Task.cont
 
-            # Velocity defined in units per frame intervals (of 1 /60 th second)
-            self.velocity = self.trajectory.pop(0)
+    def stop_traverse_clock(self, task):
+        # shares out the traversal between the tiles it moved
+        flying = [flight for flight in self.in_flight if not flight.at_rest]
+        if flying:
+            share = (globalClock.getRealTime() - self.traverse_start) / len(flying)
+            for flight in flying:
+                flight.traverse_s += share
+        return Task.cont
 
+    def fly(self, flight):
+        # Moves a tile in flight on by a frame
         low_z = 0
-        # if DBP: print('set velocity 1', self.velocity)
-        new_pos = self.flung_tile.np.getPos() + self.velocity
-        # if DBP: print('new position', new_pos)
-        if new_pos.getZ() <= low_z or self.sunk:
+        # if DBP and telemetry.enabled: telemetry.debug('set velocity 1', flight.velocity)
+        new_pos = flight.tile.np.getPos() + flight.velocity
+        # if DBP and telemetry.enabled: telemetry.debug('new position', new_pos)
+        if new_pos.getZ() <= low_z or flight.sunk:
             # stopped sinking
             new_pos.setZ(low_z)
-            self.sunk = True
-            self.velocity.setZ(low_z)
+            flight.sunk = True
+            flight.velocity.setZ(low_z)
 
-        if DBP: print('AAA')
+        if DBP and telemetry.enabled: telemetry.debug('AAA')
         # may have stopped sinking
-        if self.hit_count < self.hit_threshold:
-            if DBP: print('--B')
-            self.flung_tile.np.setFluidPos(new_pos)
-            if DBP: print('set position', self.flung_tile.np.getPos())
-            if DBP: print('set velocity', self.velocity)
+        if flight.hit_count < flight.hit_threshold:
+            if DBP and telemetry.enabled: telemetry.debug('--B')
+            flight.tile.np.setFluidPos(new_pos)
+            if DBP and telemetry.enabled: telemetry.debug('set position', flight.tile.np.getPos())
+            if DBP and telemetry.enabled: telemetry.debug('set velocity', flight.velocity)
         else:
-            if DBP: print('BBB')
-            if self.trigger:
-                if DBP: print('CCC')
+            if DBP and telemetry.enabled: telemetry.debug('BBB')
+            if flight.trigger:
+                if DBP and telemetry.enabled: telemetry.debug('CCC')
                 # keep updating pos
-                self.flung_tile.np.setFluidPos(new_pos)
-                if DBP: print('got position', self.flung_tile.np.getPos())
-                if DBP: print('got velocity', self.velocity)
-                if self.count_down > 0:
-                    if DBP: print('DDD')
-                    self.count_down -= 1
-                    self.velocity = self.velocity * self.veloc_attn_ratio
+                flight.tile.np.setFluidPos(new_pos)
+                if DBP and telemetry.enabled: telemetry.debug('got position', flight.tile.np.getPos())
+                if DBP and telemetry.enabled: telemetry.debug('got velocity', flight.velocity)
+                if flight.count_down > 0:
+                    if DBP and telemetry.enabled: telemetry.debug('DDD')
+                    flight.count_down -= 1
+                    flight.velocity = flight.velocity * self.veloc_attn_ratio
                 else:
-                    if DBP: print('--D')
-                    self.trigger = False
+                    if DBP and telemetry.enabled: telemetry.debug('--D')
+                    flight.trigger = False
             else:
-                if DBP: print('--C')
-                # first tile settled
-                if DBP: print('tile has arrived and settled')
-                # remove flung tile's tile collider
-                self.flung_tile.collider.node().clearSolids()
-                base.cTrav.removeCollider(self.flung_tile.collider)
-
-                settled_tile_nps.append(self.flung_tile.np)
-
-                if self.event != T_Evt.NONE:
-                    if not duplicator:
-                        # no duplicator implies intrusions
-                        self.bord_occl.register_occlusion(self.event, self.flung_tile)
-                    if self.event == T_Evt.REMOVE:
-                        self.floor.remove_last_attached()
-                    elif self.event == T_Evt.START:
-                        pass
-                    else:
-                        self.floor.internal_border(self.event, self.flung_tile)
-
-                # clip wall length if hit bottom row
-                self.floor.tile_wall(self.flung_tile, self.use_short_cushion)
-
-                if tile_dispatcher.tiles_left():
-                    if DBP: print('EEE')
-                    self.flung_tile, self.trajectory, self.use_short_cushion, self.event = tile_dispatcher.popup()
-                    if DBP: print('initial heading', self.flung_tile.np.getH())
-
-                    base.pusher.addCollider(self.flung_tile.collider, self.flung_tile.np)
-                    base.cTrav.addCollider(self.flung_tile.collider, self.pusher)
-
-                    self.hit_count = 0
-                    self.trigger = True
-                    self.sunk = False
-                    self.count_down = self.count_threshold
-                    # hit threshold before deceleration starts depends on number of velocity changes
-                    self.hit_threshold = len(self.trajectory)
-                    self.velocity = self.trajectory.pop(0)
-                else:
-                    if DBP: print('--E')
-                    if DBP: print('all tiles have arrived')
-                    # self.zoomIn()
-                    if DBP: self.floor.gut_collision_nodes()
-                    if duplicator:
-                        duplicator(settled_tile_nps)
-                    else:
-                        pass
-                        # There's no duplicator for border tiles but there are intrusions
-                        self.detected_occluder_nps = self.bord_occl.detect_intrusion()
-                        pass
-
-                    self.flung_tile = None
-                    return Task.done
-
-        return Task.cont
-
-
-app = MyApp()
-app.run()
\ No newline at end of file
+                if DBP and telemetry.enabled: telemetry.debug('--C')
+                flight.at_rest = True
+
+    def solvePrismTask(self, tile_dispatcher, settled_tile_nps, duplicator, task):
+        # Lays every tile in the schedule in one go, placing each straight at its
+        # resting position rather than flinging it frame by frame
+        while tile_dispatcher.tiles_left():
+            flight = FlungTile(*tile_dispatcher.popup())
+            rest_pos = self.settler.rest_position(flight.tile, flight.trajectory, self.floor.cushions)
+            flight.tile.np.setPos(rest_pos)
+            if DBP and telemetry.enabled: telemetry.debug('solved position', rest_pos)
+            self.settle_flung_tile(flight, settled_tile_nps, duplicator)
+            self.checkpoint_if_due(tile_dispatcher, duplicator)
+        self.all_tiles_settled(settled_tile_nps, duplicator)
+        return Task.done
+
+    def settle_flung_tile(self, flight, settled_tile_nps, duplicator):
+        # remove flung tile's tile collider, for a tile flung later to reuse
+        self.collision_trav.removeCollider(flight.tile.collider)
+        self.pusher.removeCollider(flight.tile.collider)
+        collider_pool.recycle(flight.tile)
+        # back out of the collision root, which is where render is, so it stays put
+        flight.tile.np.reparentTo(self.render)
+        # only what is needed of the tile is kept once it has settled
+        settled = SettledTile(flight.tile)
+
+        settled_tile_nps.append(settled.np)
+        self.settled_since_checkpoint += 1
+        cushions_added = self.floor.cushions_added
+        if self.settle_cache and flight.tile.spec['cache_key']:
+            self.settle_cache.store(flight.tile.spec['cache_key'], flight.tile.np.getPos(), flight.tile.np.getHpr())
+
+        if flight.event != T_Evt.NONE:
+            if not duplicator:
+                # no duplicator implies intrusions
+                self.bord_occl.register_occlusion(flight.event, settled)
+            if flight.event == T_Evt.REMOVE:
+                self.floor.remove_last_attached()
+            elif flight.event == T_Evt.START:
+                pass
+            else:
+                self.floor.internal_border(flight.event, settled)
+
+        # clip wall length if hit bottom row
+        self.floor.tile_wall(settled, flight.use_short_cushion)
+
+        telemetry.record('tile', name=settled.name, kind=settled.kind,
+                         frames=flight.frames, collisions=flight.hit_count,
+                         cushions=self.floor.cushions_added - cushions_added,
+                         traverse_s=flight.traverse_s)
+
+    def all_tiles_settled(self, settled_tile_nps, duplicator):
+        if DBP: self.floor.gut_collision_nodes()
+        if duplicator:
+            duplicator(settled_tile_nps)
+            if self.clip_inner and self.inner_instances is None:
+                self.clip_inner_tiles(settled_tile_nps)
+        else:
+            pass
+            # There's no duplicator for border tiles but there are intrusions, detected as
+            # the border tiles registered, so only the last records' are left
+            self.detected_occluder_nps = self.bord_occl.close_trace()
+            pass
+
+        self.in_flight = []
+        # the poses stored while laying the schedule
+        if self.settle_cache:
+            self.settle_cache.sync()
+
+    def destroy(self):
+        if getattr(self, 'settle_cache', None):
+            self.settle_cache.close()
+            self.settle_cache = None
+        super().destroy()
+
+
+if __name__ == '__main__':
+    app = MyApp(resume='--resume' in sys.argv, instanced_dups='--instanced' in sys.argv,
+                fill_floor='--fill' in sys.argv, clip_inner='--clip' in sys.argv,
+                cache_path='settle_cache' if '--cache' in sys.argv else None)
+    app.run()
\ No newline at end of file
@@ -0,0 +1,246 @@
+"""
+Versioned binary layout format, which replaces pickling the tile NodePaths, the Surface
+and the border trace. Only what is needed to rebuild the floor is kept, in NumPy
+structured arrays, one row per tile, per cushion and per border trace record:
+
+    tiles:    kind, inner or border, position, heading, scale and event
+    cushions: name, end points and radius of each collision tube still attached
+    trace:    direction and (up to 4) corner positions of each border event tile
+
+and saved together, uncompressed, in a .npz file. Loading is just reading the arrays,
+and the tile geometry is rebuilt by instancing the shared prism prototypes (see
+tile_poly.PrismCache), so neither depends on the state of the scene graph.
+
+For floors too big to hold whole, a layout can also be kept as a store: a directory of
+.npy files, with the tile records sorted by the square chunk of floor their position
+falls in and an index of where each chunk's records start. The tile records are memory
+mapped, so opening a store reads only the index, and attaching the tiles within a
+bounding box only reads the records of the chunks it overlaps.
+
+A checkpoint of a run still laying its tiles is saved the same way, plus what is needed
+to carry on: the tiles left in the schedule, which of border or inner tiles were being
+laid, the dispenser's tile count, and which cushion is the last internal border attached
+(which the next REMOVE event takes down). Its floats are kept in double precision, so
+that the resumed run lays the rest of the tiles just as the interrupted one would have.
+
+    python mod_layout.py layout.npz layout.store [chunk_size]
+"""
+
+import os
+import sys
+import numpy as np
+from panda3d.core import Point3
+
+from mod_tiles import KINDS, T_Evt, Tiles
+from tile_poly import collider_pool
+
+
+LAYOUT_VERSION = 1
+
+CUSHION_NAMES = ['path_end', 'path_bord', 'path_tile', 'path_internal']
+
+TILE_DTYPE = np.dtype([('kind', 'u1'), ('inner', '?'), ('pos', '<f4', 3),
+                       ('h', '<f4'), ('scale', '<f4', 3), ('event', 'u1')])
+CUSHION_DTYPE = np.dtype([('name', 'u1'), ('p1', '<f4', 3), ('p2', '<f4', 3),
+                          ('radius', '<f4')])
+TRACE_DTYPE = np.dtype([('to_dir', 'u1'), ('n', 'u1'), ('xys', '<f4', (4, 3))])
+CHUNK_DTYPE = np.dtype([('cx', '<i4'), ('cy', '<i4'), ('start', '<i8'), ('count', '<i8')])
+
+
+def widened(dtype):
+    """ dtype with its single precision fields made double, for checkpoints """
+    return np.dtype([(name, '<f8' if dtype[name].base == np.float32 else dtype[name].base,
+                      dtype[name].shape) for name in dtype.names])
+
+# How far a tile reaches from its position, beyond which chunks needn't be looked in
+# when finding the tiles within a bounding box (a diamond tile reaches about 1.5)
+TILE_REACH = 1.5
+
+
+def tile_records(tile_nps, inner, dtype=TILE_DTYPE):
+    records = np.zeros(len(tile_nps), dtype=dtype)
+    for record, tile_np in zip(records, tile_nps):
+        record['kind'] = KINDS.index(tile_np.getTag('kind'))
+        record['inner'] = inner
+        record['pos'] = tile_np.getPos()
+        record['h'] = tile_np.getH()
+        record['scale'] = tile_np.getScale()
+        record['event'] = int(tile_np.getTag('event') or T_Evt.NONE.value)
+    return records
+
+
+def copy_records(records, copies):
+    """
+    Records of copies of the tiles of records, as arrays of their indices into records
+    and their offsets (see mod_duplicator.cumulative_copies)
+    """
+    ixs, offsets = copies
+    copied = records[ixs]
+    copied['pos'] += offsets
+    return copied
+
+
+def cushion_records(cushion_list, dtype=CUSHION_DTYPE):
+    records = np.zeros(len(cushion_list), dtype=dtype)
+    for record, (name, p1, p2, radius) in zip(records, cushion_list):
+        record['name'] = CUSHION_NAMES.index(name)
+        record['p1'] = p1
+        record['p2'] = p2
+        record['radius'] = radius
+    return records
+
+
+def trace_records(border_tile_trace, dtype=TRACE_DTYPE):
+    records = np.zeros(len(border_tile_trace), dtype=dtype)
+    for record, rec in zip(records, border_tile_trace):
+        record['to_dir'] = rec['to_dir'].value
+        record['n'] = len(rec['xys'])
+        record['xys'][:len(rec['xys'])] = [list(xy) for xy in rec['xys']]
+    return records
+
+
+def save_layout(output, border_tile_nps, inner_tile_nps, floor, border_tile_trace, inner_copies=None):
+    """
+    Saves a layout to output, a path or a binary file, with inner_copies of the inner
+    tiles, which were only drawn instanced (see mod_instancing), as tiles of their own
+    """
+    inner = tile_records(inner_tile_nps, True)
+    tiles = np.concatenate([tile_records(border_tile_nps, False), inner] +
+                           ([copy_records(inner, inner_copies)] if inner_copies is not None else []))
+    np.savez(output, version=np.array(LAYOUT_VERSION), tiles=tiles,
+             cushions=cushion_records(floor.cushion_list()),
+             trace=trace_records(border_tile_trace))
+
+
+def load_layout(input):
+    """ The tiles, cushions and trace arrays of a layout saved to input, a path or a binary file """
+    with np.load(input) as layout:
+        version = int(layout['version'])
+        if version != LAYOUT_VERSION:
+            raise ValueError('layout version %d, expected %d' % (version, LAYOUT_VERSION))
+        return dict(tiles=layout['tiles'], cushions=layout['cushions'], trace=layout['trace'])
+
+
+# prototype prism of each tile kind, once one has been built
+prototypes = {}
+
+
+def build_tiles(records, parent_np):
+    """ Tile NodePaths, under parent_np, instancing the prototype prism of each tile's kind """
+    tile_nps = []
+    for record in records:
+        kind = KINDS[record['kind']]
+        if kind not in prototypes:
+            # make a tile of the kind just to find its prototype
+            template = getattr(Tiles, kind)((0, 0, 0), "template", 0)
+            prototypes[kind] = template.prototype
+            collider_pool.recycle(template)
+            template.np.removeNode()
+        tile_np = parent_np.attachNewNode("prism")
+        tile_np.setPosHprScale(*record['pos'].tolist(), record['h'], 0, 0, *record['scale'].tolist())
+        prototypes[kind].instanceTo(tile_np)
+        tile_np.setTag('kind', kind)
+        tile_np.setTag('event', str(record['event']))
+        tile_nps.append(tile_np)
+    return tile_nps
+
+
+def build_cushion_list(records):
+    return [(CUSHION_NAMES[record['name']], Point3(*record['p1'].tolist()),
+             Point3(*record['p2'].tolist()), float(record['radius'])) for record in records]
+
+
+def build_trace(records):
+    return [dict(to_dir=T_Evt(int(record['to_dir'])),
+                 xys=[Point3(*xy) for xy in record['xys'][:record['n']].tolist()])
+            for record in records]
+
+
+def save_checkpoint(path, inner, border_tile_nps, inner_tile_nps, floor, border_tile_trace,
+                    tile_dispatcher, chain_key):
+    """
+    Saves a checkpoint of a run laying its border (or inner) tiles to path, written
+    whole before it replaces any earlier checkpoint there
+    """
+    tiles = np.concatenate([tile_records(border_tile_nps, False, widened(TILE_DTYPE)),
+                            tile_records(inner_tile_nps, True, widened(TILE_DTYPE))])
+    last_attached_ix = floor.last_attached_ix()
+    with open(path + '.tmp', 'wb') as output:
+        np.savez(output, version=np.array(LAYOUT_VERSION), tiles=tiles,
+                 cushions=cushion_records(floor.cushion_list(), widened(CUSHION_DTYPE)),
+                 last_attached_ix=np.array(-1 if last_attached_ix is None else last_attached_ix),
+                 trace=trace_records(border_tile_trace, widened(TRACE_DTYPE)),
+                 inner=np.array(inner), schedule=tile_dispatcher.remaining(),
+                 count=np.array(tile_dispatcher.count), chain_key=np.array(chain_key or ''))
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(input):
+    """ The arrays of a checkpoint saved to input, with the scalars as Python values """
+    with np.load(input) as checkpoint:
+        version = int(checkpoint['version'])
+        if version != LAYOUT_VERSION:
+            raise ValueError('checkpoint version %d, expected %d' % (version, LAYOUT_VERSION))
+        last_attached_ix = int(checkpoint['last_attached_ix'])
+        return dict(tiles=checkpoint['tiles'], cushions=checkpoint['cushions'],
+                    last_attached_ix=None if last_attached_ix < 0 else last_attached_ix,
+                    trace=checkpoint['trace'], inner=bool(checkpoint['inner']),
+                    schedule=checkpoint['schedule'], count=int(checkpoint['count']),
+                    chain_key=str(checkpoint['chain_key']))
+
+
+def save_layout_store(path, layout, chunk_size=4.0):
+    """
+    Saves the tiles, cushions and trace arrays of a layout (as load_layout returns them)
+    as a store in the directory path, the tiles chunked into chunk_size squares
+    """
+    tiles = layout['tiles']
+    cells = np.floor(tiles['pos'][:, :2] / chunk_size).astype('<i4')
+    order = np.lexsort((cells[:, 1], cells[:, 0]))
+    cells = cells[order]
+    keys, starts, counts = np.unique(cells, axis=0, return_index=True, return_counts=True)
+    chunks = np.zeros(len(keys), dtype=CHUNK_DTYPE)
+    chunks['cx'], chunks['cy'] = keys[:, 0], keys[:, 1]
+    chunks['start'], chunks['count'] = starts, counts
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'version.npy'), np.array([LAYOUT_VERSION, chunk_size]))
+    np.save(os.path.join(path, 'tiles.npy'), tiles[order])
+    np.save(os.path.join(path, 'chunks.npy'), chunks)
+    np.save(os.path.join(path, 'cushions.npy'), layout['cushions'])
+    np.save(os.path.join(path, 'trace.npy'), layout['trace'])
+
+
+class LayoutStore:
+    """
+    A layout store opened for reading, with its tile records memory mapped, so
+    that only the records of the chunks asked for are ever read
+    """
+    def __init__(self, path):
+        version, self.chunk_size = np.load(os.path.join(path, 'version.npy'))
+        if int(version) != LAYOUT_VERSION:
+            raise ValueError('layout version %d, expected %d' % (version, LAYOUT_VERSION))
+        self.tiles = np.load(os.path.join(path, 'tiles.npy'), mmap_mode='r')
+        self.chunks = np.load(os.path.join(path, 'chunks.npy'))
+        self.chunk_ixs = {(int(cx), int(cy)): ix
+                          for ix, (cx, cy) in enumerate(zip(self.chunks['cx'], self.chunks['cy']))}
+        self.cushions = np.load(os.path.join(path, 'cushions.npy'))
+        self.trace = np.load(os.path.join(path, 'trace.npy'))
+
+    def chunks_in(self, x0, y0, x1, y1):
+        """ (cx, cy) of the chunks holding tiles which may reach into the box x0, y0 - x1, y1 """
+        lo = np.floor((np.array([x0, y0]) - TILE_REACH) / self.chunk_size)
+        hi = np.floor((np.array([x1, y1]) + TILE_REACH) / self.chunk_size)
+        within = ((self.chunks['cx'] >= lo[0]) & (self.chunks['cx'] <= hi[0]) &
+                  (self.chunks['cy'] >= lo[1]) & (self.chunks['cy'] <= hi[1]))
+        return [(int(chunk['cx']), int(chunk['cy'])) for chunk in self.chunks[within]]
+
+    def chunk_tiles(self, chunk):
+        """ The tile records of chunk (cx, cy), read from the store """
+        start, count = self.chunks[self.chunk_ixs[chunk]][['start', 'count']].tolist()
+        return np.array(self.tiles[start:start + count])
+
+
+if __name__ == '__main__':
+    chunk_size = float(sys.argv[3]) if len(sys.argv) > 3 else 4.0
+    save_layout_store(sys.argv[2], load_layout(sys.argv[1]), chunk_size)
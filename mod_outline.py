@@ -0,0 +1,170 @@
+"""
+Compiles the border schedule for a rectilinear outline, rather than hand coding the start
+positions, trajectories and corner events of its tiles (as TileDispenser does for the
+front path).
+
+The outline is the outer edge of the border, its corners in floor units, anti-clockwise,
+starting at its top left corner, where the floor's path_end and path_bord cushions meet,
+and heading south. The border is a band a square tile wide inside it: a square in the
+corner cell at each corner, and along each edge between them, strips, then a short strip
+and squares for what is left, with grout between them. As each tile is pushed back
+against the one before, less than a square left over leaves the square ending the edge
+short of its corner, so each edge is filled from where the square it starts from will
+have settled, and the outline is missed by less than a square at any corner. Except the
+last: the last edge has to line up with the START square, which path_end holds, so the
+square ending the edge before it is pushed on into its corner, against path_end, leaving
+what is left over behind it.
+
+Each tile is flung first against the cushion holding its edge, then along it, back
+against the tile before. The cushion holding an edge is the internal border put up by
+the event of the square at the corner it starts from, which is the direction the edge
+before it heads in (as the border trace records it, see Border_Occluder), on that side
+of the square. At an outer corner that is the new edge's outer side, and at an inner
+corner (an intrusion) its inner side, where the internal border it replaces would
+otherwise have been in the way. The first edge is held by path_bord and its START
+square by path_bord and path_end.
+
+The schedule is compiled in one pass over the edges, straight into the records a
+dispenser keeps its schedule in (see TileDispenser).
+
+    dispenser = OutlineDispenser([(0, 22), (0, 14), (12, 14), (12, 22)], grout_wd)
+"""
+
+import numpy as np
+
+from mod_tiles import KINDS, SCHEDULE_DTYPE, T_Evt, TileDispenser
+
+
+# width of the border band, a square tile's side
+BAND = 2 / 3
+# the tiles filling an edge, longest first, and their lengths
+FILLERS = [('edge_strip', 2.0), ('short_strip', 4 / 3), ('edge_square', BAND)]
+# How far from where it should settle each tile is released, away from the cushion
+# holding its edge (far enough for it to have sunk to the floor before reaching it, or
+# it rides over it) and ahead along it, and how high
+RELEASE_OFF, RELEASE_AHEAD, RELEASE_Z = 1.0, 0.6, 1
+# speeds, per frame, across the floor in x and y and down onto it, as TileDispenser's
+# trajectories have them
+SPEED = np.array([0.060, 0.080])
+SINK = -0.080
+
+DIR_EVENTS = {(0, -1): T_Evt.SOUTH, (1, 0): T_Evt.EAST, (0, 1): T_Evt.NORTH, (-1, 0): T_Evt.WEST}
+
+
+def edge_dirs(corners):
+    """ Unit direction of each edge of the outline, from corner i to corner i + 1 """
+    edges = np.roll(corners, -1, axis=0) - corners
+    lengths = np.abs(edges).sum(axis=1)
+    if ((edges != 0).sum(axis=1) != 1).any():
+        raise ValueError('outline edges must be horizontal or vertical, and not empty')
+    dirs = (edges / lengths[:, None]).astype(int)
+    turns = dirs[:, 0] * np.roll(dirs, -1, axis=0)[:, 1] - dirs[:, 1] * np.roll(dirs, -1, axis=0)[:, 0]
+    if (turns == 0).any():
+        raise ValueError('outline corners must each turn a right angle')
+    return dirs, lengths
+
+
+def fill(length, grout_width):
+    """ Kinds and lengths of the tiles filling length, longest first, with grout between them """
+    kinds, tile_lengths = [], []
+    room = length + grout_width
+    for kind, tile_length in FILLERS:
+        count = int(np.floor(room / (tile_length + grout_width) + 1e-9))
+        kinds += [kind] * count
+        tile_lengths += [tile_length] * count
+        room -= count * (tile_length + grout_width)
+    return kinds, np.array(tile_lengths)
+
+
+def compile_border(outline, grout_width, bounds=None):
+    """
+    The schedule of the border tiles along outline (see the module docstring), as an
+    array of SCHEDULE_DTYPE records. If the floor's far corner (x1, y1) is given as bounds,
+    the outline must start at its top left corner, (0, y1), and stay on it, as the
+    cushions holding the tiles only span the floor.
+    """
+    corners = np.asarray(outline, dtype=float)
+    if len(corners) < 4:
+        raise ValueError('an outline needs at least 4 corners')
+    if bounds is not None:
+        x1, y1 = bounds
+        if tuple(corners[0]) != (0, y1):
+            raise ValueError('outline must start where path_end and path_bord meet, at (0, %g)' % y1)
+        if (corners < 0).any() or (corners[:, 0] > x1).any() or (corners[:, 1] > y1).any():
+            raise ValueError('outline leaves the floor, from (0, 0) to (%g, %g)' % (x1, y1))
+    dirs, lengths = edge_dirs(corners)
+    x, y = corners[:, 0], corners[:, 1]
+    if (x * np.roll(y, -1) - np.roll(x, -1) * y).sum() <= 0:
+        raise ValueError('outline must be anti-clockwise')
+    if tuple(dirs[0]) != (0, -1) or tuple(dirs[-1]) != (-1, 0):
+        raise ValueError('outline must start at its top left corner, heading south')
+
+    # the centre of the corner cell at each corner, which is where the bands of the edges
+    # either side of it, a square wide inside them (on the left), meet
+    outward = np.column_stack([dirs[:, 1], -dirs[:, 0]])
+    cells = corners - (np.roll(outward, 1, axis=0) + outward) * BAND / 2
+    before = np.roll(dirs, 1, axis=0)
+
+    # path_bord and path_end hold the START square a joint in from the outline
+    start = cells[0] + np.array([grout_width, -grout_width])
+    ends = np.vstack([cells[1:-1], start, start])
+
+    schedule = []
+    # where the square the edge starts from will have settled
+    settled = start
+    for k in range(len(corners)):
+        d, hold = dirs[k], before[k]
+        # the tiles between that square and the corner cell the edge ends at
+        room = (ends[k] - settled) @ d - BAND - 2 * grout_width
+        kinds, tile_lengths = fill(room, grout_width)
+        centres = BAND / 2 + np.cumsum(tile_lengths + grout_width) - tile_lengths / 2
+        positions = settled + np.outer(centres, d)
+        phases = [90 if d[0] == 0 and kind != 'edge_square' else 0 for kind in kinds]
+        events = [T_Evt.NONE] * len(kinds)
+        # +1 for tiles pushed on along the edge, rather than back against the tile before
+        pushes = [-1] * len(kinds)
+        if k == 0:
+            kinds, phases, events = ['edge_square'] + kinds, [0] + phases, [T_Evt.START] + events
+            positions = np.vstack([settled, positions])
+            pushes = [-1] + pushes
+        if k < len(corners) - 1:
+            # the square ending the edge, pushed back against its last tile, or on into the
+            # corner before the last edge, whose event puts up the next edge's cushion
+            if k == len(corners) - 2:
+                settled = settled + d * ((ends[k] - settled) @ d)
+                pushes.append(1)
+            else:
+                settled = settled + d * (BAND + grout_width + (tile_lengths + grout_width).sum())
+                pushes.append(-1)
+            kinds, phases, events = kinds + ['edge_square'], phases + [0], events + [DIR_EVENTS[tuple(d)]]
+            positions = np.vstack([positions, settled])
+        pushes = np.array(pushes)
+
+        records = np.zeros(len(kinds), dtype=SCHEDULE_DTYPE)
+        records['kind'] = [KINDS.index(kind) for kind in kinds]
+        records['phase'] = phases
+        # the square at the corner an edge ends at is released level with where it should
+        # settle, as past the corner there may already be a cushion, as path_end is past
+        # the top right one, or short of it if it is pushed on. So is the last tile, the
+        # START square being past it.
+        ahead = np.where(np.array(events) == T_Evt.NONE, RELEASE_AHEAD, np.minimum(-pushes, 0) * RELEASE_AHEAD)
+        if k == len(corners) - 1:
+            ahead[-1] = 0
+        records['xyz'][:, :2] = positions - hold * RELEASE_OFF + np.outer(ahead, d)
+        records['xyz'][:, 2] = RELEASE_Z
+        # against the holding cushion, then along it
+        records['n'] = 2
+        records['traj'][:, 0] = [*(hold * SPEED * 3), SINK * 3]
+        records['traj'][:, 1, :2] = (hold + np.outer(pushes, d)) * SPEED * 1.5
+        records['traj'][:, 1, 2] = SINK * 1.5
+        records['event'] = [event.value for event in events]
+        schedule.append(records)
+    return np.concatenate(schedule)
+
+
+class OutlineDispenser(TileDispenser):
+    """
+    Dispenses the border tiles compiled for a rectilinear outline (see compile_border)
+    """
+    def __init__(self, outline, grout_width, bounds=None):
+        self.load(compile_border(outline, grout_width, bounds))
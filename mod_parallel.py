@@ -0,0 +1,362 @@
+"""
+Lays the border tiles region by region in a pool of worker processes, for long paths
+where the border sections only meet at fixed seams.
+
+The paths of the border tiles are the boxes their collision spheres sweep, plus
+FLIGHT_MARGIN, as the analytic solver works them out (see mod_flight), with the whole
+border laid analytically first, in a worker, which is quick next to the pusher. The
+schedule is split into regions whose tiles' paths don't meet those of any other region,
+and whose internal borders don't cross the paths of another's tiles while they are up.
+A border is a ring, each tile laid against the one before, so those regions are cut into
+sections, at the tiles ending edges. Each section meets the sections before it only at
+seams: the tiles of theirs its tiles' paths meet, which are placed where the solver
+settled them, before its own tiles are laid among them.
+
+Each region is laid headless in a fresh worker process, with its own Surface and
+collision world. The settled positions are merged back, and the border is replayed in
+schedule order, placing each tile where its region settled it, which rebuilds the
+cushions and the Border_Occluder trace just as laying the whole border in one go does.
+As the seams are where the solver settled them, rather than the pusher, the tiles laid
+against them are off from where laying the border in one go puts them by as much as the
+two engines differ, well under a grout width. The inner tiles are then laid as usual.
+When the whole border is the one region, the layout is just laid as usual, in this
+process.
+
+Any border schedule can be laid, the zoo floor's TileDispenser one by default, or one
+compiled for an outline (see mod_outline).
+
+    python mod_parallel.py [layout_path] [workers]
+"""
+import sys
+import multiprocessing
+from direct.task import Task
+from panda3d.core import loadPrcFileData
+
+from mod_tiles import T_Evt, TileDispenser
+from mod_flight import FLIGHT_MARGIN, INF, FlungTile, unbounded_region
+
+
+# Events which throw up an internal border across the whole surface, along x = const
+# or along y = const
+X_BORDERS = [T_Evt.EAST, T_Evt.EA_PT, T_Evt.WEST, T_Evt.WE_PT]
+Y_BORDERS = [T_Evt.NORTH, T_Evt.NO_PT, T_Evt.SOUTH, T_Evt.SO_PT]
+
+
+def flight_region(tile_spec):
+    """
+    Boxes a scheduled tile can end up in, unbounded in the directions it travels in, and
+    the internal border it throws up, if any, for when its path hasn't been worked out
+    """
+    x, y, _ = tile_spec['xyz']
+    box = unbounded_region(tile_spec, (x - FLIGHT_MARGIN, x + FLIGHT_MARGIN, y - FLIGHT_MARGIN, y + FLIGHT_MARGIN))
+    event = T_Evt(int(tile_spec['event']))
+    x_lo, x_hi, y_lo, y_hi = box
+    if event in X_BORDERS:
+        return [box, (x_lo, x_hi, -INF, INF)]
+    if event in Y_BORDERS:
+        return [box, (-INF, INF, y_lo, y_hi)]
+    return [box]
+
+
+def meetings(schedule, paths):
+    """
+    The pairs of scheduled tiles (ix1, ix2, across) whose paths meet, ix1 < ix2, or where
+    the path of one (ix2) meets the internal border the other (ix1) puts up or takes down
+    (across). The boxes are swept through in order of x, so that each is only checked
+    against those it overlaps in x.
+    """
+    # boxes (x_lo, x_hi, y_lo, y_hi), and the tile each belongs to, the tiles' own first
+    boxes = [path[0] for path in paths]
+    owners = list(range(len(schedule)))
+    for ix, path in enumerate(paths):
+        boxes += path[1:]
+        owners += [ix] * len(path[1:])
+
+    # those still overlapping in x as the sweep reaches each box's x_lo
+    active = []
+    for box_ix in sorted(range(len(boxes)), key=lambda box_ix: boxes[box_ix][0]):
+        x_lo, _, y_lo, y_hi = boxes[box_ix]
+        active = [other_ix for other_ix in active if boxes[other_ix][1] > x_lo]
+        for other_ix in active:
+            # borders crossing each other don't bring their tiles together
+            if min(other_ix, box_ix) >= len(schedule):
+                continue
+            if boxes[other_ix][2] < y_hi and y_lo < boxes[other_ix][3]:
+                if max(other_ix, box_ix) < len(schedule):
+                    yield min(other_ix, box_ix), max(other_ix, box_ix), False
+                else:
+                    tile_ix, border_ix = sorted([other_ix, box_ix])
+                    yield owners[border_ix], tile_ix, True
+        active.append(box_ix)
+
+
+def next_events(schedule):
+    # Each internal border stays up until the next event, which puts up another or takes
+    # it down: event index -> the index of the next
+    events = [ix for ix, tile_spec in enumerate(schedule) if T_Evt(int(tile_spec['event'])) != T_Evt.NONE]
+    return dict(zip(events, events[1:]))
+
+
+def split_regions(schedule, paths=None, count=None):
+    """
+    Partitions the indices of a border schedule into regions which can be laid
+    independently, each in schedule order, the regions in order of their first tile.
+    paths are each tile's path box, then the boxes of the internal border it puts up or
+    takes down, if any (see solve_paths), or else its flight_region. Tiles whose paths,
+    or borders, meet are in the same region, unless count is given, when regions of more
+    than 1 / count of the schedule are cut into sections of about that, after the tile
+    ending an edge (one with an event). Those meet the regions before them at seams (see
+    region_seams).
+    """
+    if paths is None:
+        paths = [flight_region(tile_spec) for tile_spec in schedule]
+    region_of = list(range(len(schedule)))
+
+    def find(ix):
+        while region_of[ix] != ix:
+            region_of[ix] = region_of[region_of[ix]]
+            ix = region_of[ix]
+        return ix
+
+    def join(ix1, ix2):
+        region_of[find(ix2)] = find(ix1)
+
+    # A region laid on its own keeps an internal border up until its own next event, so
+    # a tile meeting it after then has to be laid with the event that took it down
+    next_event = next_events(schedule)
+    for ix1, ix2, across in meetings(schedule, paths):
+        join(ix1, ix2)
+        if across and next_event.get(ix1, ix2) < ix2:
+            join(ix1, next_event[ix1])
+
+    regions = {}
+    for ix in range(len(schedule)):
+        regions.setdefault(find(ix), []).append(ix)
+    if count is None:
+        return sorted(regions.values())
+
+    size = -(-len(schedule) // count)
+    sections = []
+    for region in sorted(regions.values()):
+        sections.append([])
+        for ix in region:
+            sections[-1].append(ix)
+            if len(sections[-1]) >= size and schedule[ix]['event'] != T_Evt.NONE.value and ix != region[-1]:
+                sections.append([])
+    return sections
+
+
+def region_seams(schedule, paths, regions):
+    """
+    For each region, the tiles of other regions before its own whose paths, or borders,
+    its tiles' paths meet, which are placed where they were worked out to settle, as
+    fixed seams, before its own tiles are laid among them. An internal border one meets
+    but which was taken down before it is reached takes with it the event that took it
+    down.
+    """
+    region_of = {ix: k for k, region in enumerate(regions) for ix in region}
+    next_event = next_events(schedule)
+    seams = [set() for _ in regions]
+    for ix1, ix2, across in meetings(schedule, paths):
+        # a border put up after the tile has been laid is no matter
+        if ix1 > ix2:
+            continue
+        k = region_of[ix2]
+        seams[k].add(ix1)
+        if across and next_event.get(ix1, ix2) < ix2:
+            seams[k].add(next_event[ix1])
+    return [sorted(ix for ix in seam if region_of[ix] != k) for k, seam in enumerate(seams)]
+
+
+class RegionDispenser(TileDispenser):
+    """
+    Dispenses just one region's share of a border schedule, and the seam tiles it is laid
+    among (see region_seams), noting the schedule index of each tile in the order they
+    are popped up. Only the tiles up to the next seam tile are dispensed, as the tiles
+    around it have to wait for it to be placed.
+    """
+    def __init__(self, schedule, region_ixs, seam_ixs=()):
+        self.ixs = sorted([*region_ixs, *seam_ixs])
+        self.load(schedule[self.ixs])
+        self.seam_records = [i for i, ix in enumerate(self.ixs) if ix in set(seam_ixs)]
+        self.popped_ixs = []
+
+    def popup(self, ix=0):
+        self.popped_ixs.append(self.ixs[self.record_ix(ix)])
+        return super().popup(ix)
+
+    def next_seam(self):
+        # the record of the next seam tile, or the end of the schedule
+        return next((i for i in self.seam_records if not self.popped[i]), len(self.schedule))
+
+    def seam_due(self):
+        return self.left and self.head == self.next_seam()
+
+    def tiles_left(self):
+        end = self.next_seam()
+        if end == len(self.schedule):
+            return self.left
+        return end - self.head - sum(self.popped[self.head:end])
+
+
+def region_app(schedule, region_ixs, seams=None):
+    """
+    A MyApp class laying just one region of a border schedule as the border, among its
+    seams, {schedule index: (pos, hpr)}, for a worker
+    """
+    # No sound either, so that no audio device is needed
+    loadPrcFileData('headless', 'audio-library-name null')
+    from mod_key_move import MyApp
+    seams = seams or {}
+
+    class RegionApp(MyApp):
+        def lay_border_tiles(self):
+            self.dispenser = RegionDispenser(schedule, region_ixs, list(seams))
+            self.lay_run(None)
+
+        def lay_run(self, task):
+            # Places the seam tiles due, then lays the tiles up to the next
+            dispenser = self.dispenser
+            while dispenser.seam_due():
+                flight = FlungTile(*dispenser.popup())
+                flight.tile.np.setPosHpr(*seams[dispenser.popped_ixs[-1]])
+                self.settle_flung_tile(flight, self.border_tile_nps, None)
+            if dispenser.left:
+                self.lay_schedule(dispenser, self.border_tile_nps, None, self.lay_run)
+            else:
+                self.laid = True
+
+        def all_tiles_settled(self, settled_tile_nps, duplicator):
+            # only once the region is finished
+            if self.dispenser.left:
+                self.in_flight = []
+            else:
+                super().all_tiles_settled(settled_tile_nps, duplicator)
+
+    return RegionApp
+
+
+def lay_headless(app_class, engine):
+    # uncached and uncheckpointed, as the workers' schedules are only parts of the whole
+    app = app_class(headless=True, layout_path=None, engine=engine, cache_path=None,
+                    checkpoint_path=None)
+    while not app.laid:
+        app.taskMgr.step()
+    return app
+
+
+def poses(app):
+    # {schedule index: (pos, hpr)} of the tiles a RegionApp has laid, and its seams, in
+    # the order they were popped up
+    return {ix: (tuple(tile_np.getPos()), tuple(tile_np.getHpr()))
+            for ix, tile_np in zip(app.dispenser.popped_ixs, app.border_tile_nps)}
+
+
+def solve_paths(schedule):
+    """
+    Worker: lays a border schedule analytically, returning each tile's path box, then the
+    boxes of the internal border it puts up or takes down, if any, as FlightScheduler
+    works them out among the cushions up as it is released, and where it settled
+    """
+    class PathApp(region_app(schedule, list(range(len(schedule))))):
+        paths = []
+
+        def solvePrismTask(self, tile_dispatcher, settled_tile_nps, duplicator, task):
+            scheduler = self.flight_scheduler
+            while tile_dispatcher.tiles_left():
+                box = scheduler.path_box(tile_dispatcher, 0, [])
+                event = T_Evt(int(tile_dispatcher.peek()['event']))
+                self.paths.append([box] + scheduler.event_boxes(event, box))
+                flight = FlungTile(*tile_dispatcher.popup())
+                flight.tile.np.setPos(self.settler.rest_position(flight.tile, flight.trajectory, self.floor.cushions))
+                self.settle_flung_tile(flight, settled_tile_nps, duplicator)
+            self.all_tiles_settled(settled_tile_nps, duplicator)
+            return Task.done
+
+    app = lay_headless(PathApp, 'analytic')
+    settled = poses(app)
+    return app.paths, [settled[ix] for ix in range(len(schedule))]
+
+
+def lay_region(schedule, region_ixs, seams, engine='pusher'):
+    """ Worker: lays one region of a border schedule among its seams, returning {schedule index: (pos, hpr)} """
+    settled = poses(lay_headless(region_app(schedule, region_ixs, seams), engine))
+    return {ix: settled[ix] for ix in region_ixs}
+
+
+def split_schedule(schedule, count=None):
+    """
+    The regions of a border schedule (see split_regions), its paths solved in a worker
+    process, and the seams of each, {schedule index: (pos, hpr)}
+    """
+    # a fresh process, as there can only be one ShowBase per process
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        paths, solved = pool.apply(solve_paths, (schedule,))
+    regions = split_regions(schedule, paths, count)
+    return regions, [{ix: solved[ix] for ix in seam_ixs} for seam_ixs in region_seams(schedule, paths, regions)]
+
+
+def lay_regions(schedule, regions, seams, workers=None, engine='pusher'):
+    """
+    Lays the regions of a border schedule among their seams in up to workers processes
+    (default, one per core), merged into {schedule index: (pos, hpr)}
+    """
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, maxtasksperchild=1) as pool:
+        results = pool.starmap(lay_region, [(schedule, region_ixs, region_seams, engine)
+                                            for region_ixs, region_seams in zip(regions, seams)])
+    settled = {}
+    for result in results:
+        settled.update(result)
+    return settled
+
+
+def lay_parallel(layout_path='zoo.npz', workers=None, engine='pusher', schedule=None):
+    """
+    Lays the regions of the border schedule (default, the zoo floor's) in up to workers
+    processes (default, one per core), then the inner tiles, and stashes the layout
+    """
+    loadPrcFileData('headless', 'audio-library-name null')
+    from mod_key_move import MyApp
+
+    if schedule is None:
+        schedule = TileDispenser(MyApp.top_limit).schedule
+    regions, seams = split_schedule(schedule, workers or multiprocessing.cpu_count())
+    settled = lay_regions(schedule, regions, seams, workers, engine) if len(regions) > 1 else None
+
+    class MergedApp(MyApp):
+        def lay_border_tiles(self):
+            tile_dispatcher = RegionDispenser(schedule, list(range(len(schedule))))
+            if settled is None:
+                # nothing to lay alongside anything else
+                self.lay_schedule(tile_dispatcher, self.border_tile_nps, None, self.lay_inner_tiles)
+                return
+            self.taskMgr.add(self.replayPrismTask, "spinPrismTask", extraArgs=[
+                tile_dispatcher, self.border_tile_nps, None],
+                             appendTask=True, uponDeath=self.lay_inner_tiles)
+
+        def replayPrismTask(self, tile_dispatcher, settled_tile_nps, duplicator, task):
+            # Places the whole schedule, in order, where the regions settled each tile
+            ix = 0
+            while tile_dispatcher.tiles_left():
+                flight = FlungTile(*tile_dispatcher.popup())
+                pos, hpr = settled[ix]
+                flight.tile.np.setPosHpr(pos, hpr)
+                self.settle_flung_tile(flight, settled_tile_nps, duplicator)
+                ix += 1
+            self.all_tiles_settled(settled_tile_nps, duplicator)
+            return Task.done
+
+    app = MergedApp(headless=True, layout_path=layout_path, engine=engine, cache_path=None,
+                    checkpoint_path=None)
+    while not app.laid:
+        app.taskMgr.step()
+    return app, regions
+
+if __name__ == '__main__':
+    layout_path = sys.argv[1] if len(sys.argv) > 1 else 'zoo.npz'
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    app, regions = lay_parallel(layout_path, workers)
+    print('laid', len(app.border_tile_nps), 'border tiles in', len(regions), 'regions and',
+          len(app.inner_tile_nps), 'inner tiles into', layout_path)
@@ -0,0 +1,320 @@
+"""
+Analytic alternative to flinging a tile frame by frame in MyApp.spinPrismTask.
+
+A flung tile only collides through its collision spheres (at its corners, plus the
+hopper at its c of g) with the cushions, which are capsules: segments with a radius.
+Each frame the pusher pushes the tile back out along the contact normal, so the tile
+slides along a cushion (or the floor, once it has sunk) with whatever part of its
+velocity doesn't point into it, and comes to rest when its velocity points into the
+cushions it is touching, or when its velocity has decayed away.
+
+So instead of stepping, each trajectory leg is swept in closed form: the spheres move
+in a straight line to the first contact with a capsule or the floor, the velocity is
+projected onto whatever is being touched, and the sweep carries on for the remaining
+time. The legs are timed as spinPrismTask times them: each cushion the tile starts
+touching throws an 'into' event and moves it onto the next leg, until there have been
+as many as there are legs, and then the velocity decays for count_threshold frames.
+
+Only the cushions near the tile's start are swept against, those the surface's
+CushionGrid has in a box round it, which is widened for as long as the tile's path
+leaves it, so a tile isn't swept against every cushion on the surface.
+"""
+
+import numpy as np
+from panda3d.core import Point3
+
+# Contacts are taken to be touching within this distance
+TOUCH_TOL = 1e-6
+# Tiles are laid to butt up exactly against their neighbours' cushions, so a sphere
+# only counts as hitting a capsule once it overlaps it by more than this much, which
+# swamps the rounding in the positions the pusher leaves tiles at
+CONTACT_SLOP = 1e-4
+# Cosine of the angle of approach below which a sphere only grazes a capsule, as a
+# tile does when sliding past a neighbour which it exactly butts up against
+GRAZE_COS = 1e-3
+# A tile moving at less than this angle (in radians) to the capsules it touches slides
+# straight along their sides
+PARALLEL_TOL = 1e-9
+# Caps the number of contacts swept through in one sweep
+MAX_CONTACTS = 32
+# Frames allowed for a leg to make its next hit
+MAX_LEG_FRAMES = 10000
+# The floor, which tiles sink onto, but which doesn't count as a hit
+FLOOR_NORMAL = np.array([0.0, 0.0, 1.0])
+# How far round a tile's start the box of cushions it is first swept against reaches,
+# and then how far round the path it took, for as long as its path leaves the box
+WINDOW = 4.0
+
+
+def tile_spheres(flung_tile):
+    """ Offsets (from the tile position) and radii, in world units, of a tile's collision spheres """
+    mat = flung_tile.np.getMat(render)
+    pos = flung_tile.np.getPos(render)
+    offsets = []
+    radii = []
+    for solid in flung_tile.collider.node().getSolids():
+        centre = mat.xformPoint(solid.getCenter()) - pos
+        # the pusher sizes the sphere by its x axis, ignoring the z scale
+        radius = mat.xformVec((solid.getRadius(), 0, 0)).length()
+        offsets.append(list(centre))
+        radii.append(radius)
+    return np.array(offsets), np.array(radii)
+
+
+def cushion_arrays(cushions):
+    p1s = np.array([list(cushion['vec'].p1) for cushion in cushions], dtype=float).reshape(-1, 3)
+    p2s = np.array([list(cushion['vec'].p2) for cushion in cushions], dtype=float).reshape(-1, 3)
+    radii = np.array([cushion['radius'] for cushion in cushions], dtype=float)
+    return p1s, p2s, radii
+
+
+class Capsules:
+    """
+    The segments p1-p2 of the cushions a tile is swept against, with what sweeping needs
+    of them worked out once, rather than at every step of the sweep
+    """
+    def __init__(self, p1s, p2s):
+        self.p1s = p1s
+        self.p2s = p2s
+        self.edge = p2s - p1s
+        self.hyp2 = (self.edge * self.edge).sum(axis=-1)
+        self.length = np.sqrt(self.hyp2)
+        self.along = self.edge / self.length[:, None]
+        # both ends, swept against together
+        self.ends = np.concatenate([p1s, p2s])
+
+    def closest(self, ps, js=None):
+        """
+        As tile_poly.closest_on_segments, the closest points on each segment to each of
+        the (n, 3) points ps, as an (n, m, 3) array, or with js, only those on segment
+        js[i] to ps[i], as an (n, 3) array
+        """
+        if js is None:
+            p1s, p2s, edge, hyp2 = self.p1s, self.p2s, self.edge, self.hyp2
+            rel = ps[:, None, :] - p1s[None, :, :]
+        else:
+            p1s, p2s, edge, hyp2 = self.p1s[js], self.p2s[js], self.edge[js], self.hyp2[js]
+            rel = ps - p1s
+        t = (rel * edge).sum(axis=-1) / hyp2
+        closest = p1s + t[..., None] * edge
+        closest = np.where((t < 0)[..., None], p1s, closest)
+        return np.where((t > 1)[..., None], p2s, closest)
+
+    def straight_run(self, centres, moving, touching):
+        """
+        Frames for which the spheres at centres, moving at moving, can slide straight along
+        the sides of the capsules they are touching (spheres x capsules), before the first
+        of them reaches the end of its side, or 0 if they aren't all moving along the sides
+        """
+        i, j = np.nonzero(touching)
+        along = self.along[j]
+        rate = along @ moving
+        across = moving - rate[:, None] * along
+        if (across * across).sum(axis=-1).max() > PARALLEL_TOL ** 2 * (moving @ moving):
+            return 0
+        w = ((centres[i] - self.p1s[j]) * along).sum(axis=-1)
+        if ((w < 0) | (w > self.length[j])).any():
+            return 0
+        with np.errstate(divide='ignore'):
+            to_end = np.where(rate > 0, (self.length[j] - w) / rate, -w / rate)
+        return to_end.min()
+
+
+def first_contact(centres, reach, disp, capsules, free):
+    """
+    Fraction of the displacement disp after which the first of the spheres at centres
+    comes within reach (spheres x capsules) of one of the Capsules, ignoring the pairs
+    which are not free (already touching). Returns inf if none do.
+    """
+    along, length = capsules.along, capsules.length
+    disp_len = np.sqrt(disp @ disp)
+
+    def earliest(f, d, d_dot_d, reach):
+        # earliest s at which |f + s d| = reach, approaching from outside, and not just
+        # grazing, where the rate of approach, sqrt(disc) / (2 reach), is all but zero
+        b = 2 * (f * d).sum(axis=-1)
+        c = (f * f).sum(axis=-1) - reach * reach
+        disc = b * b - 4 * d_dot_d * c
+        s = (-b - np.sqrt(disc)) / (2 * d_dot_d)
+        approach_cos = np.sqrt(disc) / (2 * reach * disp_len)
+        return np.where((c >= 0) & (b < 0) & (approach_cos > GRAZE_COS), s, np.inf)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # the cylindrical sides of the capsules, found square on to the segments
+        rel = centres[:, None, :] - capsules.p1s[None, :, :]
+        rel_perp = rel - (rel * along).sum(axis=-1)[..., None] * along
+        disp_perp = disp - (disp @ along.T)[..., None] * along
+        s_side = earliest(rel_perp, disp_perp, (disp_perp * disp_perp).sum(axis=-1), reach)
+        w = ((rel + s_side[..., None] * disp) * along).sum(axis=-1)
+        s_side = np.where((w >= 0) & (w <= length), s_side, np.inf)
+
+        # and the round ends, p1s then p2s
+        s_ends = earliest(centres[:, None, :] - capsules.ends[None, :, :], disp, disp @ disp,
+                          np.concatenate([reach, reach], axis=1))
+
+    m = len(length)
+    s = np.minimum(np.minimum(s_side, s_ends[:, :m]), s_ends[:, m:])
+    s = np.where(free & (s >= 0), s, np.inf)
+    return s.min() if s.size else np.inf
+
+
+def slide(velocity, normals):
+    """
+    The velocity once any part of it into the touched surfaces (with outward normals,
+    one to a row) has been removed, or zero if it is wedged between them
+    """
+    into = normals @ velocity
+    if (into >= 0).all():
+        return velocity
+    # sliding along the first of them that keeps clear of the rest
+    alongs = velocity - np.minimum(into, 0)[:, None] * normals
+    clear = (alongs @ normals.T >= -TOUCH_TOL).all(axis=1)
+    if clear.any():
+        return alongs[clear.argmax()]
+    # sliding along the crease between pairs of them
+    for i, n in enumerate(normals):
+        for m in normals[i + 1:]:
+            # n x m, written out, as np.cross is slow for single vectors
+            crease = np.array([n[1] * m[2] - n[2] * m[1], n[2] * m[0] - n[0] * m[2], n[0] * m[1] - n[1] * m[0]])
+            if crease @ crease < TOUCH_TOL:
+                continue
+            along = (velocity @ crease) / (crease @ crease) * crease
+            if (normals @ along >= -TOUCH_TOL).all():
+                return along
+    return np.zeros(3)
+
+
+class SettleSolver:
+    """
+    Works out where a flung tile comes to rest, given its trajectory and the cushions
+    currently on the surface, without stepping the pusher
+    """
+    def __init__(self, count_threshold, veloc_attn_ratio):
+        # Frames of motion at the final velocity once the hit threshold is reached, which
+        # decays by veloc_attn_ratio each frame for count_threshold frames, and one more
+        self.decay_frames = sum(veloc_attn_ratio ** k for k in range(count_threshold + 1))
+
+    def rest_position(self, flung_tile, trajectory, cushions):
+        """ Where flung_tile comes to rest among cushions, the surface's CushionGrid """
+        offsets, radii = tile_spheres(flung_tile)
+        pos = np.array(list(flung_tile.np.getPos(render)), dtype=float)
+        legs = [np.array(list(v), dtype=float) for v in trajectory]
+        rest, _ = self.solve(pos, legs, offsets, radii, cushions)
+        return Point3(*rest)
+
+    def solve(self, pos, legs, offsets, radii, cushions):
+        """
+        Where the tile at pos, with collision spheres at offsets from it, comes to rest
+        among cushions (a CushionGrid), and the x, y box (lows, highs) its spheres sweep
+        on the way there
+        """
+        # how far the spheres reach from the tile's position
+        extent = (np.abs(offsets[:, :2]) + radii[:, None]).max(axis=0)
+        low, high = pos[:2] - WINDOW, pos[:2] + WINDOW
+        while True:
+            near = cushions.within(*low, *high)
+            rest, path = self.solve_among(pos, legs, offsets, radii, near)
+            path_low, path_high = path[:, :2].min(axis=0) - extent, path[:, :2].max(axis=0) + extent
+            # the cushions left out can't have been touched if the path kept inside the box
+            if ((path_low >= low) & (path_high <= high)).all() or len(near) == len(cushions):
+                return rest, (path_low, path_high)
+            low, high = np.minimum(low, path_low) - WINDOW, np.maximum(high, path_high) + WINDOW
+
+    def solve_among(self, pos, legs, offsets, radii, cushions):
+        # Where the tile comes to rest among the cushions listed, and the positions it
+        # passes through in straight lines on the way
+        p1s, p2s, cradii = cushion_arrays(cushions)
+        capsules = Capsules(p1s, p2s)
+        reach = radii[:, None] + cradii[None, :] - CONTACT_SLOP
+        path = []
+
+        hits = 0
+        while hits < len(legs):
+            velocity = legs[min(hits, len(legs) - 1)]
+            pos, frames, new_hits = self.sweep(pos, velocity, MAX_LEG_FRAMES, offsets, reach,
+                                               capsules, until_hit=True, path=path)
+            if not new_hits:
+                # never hits anything, so would never settle
+                break
+            # the rest of the frame in which the hit happened is still at the old velocity
+            pos, _, _ = self.sweep(pos, velocity, np.ceil(frames) - frames, offsets, reach, capsules,
+                                   path=path)
+            hits += new_hits
+        else:
+            velocity = legs[-1] if len(legs) > 1 else legs[0]
+            pos, _, _ = self.sweep(pos, velocity, self.decay_frames, offsets, reach, capsules, path=path)
+
+        path.append(pos)
+        return np.array([pos[0], pos[1], max(pos[2], 0)]), np.array(path)
+
+    def sweep(self, pos, velocity, frames, offsets, reach, capsules, until_hit=False, path=None):
+        """
+        Moves the tile at pos with velocity (per frame) for frames, sliding along the
+        cushions and floor it meets, or only until it starts touching another cushion
+        if until_hit. Returns where it ends up, after how many frames, and how many
+        cushions it started touching then. The positions it moves through in straight
+        lines from are added to path, if given.
+        """
+        elapsed = 0
+        contacts = 0
+        while elapsed < frames and contacts < MAX_CONTACTS:
+            if path is not None:
+                path.append(pos)
+            centres = pos + offsets
+            gaps = centres[:, None, :] - capsules.closest(centres)
+            dists = np.sqrt((gaps * gaps).sum(axis=-1))
+            touching = dists - reach <= TOUCH_TOL
+            normals = gaps[touching] / dists[touching][:, None]
+            on_floor = pos[2] <= TOUCH_TOL
+            if on_floor:
+                normals = np.vstack([normals, FLOOR_NORMAL])
+
+            moving = slide(velocity, normals)
+            if not moving.any():
+                break
+            # sliding round a curved cushion is stepped a frame at a time, as the pusher
+            # keeps the tile on it, where a straight line would leave it, but along the
+            # straight sides of the capsules it goes as far as it can in one
+            run = np.inf if not touching.any() else capsules.straight_run(centres, moving, touching)
+            step = min(frames - elapsed, max(1, run))
+            disp = moving * step
+            s = first_contact(centres, reach, disp, capsules, ~touching)
+            s_floor = -pos[2] / disp[2] if disp[2] < 0 and not on_floor else np.inf
+            if min(s, s_floor) >= 1:
+                if run < step:
+                    pos = self.push_out(pos + velocity * step, offsets, reach, capsules, touching)
+                else:
+                    pos = pos + disp
+                elapsed += step
+                continue
+            contacts += 1
+            if s_floor < s:
+                pos = pos + s_floor * disp
+                pos[2] = 0
+                elapsed += s_floor * step
+                continue
+            pos = pos + s * disp
+            elapsed += s * step
+            if until_hit:
+                centres = pos + offsets
+                gaps = centres[:, None, :] - capsules.closest(centres)
+                dists = np.sqrt((gaps * gaps).sum(axis=-1))
+                now_touching = (dists - reach <= TOUCH_TOL).any(axis=0)
+                return pos, elapsed, int((now_touching & ~touching.any(axis=0)).sum())
+        return pos, elapsed, 0
+
+    def push_out(self, pos, offsets, reach, capsules, touching):
+        """ Pushes the tile back out of the cushions it was touching, as the pusher does """
+        pos[2] = max(pos[2], 0)
+        pairs = np.nonzero(touching)
+        for _ in range(len(pairs[0]) + 1):
+            centres = pos[None, :] + offsets[pairs[0]]
+            gaps = centres - capsules.closest(centres, pairs[1])
+            dists = np.sqrt((gaps * gaps).sum(axis=-1))
+            depths = reach[pairs] - dists
+            k = depths.argmax()
+            if depths[k] <= TOUCH_TOL:
+                break
+            pos = pos + depths[k] * gaps[k] / dists[k]
+        pos[2] = max(pos[2], 0)
+        return pos
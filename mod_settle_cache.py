@@ -0,0 +1,60 @@
+"""
+Persistent cache of the poses tiles settled at in earlier runs, content addressed by the
+schedule, so that a run whose schedule only differs after some point replays the tiles
+before it rather than flinging them all again.
+
+Each schedule entry is keyed by a hash chained from the key of the entry before it, and
+the first from a hash of everything else a settled pose depends on: the engine and its
+parameters, the Surface's parameters, and the tile catalogue, the source of the Tiles
+class, which holds the shapes, tip radius and each kind's scale. So an entry's key
+changes if anything ahead of it in the schedule does, and the cached poses of the longest
+unchanged prefix of a schedule can be replayed. The inner tile schedule is chained on
+from the border schedule's last key.
+"""
+
+import hashlib
+import inspect
+import shelve
+
+from mod_tiles import KINDS, Tiles
+
+
+def spec_repr(tile_spec):
+    return repr((KINDS[tile_spec['kind']], float(tile_spec['phase']), tuple(tile_spec['xyz'].tolist()),
+                 [tuple(v) for v in tile_spec['traj'][:tile_spec['n']].tolist()],
+                 bool(tile_spec['short']), int(tile_spec['event'])))
+
+
+class SettleCache:
+    def __init__(self, path, params):
+        self.db = shelve.open(path)
+        catalogue = inspect.getsource(Tiles)
+        self.base_key = hashlib.sha256((repr(params) + catalogue).encode()).hexdigest()
+
+    def key_schedule(self, schedule, chain_key):
+        """ Keys each entry of schedule, chained on from chain_key, returning the last key """
+        for tile_spec in schedule:
+            chain_key = hashlib.sha256((chain_key + spec_repr(tile_spec)).encode()).hexdigest()
+            tile_spec['cache_key'] = chain_key
+        return chain_key
+
+    def cached_length(self, schedule):
+        """ Number of (keyed) entries at the head of schedule with a cached pose """
+        for length, tile_spec in enumerate(schedule):
+            if tile_spec['cache_key'] not in self.db:
+                return length
+        return len(schedule)
+
+    def pose(self, key):
+        return self.db[key]
+
+    def store(self, key, pos, hpr):
+        # written out by sync, or close, rather than on every store
+        if key not in self.db:
+            self.db[key] = (tuple(pos), tuple(hpr))
+
+    def sync(self):
+        self.db.sync()
+
+    def close(self):
+        self.db.close()
@@ -1,8 +1,11 @@
 from panda3d.core import *
 from itertools import product
+import math
+import numpy as np
 
 
 from mod_tiles import T_Evt
+from mod_telemetry import telemetry
 import tile_poly as tile
 
 UNHIDE = True
@@ -10,20 +13,34 @@ UNHIDE = True
 DBP = True
 # DBP = False
 
+# Each role in the collisions has a bit of its own in the collide masks. The cushions
+# are only ever collided into, and the tiles in flight only collide into the cushions,
+# not into each other, nor into any visible geometry (which is into GeomNode's default
+# collide mask), so the traverser never tests the pairs that could not matter.
+ROLES = ['flying_tile', 'path_end', 'path_bord', 'path_internal', 'path_tile']
+ROLE_MASKS = {role: BitMask32.bit(bit) for bit, role in enumerate(ROLES)}
+FLYING_FROM_MASK = BitMask32.allOff()
+for role in ROLES[1:]:
+    FLYING_FROM_MASK |= ROLE_MASKS[role]
+# path_tile cushions, as many as the tiles laid, are grouped under a node for each square
+# bin of floor this wide, so the traverser passes over the bins away from a tile in
+# flight by their bounds, rather than testing every cushion
+CUSHION_BIN = 4.0
+
 
 class Surface:
     """
     Surface on which tiles are laid.
     Contains the following node paths:
-    moveable_np: all collision tubes are attached to this
+    moveable_np: all collision tubes are attached to this, under collision_np
     - those for initial path borders: path_end, path_bord
-    - those attached to laid tiles: path_tile
+    - those attached to laid tiles: path_tile, binned by where they are
     - internal borders: path_internal
     floor_np: textured concrete base. Can be suppressed without
         any effect on laying the tiles, so essentially optional.
     """
     def __init__(self, x1, y1,
-                 grout_wd, tip_rad):
+                 grout_wd, tip_rad, collision_np=None):
         # Path to front door
         self.x0 = 0
         self.x1 = x1
@@ -32,8 +49,14 @@ class Surface:
         self.grout_wd = grout_wd
         self.tip_rad = tip_rad
 
-        self.movable_np = render.attachNewNode("movable")
+        self.movable_np = (collision_np or render).attachNewNode("movable")
+        # bin -> the node its path_tile cushions are under
+        self.bin_nps = {}
+        # the cushions, in the order they were attached
+        self.cushion_nps = []
         self.last_attached_node = None
+        # for the telemetry
+        self.cushions_added = 0
 
         # Add cushions to movable
         self.cushion_rad = 0.2
@@ -41,21 +64,19 @@ class Surface:
         projection = self.grout_wd - self.tip_rad
         self.offset = self.cushion_rad - projection
 
+        # how close a tile corner must be to a cushion, beyond its radius, to be embraced by it
+        self.closeness_tol = 0.3
+        self.cushions = CushionGrid(cell_size=1.0, reach=self.closeness_tol)
+
         # top end only of concrete path
         for y in [self.y1 + self.offset]:
             wallSolid = CollisionTube(self.x0, y, 0, self.x1, y, 0, self.cushion_rad)
-            wallNode = CollisionNode("path_end")
-            wallNode.addSolid(wallSolid)
-            wall = self.movable_np.attachNewNode(wallNode)
-            if UNHIDE: wall.show()
+            self.add_cushion("path_end", wallSolid)
 
         # left border only of concrete path
         for x in [self.x0 - self.offset]:
             wallSolid = CollisionTube(x, self.y0, 0, x, self.y1, 0, self.cushion_rad)
-            wallNode = CollisionNode("path_bord")
-            wallNode.addSolid(wallSolid)
-            wall = self.movable_np.attachNewNode(wallNode)
-            if UNHIDE: wall.show()
+            self.add_cushion("path_bord", wallSolid)
 
         self.concrete_base()
 
@@ -78,9 +99,32 @@ class Surface:
         # Rotate card downwards from vertical to horizontal
         self.floor_np.setHpr(0, -90.0, -0)
 
+    def add_cushion(self, name, wallSolid):
+        """ Attaches a collision tube to movable and enters it in the cushion registry """
+        wallNode = CollisionNode(name)
+        wallNode.addSolid(wallSolid)
+        wallNode.setFromCollideMask(BitMask32.allOff())
+        wallNode.setIntoCollideMask(ROLE_MASKS[name])
+        wall = self.cushion_parent(name, wallSolid).attachNewNode(wallNode)
+        self.cushions.add(wall, wallSolid)
+        self.cushion_nps.append(wall)
+        self.cushions_added += 1
+        if UNHIDE: wall.show()
+        return wall
+
+    def cushion_parent(self, name, wallSolid):
+        # The long borders go straight under movable, and a tile's cushions under the bin
+        # their middle is in
+        if name != 'path_tile':
+            return self.movable_np
+        middle = (wallSolid.point_a + wallSolid.point_b) / 2
+        cell = (math.floor(middle.x / CUSHION_BIN), math.floor(middle.y / CUSHION_BIN))
+        if cell not in self.bin_nps:
+            self.bin_nps[cell] = self.movable_np.attachNewNode('bin_%d_%d' % cell)
+        return self.bin_nps[cell]
+
     def internal_border(self, to_dir, on_tile):
-        corners = on_tile.corner_nodes()
-        xys = [np.getPos(self.movable_np) for np in corners]
+        xys = on_tile.corners_in(self.movable_np)
         # Reverse the offset if defending a point
         point_events = [T_Evt.EA_PT, T_Evt.WE_PT, T_Evt.NO_PT, T_Evt.SO_PT]
         offset = -self.offset if to_dir in point_events else self.offset
@@ -96,22 +140,20 @@ class Surface:
         elif to_dir in [T_Evt.SOUTH, T_Evt.SO_PT]:
             y = min([p.y for p in xys]) - self.grout_wd - offset
             wallSolid = CollisionTube(self.x0, y, 0, self.x1, y, 0, self.cushion_rad)
-        wallNode = CollisionNode("path_internal")
-        wallNode.addSolid(wallSolid)
-        wall = self.movable_np.attachNewNode(wallNode)
+        wall = self.add_cushion("path_internal", wallSolid)
         self.remove_last_attached()
         self.last_attached_node = wall
-        if UNHIDE: wall.show()
 
     def remove_last_attached(self):
         if self.last_attached_node:
+            self.cushions.remove(self.last_attached_node)
             self.last_attached_node.node().clearSolids()
             self.last_attached_node.clear()
 
     def collision_nodes(self):
         """ for debug """
         print('called')
-        collision_nodeCollection = self.movable_np.findAllMatches('*')
+        collision_nodeCollection = self.movable_np.findAllMatches('**/path_*')
         for nodePath in collision_nodeCollection:
             print('a node')
             collision_node = nodePath.node()
@@ -123,9 +165,49 @@ class Surface:
                 print(solid)
                 print(solid.point_a, solid.point_b)
 
+    def cushion_list(self):
+        """ (name, point_a, point_b, radius) of every cushion still attached to movable """
+        cushions = []
+        for nodePath in self.attached_nps():
+            for solid in nodePath.node().getSolids():
+                cushions.append((nodePath.name, Point3(solid.point_a), Point3(solid.point_b), solid.radius))
+        return cushions
+
+    def last_attached_ix(self):
+        """ Index in cushion_list of the last internal border attached, if it is still there """
+        cushion_nps = [nodePath for nodePath in self.attached_nps()
+                       for solid in nodePath.node().getSolids()]
+        if self.last_attached_node and self.last_attached_node in cushion_nps:
+            return cushion_nps.index(self.last_attached_node)
+        return None
+
+    def attached_nps(self):
+        # in the order they were attached, rather than as found under the bins, without
+        # the internal borders since removed
+        return [nodePath for nodePath in self.cushion_nps if not nodePath.isEmpty()]
+
+    def restore_cushions(self, cushion_list, last_attached_ix=None):
+        """
+        Replaces all the cushions attached to movable with those in cushion_list, the one
+        at last_attached_ix, if given, being the last internal border attached
+        """
+        for nodePath in self.movable_np.findAllMatches('**/path_*'):
+            self.cushions.remove(nodePath)
+            nodePath.removeNode()
+        for bin_np in self.bin_nps.values():
+            bin_np.removeNode()
+        self.bin_nps = {}
+        self.cushion_nps = []
+        self.last_attached_node = None
+        for ix, (name, point_a, point_b, radius) in enumerate(cushion_list):
+            wall = self.add_cushion(name, CollisionTube(point_a, point_b, radius))
+            if ix == last_attached_ix:
+                self.last_attached_node = wall
+
     def gut_collision_nodes(self):
-        collision_nodeCollection = self.movable_np.findAllMatches('path_[ti]*')
+        collision_nodeCollection = self.movable_np.findAllMatches('**/path_[ti]*')
         for nodePath in collision_nodeCollection:
+            self.cushions.remove(nodePath)
             collision_node = nodePath.node()
             collision_node.clearSolids()
 
@@ -162,82 +244,165 @@ class Surface:
         return abs(d1) < closeness and abs(d2) < closeness
 
     def tile_wall(self, flung_tile, clipped):
-        # Get the floor based locations of all the corner nodes of the tile after it has settled
-        corners = flung_tile.corner_nodes()
-        xys = [np.getPos(self.movable_np) for np in corners]
-        if DBP: print('xxx', xys)
+        # Get the floor based locations of all the corners of the tile after it has settled
+        xys = flung_tile.corners_in(self.movable_np)
+        if DBP and telemetry.enabled: telemetry.debug('xxx', xys)
         self.prism_wall(xys, clipped)
 
     def prism_wall(self, xys, clipped):
-        closeness_tol = 0.3
+        # Only the cushions registered near the tile's corners can embrace them
+        collision_cylinders = self.cushions.near(xys)
+        if DBP and telemetry.enabled: telemetry.debug(collision_cylinders)
 
-        collision_cylinders = []
-        collision_nodeCollection = self.movable_np.findAllMatches('path*')
-        for nodePath in collision_nodeCollection:
-            collision_node = nodePath.node()
-            solids = collision_node.getSolids()
-            if solids:
-                # At most one collision solid per node
-                solid = solids[0]
-                collision_cylinders.append(dict(
-                    vec=tile.Vector2D(solid.point_a, solid.point_b), radius=solid.radius))
-        if DBP: print(collision_cylinders)
-
-        # First we build up lists of sets identifying the (up to 2) cylinders which
-        # embrace the p1s and p2s of the line segments of the tile edges.
-        # Note p2 of a preceding segment is the same as p1 of its succeeding segment.
-        p1_embs = []
-        p2_embs = []
-        for i, (p1, p2) in enumerate(zip(xys, tile.rotate_by_1(xys))):
-
-            # Start with empty sets for the p1 and p2 of this segment, then append
-            # an index to any collision cylinder which embraces the p1 and then the p2
-            p1_embs.append(set())
-            p2_embs.append(set())
-            for j, cyl in enumerate(collision_cylinders):
-                closeness = cyl['radius'] + closeness_tol
-                if self.embraced(p1, cyl['vec'], closeness):
-                    p1_embs[i].add(j)
-                if self.embraced(p2, cyl['vec'], closeness):
-                    p2_embs[i].add(j)
-
-            # Test for intersections in the 2 sets of cylinders which embrace p1 and
-            # p2 for this segment. If there are no intersections, then the segment
-            # is exposed to collisions from any subsequently arriving tile, and
-            # so requires a new cushion to protect it.
-            if DBP: print("p1_embs[i]", p1_embs[i])
-            if DBP: print("p2_embs[i]", p2_embs[i])
-            if not(p1_embs[i] & p2_embs[i]):
-                # No intersections of cylinders embracing p1 and p2 but
-                # still need to test if any of the cylinders in the p1 set are
-                # collinear with any of the cylinders in the p2 set
-                any_collinear = False
-                for pair in product(p1_embs[i], p2_embs[i]):
-                    any_collinear = any_collinear or self.collinear(collision_cylinders[pair[0]]['vec'],
-                                                                    collision_cylinders[pair[1]]['vec'],
-                                                                    closeness=0.1)
-                if not any_collinear:
-                    # need a new cushion for this segment
-                    if DBP: print('seg', i, p1, p2)
-                    seg = tile.Vector2D(p1, p2)
-                    norm = seg.norm_2D()
-                    tan = seg.tan_2D()
-                    if DBP: print('new normals x y', norm.x, norm.y)
-                    # pull back in opposite direction to normal
-                    q1x = p1.x - norm.x * self.offset
-                    q1y = p1.y - norm.y * self.offset
-                    q2x = p2.x - norm.x * self.offset
-                    q2y = p2.y - norm.y * self.offset
-                    # trim length if exposed or clipped
-                    if not p1_embs[i] or clipped:
-                        q1x += tan.x * self.offset
-                        q1y += tan.y * self.offset
-                    if not p2_embs[i] or clipped:
-                        q2x -= tan.x * self.offset
-                        q2y -= tan.y * self.offset
-
-                    wallSolid = CollisionTube(q1x, q1y, p1.z, q2x, q2y, p2.z, self.cushion_rad)
-                    wallNode = CollisionNode("path_tile")
-                    wallNode.addSolid(wallSolid)
-                    wall = self.movable_np.attachNewNode(wallNode)
-                    if UNHIDE: wall.show()
+        # Decide every edge of the tile against every nearby cylinder at once. The p1 of
+        # edge i is corner i and its p2 is corner i + 1, so the (up to 2) cylinders which
+        # embrace the p1s and p2s of the edges are both rows of one corners x cylinders
+        # matrix, with the p2 rows rotated by 1.
+        corners = tile.xy_array(xys)
+        cyl_p1s = tile.xy_array([cyl['vec'].p1 for cyl in collision_cylinders])
+        cyl_p2s = tile.xy_array([cyl['vec'].p2 for cyl in collision_cylinders])
+        closeness = np.array([cyl['radius'] for cyl in collision_cylinders]) + self.closeness_tol
+        corner_embs = tile.dist_from_segments(corners, cyl_p1s, cyl_p2s) < closeness
+        p1_embs = corner_embs
+        p2_embs = np.roll(corner_embs, -1, axis=0)
+
+        # A cylinder (row) is collinear with another (column) if both ends of the other
+        # lie on the infinite line through the first
+        collinear = ((tile.dist_from_segments(cyl_p1s, cyl_p1s, cyl_p2s, infinite=True).T < 0.1) &
+                     (tile.dist_from_segments(cyl_p2s, cyl_p1s, cyl_p2s, infinite=True).T < 0.1))
+
+        # Test for intersections in the 2 sets of cylinders which embrace p1 and
+        # p2 for each edge. If there are no intersections, then the segment
+        # is exposed to collisions from any subsequently arriving tile, and
+        # so requires a new cushion to protect it, unless any of the cylinders
+        # in the p1 set are collinear with any of the cylinders in the p2 set.
+        shared = (p1_embs & p2_embs).any(axis=1)
+        any_collinear = np.einsum('ij,jk,ik->i', p1_embs.astype(int), collinear.astype(int),
+                                  p2_embs.astype(int)) > 0
+        exposed = ~(shared | any_collinear)
+        if DBP and telemetry.enabled:
+            telemetry.debug("p1_embs", [set(np.flatnonzero(embs)) for embs in p1_embs])
+            telemetry.debug("p2_embs", [set(np.flatnonzero(embs)) for embs in p2_embs])
+
+        p1s = corners
+        p2s = np.roll(corners, -1, axis=0)
+        norms = tile.norms_2D(p1s, p2s)
+        tans = tile.tans_2D(p1s, p2s)
+        for i in np.flatnonzero(exposed):
+            # need a new cushion for this segment
+            p1, p2 = xys[i], xys[(i + 1) % len(xys)]
+            if DBP and telemetry.enabled: telemetry.debug('seg', i, p1, p2)
+            norm, tan = norms[i], tans[i]
+            if DBP and telemetry.enabled: telemetry.debug('new normals x y', norm[0], norm[1])
+            # pull back in opposite direction to normal
+            q1 = p1s[i] - norm * self.offset
+            q2 = p2s[i] - norm * self.offset
+            # trim length if exposed or clipped
+            if not p1_embs[i].any() or clipped:
+                q1 += tan * self.offset
+            if not p2_embs[i].any() or clipped:
+                q2 -= tan * self.offset
+
+            wallSolid = CollisionTube(*q1, p1.z, *q2, p2.z, self.cushion_rad)
+            self.add_cushion("path_tile", wallSolid)
+
+
+class CushionGrid:
+    """
+    Registry of the cushions (collision tubes) attached to a surface's movable_np,
+    binned in a uniform grid of square cells, so that finding the cushions which
+    might embrace a tile's corners only touches the cells under those corners
+    rather than every cushion on the surface. Each cushion is entered in every
+    cell overlapped by its tube widened by its radius plus reach, so reach must be
+    at least the largest closeness tolerance that will be asked of it. Cells are
+    hashed rather than allocated, so cushions outside the surface extents need no
+    special care.
+    """
+    def __init__(self, cell_size, reach):
+        self.cell_size = cell_size
+        self.reach = reach
+        # cell -> {cushion key: cushion}
+        self.cells = {}
+        # cushion key -> cells it was entered in
+        self.cells_of = {}
+        # numbers the cushions in the order they were registered
+        self.registered = 0
+        # the x, y box (x_lo, y_lo, x_hi, y_hi) of each cushion added or removed, in
+        # turn, so that what has changed where since can be told (see changed_within)
+        self.changes = []
+
+    def cell_range(self, lo, hi):
+        return range(math.floor(lo / self.cell_size), math.floor(hi / self.cell_size) + 1)
+
+    def add(self, wall_np, solid):
+        # keyed on the node, as a NodePath's key isn't kept once its NodePaths have gone
+        key = wall_np.node()
+        # copies, as the solid's own points go when its node is gutted
+        a, b = Point3(solid.point_a), Point3(solid.point_b)
+        cushion = dict(vec=tile.Vector2D(a, b), radius=solid.radius, seq=self.registered)
+        self.registered += 1
+        reach = solid.radius + self.reach
+        cells = list(product(self.cell_range(min(a.x, b.x) - reach, max(a.x, b.x) + reach),
+                             self.cell_range(min(a.y, b.y) - reach, max(a.y, b.y) + reach)))
+        for cell in cells:
+            self.cells.setdefault(cell, {})[key] = cushion
+        self.cells_of[key] = cells
+        self.changes.append((min(a.x, b.x) - reach, min(a.y, b.y) - reach,
+                             max(a.x, b.x) + reach, max(a.y, b.y) + reach))
+
+    def remove(self, wall_np):
+        key = wall_np.node()
+        cells = self.cells_of.pop(key, [])
+        if cells:
+            cushion = self.cells[cells[0]][key]
+            a, b = cushion['vec'].p1, cushion['vec'].p2
+            reach = cushion['radius'] + self.reach
+            self.changes.append((min(a.x, b.x) - reach, min(a.y, b.y) - reach,
+                                 max(a.x, b.x) + reach, max(a.y, b.y) + reach))
+        for cell in cells:
+            del self.cells[cell][key]
+
+    def near(self, xys):
+        """ Cushions entered in the cells under any of the points xys, each listed once """
+        found = {}
+        for p in xys:
+            cell = (math.floor(p.x / self.cell_size), math.floor(p.y / self.cell_size))
+            found.update(self.cells.get(cell, {}))
+        return list(found.values())
+
+    def within(self, x_lo, y_lo, x_hi, y_hi):
+        """
+        Cushions entered in the cells overlapping the box, each listed once, in the order
+        they were registered. Any cushion which comes within reach of the box is among them.
+        """
+        found = {}
+        xs, ys = self.cell_range(x_lo, x_hi), self.cell_range(y_lo, y_hi)
+        if len(xs) * len(ys) > len(self.cells):
+            # a box bigger than the cells there are, as of a path flying off, is looked
+            # up the other way round
+            for (x, y), cell in self.cells.items():
+                if x in xs and y in ys:
+                    found.update(cell)
+        else:
+            for cell in product(xs, ys):
+                found.update(self.cells.get(cell, {}))
+        return sorted(found.values(), key=lambda cushion: cushion['seq'])
+
+    def version(self):
+        """ Count of the changes so far, to ask changed_within about later """
+        return len(self.changes)
+
+    def changed_within(self, version, x_lo, y_lo, x_hi, y_hi):
+        """ Whether any cushion coming within reach of the box has been added or removed since version """
+        return any(c_x_lo < x_hi and x_lo < c_x_hi and c_y_lo < y_hi and y_lo < c_y_hi
+                   for c_x_lo, c_y_lo, c_x_hi, c_y_hi in self.changes[version:])
+
+    def all(self):
+        """ Every registered cushion, each listed once """
+        found = {}
+        for cell in self.cells.values():
+            found.update(cell)
+        return list(found.values())
+
+    def __len__(self):
+        return len(self.cells_of)
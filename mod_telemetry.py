@@ -0,0 +1,78 @@
+"""
+Telemetry for laying tiles, which the DBP debug output of each module is routed through
+rather than printed, and which MyApp records each settled tile's statistics in, by topic:
+
+    tile   name, kind, frames to settle, collisions, cushions created and the traverser
+           time spent on it while in flight (its share of each frame's traversal)
+    debug  what used to be printed, as a message
+
+Each topic's records are kept in a ring buffer of its last capacity records, so that the
+debug messages don't crowd out the tile statistics, and are also written to a JSON-lines
+sink, if one is open. A debug message is formatted as print would have, since
+some of what is passed changes afterwards, but isn't written to stdout, which is what made
+the printing slow. Telemetry is disabled until it is wanted, as formatting what is passed
+still isn't free, and while it is disabled, recording costs nothing but the call.
+
+    from mod_telemetry import telemetry
+    telemetry.enabled = True
+    telemetry.open_sink('laying.jsonl')
+"""
+
+import json
+import time
+from collections import defaultdict, deque
+
+
+class Telemetry:
+    def __init__(self, capacity=10000, enabled=False, echo=False):
+        # topic -> ring buffer of its records
+        self.records = defaultdict(lambda: deque(maxlen=capacity))
+        self.enabled = enabled
+        # print debug messages too, as DBP used to
+        self.echo = echo
+        self.sink = None
+
+    def record(self, topic, **fields):
+        if not self.enabled:
+            return
+        fields['topic'] = topic
+        fields['t'] = time.perf_counter()
+        self.records[topic].append(fields)
+        if self.sink:
+            self.write(fields)
+
+    def debug(self, *args):
+        if not self.enabled:
+            return
+        message = ' '.join(str(arg) for arg in args)
+        if self.echo:
+            print(message)
+        self.record('debug', message=message)
+
+    def open_sink(self, path):
+        """ Writes every record from now on to path, as JSON lines """
+        self.close_sink()
+        self.sink = open(path, 'w')
+
+    def close_sink(self):
+        if self.sink:
+            self.sink.close()
+            self.sink = None
+
+    def write(self, fields):
+        self.sink.write(json.dumps(fields, default=str) + '\n')
+
+    def dump(self, path):
+        """ Writes the records in the ring buffers to path, as JSON lines, in the order they were made """
+        sink, self.sink = self.sink, open(path, 'w')
+        for fields in sorted((fields for records in self.records.values() for fields in records),
+                             key=lambda fields: fields['t']):
+            self.write(fields)
+        self.sink.close()
+        self.sink = sink
+
+    def tile_records(self):
+        return list(self.records['tile'])
+
+
+telemetry = Telemetry()
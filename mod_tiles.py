@@ -1,6 +1,6 @@
 import math
+import numpy as np
 from panda3d.core import *
-from collections import deque
 from enum import Enum
 
 import tile_poly as tile
@@ -29,6 +29,16 @@ class T_Evt(Enum):
     SO_PT = 10
 
 
+# Tile kinds are the names of the Tiles methods which make them
+KINDS = ['cnr_tri', 'edge_tri', 'off_edge_diamond', 'edge_diamond',
+         'edge_strip', 'short_strip', 'edge_square']
+# A schedule entry: the kind of tile, its phase, where it is released, up to 3
+# trajectory legs, and the settle cache key, if any (see mod_settle_cache)
+SCHEDULE_DTYPE = np.dtype([('kind', 'u1'), ('phase', '<f8'), ('xyz', '<f8', 3), ('n', 'u1'),
+                           ('traj', '<f8', (3, 3)), ('short', '?'), ('event', 'u1'),
+                           ('cache_key', 'U64')])
+
+
 class Tiles:
     """
     Collection of methods for generating different kinds of tiles. Some, such as the
@@ -102,6 +112,9 @@ class TileDispenser:
     Creates a schedule of tiles to dispense for the border tiles. Also contains all the methods
     for the inner tiles, but they're not invoked here. Instead the inner tile methods are invoked
     in a subclass, TileDispenser2.
+
+    The schedule is an array of SCHEDULE_DTYPE records, which popup reads in place, rather
+    than a list of dicts, so that dispensing a tile only makes the tile.
     """
     up_lf = [Vec3(0.0, 0.080, -0.080) * 3, Vec3(-0.060, 0.080, -0.080) * 1.5]
     up_hl = [Vec3(0.0, 0.080, -0.080) * 3, Vec3(-0.060, 0.020, -0.080) * 1.5]
@@ -115,8 +128,11 @@ class TileDispenser:
     dn_rt = [Vec3(0.0, -0.080, -0.080) * 3, Vec3(0.060, -0.080, -0.080) * 1.5]
     up_rt_lf = [Vec3(0.0, 0.080, -0.080) * 3, Vec3(0.060, 0.080, -0.080) * 1.5, Vec3(-0.060, 0.080, -0.080) * 1.5]
 
+    # only a schedule resumed from a checkpoint has been dispensed from before
+    resumed = False
+
     def __init__(self, top_y):
-        self.schedule = deque()
+        self.entries = []
 
         self.left_edge(top_y - 5)
 
@@ -151,43 +167,80 @@ class TileDispenser:
         self.right_edge(top_y - 4.3)
         self.top_edge(top_y - 3, traj=self.up_lf)
 
-        self.count = 0
+        self.load(self.entries)
+
+    def load(self, records, count=0):
+        # Tiles can be popped up from a little way ahead of the next (see FlightScheduler),
+        # so those popped are marked, and head is the first not yet popped
+        self.schedule = np.array(records, dtype=SCHEDULE_DTYPE)
+        self.popped = bytearray(len(self.schedule))
+        self.head = 0
+        self.left = len(self.schedule)
+        self.count = count
 
     def whole_row(self, y):
         print('yywh1', y)
         z = 1
-        self.schedule.append(dict(shape=Tiles.off_edge_diamond, phase=45, xyz=(2.5,y,z), traj=self.up_lf, short=True, event=T_Evt.EA_PT))
+        self.sched_tile(Tiles.off_edge_diamond, phase=45, xyz=(2.5,y,z), traj=self.up_lf, event=T_Evt.EA_PT, short=True)
         print('yywh2', y)
-        self.schedule.append(dict(shape=Tiles.off_edge_diamond, phase=45, xyz=(5,y,z), traj=self.up_lf, short=True, event=T_Evt.EA_PT))
+        self.sched_tile(Tiles.off_edge_diamond, phase=45, xyz=(5,y,z), traj=self.up_lf, event=T_Evt.EA_PT, short=True)
         print('yywh3', y)
-        self.schedule.append(dict(shape=Tiles.off_edge_diamond, phase=45, xyz=(7.5,y,z), traj=self.up_lf, short=True, event=T_Evt.EA_PT))
+        self.sched_tile(Tiles.off_edge_diamond, phase=45, xyz=(7.5,y,z), traj=self.up_lf, event=T_Evt.EA_PT, short=True)
 
     def split_row(self, y):
         print('yysp1', y)
         z = 1
-        self.schedule.append(dict(shape=Tiles.edge_diamond, phase=45, xyz=(3.5,y,z), traj=self.up_lf, short=True, event=T_Evt.EA_PT))
+        self.sched_tile(Tiles.edge_diamond, phase=45, xyz=(3.5,y,z), traj=self.up_lf, event=T_Evt.EA_PT, short=True)
         print('yysp2', y)
-        self.schedule.append(dict(shape=Tiles.edge_diamond, phase=45, xyz=(6,y,z), traj=self.up_lf, short=True, event=T_Evt.EA_PT))
+        self.sched_tile(Tiles.edge_diamond, phase=45, xyz=(6,y,z), traj=self.up_lf, event=T_Evt.EA_PT, short=True)
         print('yysp3', y)
-        self.schedule.append(dict(shape=Tiles.edge_diamond, phase=45, xyz=(9,y,z), traj=self.up_hl, short=True, event=T_Evt.NONE))
-
-    def sched_tile(self, shape, phase, xyz, traj, event):
-        # short is nearly always False, so cut it out of the (too long) parameter list
-        self.schedule.append(dict(shape=shape, phase=phase, xyz=xyz, traj=traj, short=False, event=event))
-
-    def popup(self):
-        tile_spec = self.schedule.popleft()
+        self.sched_tile(Tiles.edge_diamond, phase=45, xyz=(9,y,z), traj=self.up_hl, event=T_Evt.NONE, short=True)
+
+    def sched_tile(self, shape, phase, xyz, traj, event, short=False):
+        # short is nearly always False, so it comes last in the (too long) parameter list, defaulted
+        legs = [tuple(v) for v in traj]
+        self.entries.append((KINDS.index(shape.__name__), phase, xyz, len(legs),
+                             legs + [(0, 0, 0)] * (3 - len(legs)), short, event.value, ''))
+
+    def record_ix(self, ix=0):
+        # index in the schedule of the ix th tile yet to be popped up
+        i = self.head
+        while self.popped[i] or ix:
+            ix -= not self.popped[i]
+            i += 1
+        return i
+
+    def popup(self, ix=0):
+        i = self.record_ix(ix)
+        self.popped[i] = True
+        self.left -= 1
+        while self.head < len(self.popped) and self.popped[self.head]:
+            self.head += 1
         self.count += 1
-        start_pos = tile_spec['xyz']
-        this_tile = tile_spec['shape'](start_pos, "tile"+str(self.count),
-                                       tile_spec['phase'])
-        trajectory = [Vec3(v) for v in tile_spec['traj']]
-        use_short_cushion = tile_spec['short']
-        event = tile_spec['event']
-        return this_tile, trajectory, use_short_cushion, event
+        # a view of the record, so the settle cache key given it later is kept in the schedule
+        tile_spec = self.schedule[i]
+        # read whole, as reading the fields one at a time is slower
+        kind, phase, xyz, n, traj, use_short_cushion, event, _ = tile_spec.item()
+        kind = KINDS[kind]
+        this_tile = getattr(Tiles, kind)(tuple(xyz.tolist()), "tile"+str(self.count), phase)
+        # tagged, so that duplicates and saved layouts know what they are (see mod_layout)
+        this_tile.np.setTag('kind', kind)
+        this_tile.np.setTag('event', str(event))
+        this_tile.spec = tile_spec
+        trajectory = [Vec3(*v) for v in traj[:n].tolist()]
+        return this_tile, trajectory, use_short_cushion, T_Evt(event)
+
+    def peek(self, ix=0):
+        # the record of a tile yet to be popped up, without making it
+        return self.schedule[self.record_ix(ix)]
 
     def tiles_left(self):
-        return len(self.schedule)
+        return self.left
+
+    def remaining(self):
+        # the records of the tiles yet to be popped up, as a checkpoint keeps them
+        popped = np.frombuffer(self.popped, dtype=bool)
+        return self.schedule[self.head:][~popped[self.head:]]
 
     def bottom_edge(self, y, traj):
         z = 1
@@ -272,9 +325,19 @@ class TileDispenser2(TileDispenser):
     Creates a schedule of tiles to dispense for the inner tiles.
     """
     def __init__(self, top_y):
-        self.schedule = deque()
+        self.entries = []
 
         self.whole_row(top_y - 5)
         self.split_row(top_y - 6)
 
-        self.count = 0
+        self.load(self.entries)
+
+
+class ResumedDispenser(TileDispenser):
+    """
+    Dispenses the tiles left in a schedule when its laying was checkpointed (see mod_layout)
+    """
+    resumed = True
+
+    def __init__(self, schedule, count):
+        self.load(schedule, count)
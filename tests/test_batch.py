@@ -0,0 +1,57 @@
+import os
+import sys
+
+from panda3d.core import NodePath
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mod_batch import TileBatches
+from tile_poly import TilePoly
+
+
+def tiles(parent_np, xs):
+    # a square tile at each x along y = 1
+    prototype = NodePath(TilePoly([(0, 0), (1, 0), (1, 1), (0, 1)], (1, 1, 1, 1)).node)
+    tile_nps = []
+    for x in xs:
+        tile_np = parent_np.attachNewNode('tile')
+        prototype.instanceTo(tile_np)
+        tile_np.setPos(x, 1, 0)
+        tile_nps.append(tile_np)
+    return tile_nps
+
+
+def test_only_dirty_chunk_rebuilt():
+    parent_np = NodePath('parent')
+    # two tiles in each of two chunks
+    tile_nps = tiles(parent_np, [1, 3, 9, 11])
+    batches = TileBatches(parent_np)
+    batches.add(tile_nps)
+    before = dict(batches.batch_nps)
+    assert sorted(before) == [(0, 0), (1, 0)]
+
+    # nudged within its chunk
+    tile_nps[0].setX(2)
+    batches.update(tile_nps[:1])
+    assert batches.batch_nps[(1, 0)] == before[(1, 0)]
+    assert batches.batch_nps[(0, 0)] != before[(0, 0)]
+    assert before[(0, 0)].isEmpty()
+
+    # dropped, as clip_tiles drops a tile beyond the border outline
+    rebuilt = batches.batch_nps[(0, 0)]
+    tile_nps[2].removeNode()
+    batches.update(tile_nps[2:3])
+    assert batches.batch_nps[(0, 0)] == rebuilt
+    assert batches.chunk_tiles[(1, 0)] == [tile_nps[3]]
+    assert len(batches.chunk_of) == 3
+
+
+def test_moved_across_chunks():
+    parent_np = NodePath('parent')
+    tile_nps = tiles(parent_np, [1, 9])
+    batches = TileBatches(parent_np)
+    batches.add(tile_nps)
+    tile_nps[1].setX(3)
+    batches.update(tile_nps[1:])
+    assert list(batches.batch_nps) == [(0, 0)]
+    assert batches.chunk_tiles == {(0, 0): tile_nps}
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+from panda3d.core import NodePath
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mod_clip import ACROSS, INSIDE, OUTSIDE, BorderClip, clip_tiles, visible_copies
+from tile_poly import TilePoly
+
+
+# a 10 x 10 floor, and the occluder bands, 4 wide, round it
+OUTLINE = [(0, 0), (10, 0), (10, 10), (0, 10)]
+BANDS = [[(-4, -4), (14, -4), (14, 0), (-4, 0)],
+         [(10, -4), (14, -4), (14, 14), (10, 14)],
+         [(-4, 10), (14, 10), (14, 14), (-4, 14)],
+         [(-4, -4), (0, -4), (0, 14), (-4, 14)]]
+
+
+# footprints are placed by the tiles' transforms from the top of their graph
+ROOT = NodePath('root')
+
+
+def unit_tile(x, y):
+    tile_np = ROOT.attachNewNode('tile')
+    tile_np.attachNewNode(TilePoly([(0, 0), (1, 0), (1, 1), (0, 1)], (1, 1, 1, 1)).node)
+    tile_np.setPos(x, y, 0)
+    return tile_np
+
+
+def test_sides():
+    clipper = BorderClip(BANDS, OUTLINE)
+    squares = np.array([[(4, 4), (5, 4), (5, 5), (4, 5)],
+                        [(9.5, 4), (10.5, 4), (10.5, 5), (9.5, 5)],
+                        [(4, -20), (5, -20), (5, -19), (4, -19)]], dtype=float)
+    assert list(clipper.sides(squares)) == [INSIDE, ACROSS, OUTSIDE]
+
+
+def test_copy_beyond_band_removed():
+    clipper = BorderClip(BANDS, OUTLINE)
+    tile_nps = [unit_tile(4, 4)]
+    # the tile itself, a copy across the outline, one under the band and one well beyond it
+    offsets = np.array([(0, 0, 0), (0, -4.5, 0), (0, -6, 0), (0, -30, 0)], dtype=float)
+    ixs, kept = visible_copies(tile_nps, (np.zeros(4, dtype=int), offsets), clipper)
+    assert [tuple(offset[:2]) for offset in kept] == [(0, 0), (0, -4.5)]
+
+
+def test_tile_beyond_band_dropped():
+    clipper = BorderClip(BANDS, OUTLINE)
+    tile_nps = [unit_tile(4, 4), unit_tile(4, -0.5), unit_tile(4, -30)]
+    inside, across = tile_nps[0], tile_nps[1]
+    clip_tiles(tile_nps, clipper)
+    assert tile_nps == [inside, across]
+    # only what is left of the tile across the outline, inside it
+    xys = np.array(across.find('+GeomNode').getPythonTag('xys'))
+    assert np.allclose(xys[:, 1].min(), 0.5)
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import mod_duplicator
+from mod_duplicator import fit_lattice, infer_lattice
+
+
+def test_strays_left_out():
+    # a 10 x 10 square lattice, of side 2, with two tiles the pusher left well off it
+    uvs = np.array([(u, v) for u in range(10) for v in range(10)], dtype=float)
+    positions = uvs * 2
+    positions[23] += (0.3, 0.2)
+    positions[67] += (-0.25, 0.3)
+    lattice = infer_lattice(positions)
+    assert np.allclose(sorted(np.abs(lattice.basis).tolist()), [[0, 2], [2, 0]], atol=1e-9)
+    assert np.allclose(lattice.origin % 2, 0, atol=1e-9)
+
+
+def test_strays_left_out_together(monkeypatch):
+    # half a dozen strays are left out in one pass, not refitting once for each
+    uvs = np.array([(u, v) for u in range(10) for v in range(10)], dtype=float)
+    positions = uvs * 2
+    rng = np.random.default_rng(0)
+    strays = rng.choice(len(positions), 6, replace=False)
+    positions[strays] += rng.uniform(0.2, 0.3, (6, 2)) * rng.choice([-1, 1], (6, 2))
+    fits = []
+    monkeypatch.setattr(mod_duplicator, 'fit_lattice', lambda *args: fits.append(args) or fit_lattice(*args))
+    lattice = infer_lattice(positions)
+    assert np.allclose(sorted(np.abs(lattice.basis).tolist()), [[0, 2], [2, 0]], atol=1e-9)
+    assert len(fits) <= 3
@@ -0,0 +1,21 @@
+import os
+import sys
+
+from panda3d.core import loadPrcFileData
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+loadPrcFileData('', 'audio-library-name null')
+
+from mod_key_move import MyApp
+
+
+def test_tiles_flown_together(tmp_path):
+    # the zoo floor's own dispenser schedules, laid by the pusher
+    app = MyApp(headless=True, layout_path=str(tmp_path / 'zoo.npz'), engine='pusher',
+                cache_path=None, checkpoint_path=None)
+    most_in_flight = 0
+    while not app.laid:
+        app.taskMgr.step()
+        most_in_flight = max(most_in_flight, len(app.in_flight))
+    assert 1 < most_in_flight <= app.flight_scheduler.max_in_flight
+    app.destroy()
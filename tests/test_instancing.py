@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+from panda3d.core import NodePath
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mod_instancing import InstancedTiles
+from tile_poly import TilePoly
+
+
+def group(parent_np):
+    # two tiles of one kind and one of another, each kind sharing its prototype
+    prototypes = {kind: NodePath(TilePoly([(0, 0), (1, 0), (1, 1), (0, 1)], (1, 1, 1, 1)).node)
+                  for kind in ['square', 'other']}
+    tile_nps = []
+    for x, kind in enumerate(['square', 'other', 'square']):
+        tile_np = parent_np.attachNewNode('tile')
+        tile_np.setTag('kind', kind)
+        prototypes[kind].instanceTo(tile_np)
+        tile_np.setPos(x * 2, 0, 0)
+        tile_nps.append(tile_np)
+    return tile_nps
+
+
+def test_instances_split_across_buffers():
+    parent_np = NodePath('parent')
+    tile_nps = group(parent_np)
+    # 10 copies of the group, offset in y
+    copy_ixs = np.tile(np.arange(3), 10)
+    copy_offsets = np.repeat(np.arange(1, 11), 3)[:, None] * (0, 2, 0)
+    # buffers of at most 8 instances
+    instances = InstancedTiles(parent_np, tile_nps, (copy_ixs, copy_offsets), max_texels=32)
+    counts = {instanced_nps[0].getName(): [instanced_np.getInstanceCount() for instanced_np in instanced_nps]
+              for instanced_nps in instances.instanced_nps.values()}
+    assert counts == {'instanced_square': [8, 8, 6], 'instanced_other': [8, 3]}
+    assert len(instances) == 33
+    instances.remove()
+    assert not parent_np.findAllMatches('instanced_*')
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mod_outline import BAND, RELEASE_OFF, compile_border
+from mod_tiles import KINDS, T_Evt
+
+GROUT = 2 / 75
+# MyApp's floor
+BOUNDS = (18, 22)
+RECT = [(0, 22), (0, 14), (12, 14), (12, 22)]
+# the rectangle, with its top right corner cut out
+INTRUSION = [(0, 22), (0, 14), (12, 14), (12, 18), (8, 18), (8, 22)]
+
+
+def events(records):
+    return [T_Evt(event) for event in records['event']]
+
+
+def test_rectangle_records():
+    records = compile_border(RECT, GROUT, BOUNDS)
+    E, N = T_Evt, T_Evt.NONE
+    assert events(records) == [E.START] + [N] * 3 + [E.SOUTH] + [N] * 5 + [E.EAST] + [N] * 3 + [E.NORTH] + [N] * 5
+    # a square at each corner, whose event puts up the next edge's cushion, and strips
+    # between them, turned along the edges going north and south
+    squares = records['event'] != N.value
+    assert (records['kind'][squares] == KINDS.index('edge_square')).all()
+    assert (records['kind'][~squares] == KINDS.index('edge_strip')).all()
+    assert list(records['phase'][~squares]) == [90] * 3 + [0] * 5 + [90] * 3 + [0] * 5
+    # released inside the outline, above the floor, and flung down onto it
+    x, y, z = records['xyz'].T
+    assert ((x > 0) & (x < 12) & (y > 14) & (y < 22) & (z > 0)).all()
+    assert (records['n'] == 2).all()
+    assert (records['traj'][:, :2, 2] < 0).all()
+    # the first edge against path_bord, the second against the internal border the
+    # SOUTH square puts up south of it, and so on round
+    holds = np.sign(records['traj'][:, 0, :2])
+    assert [tuple(hold) for hold in holds[[1, 5, 11, 15]]] == [(-1, 0), (0, -1), (1, 0), (0, 1)]
+
+
+def test_intrusion_records():
+    records = compile_border(INTRUSION, GROUT, BOUNDS)
+    E, N = T_Evt, T_Evt.NONE
+    assert events(records) == ([E.START] + [N] * 3 + [E.SOUTH] + [N] * 5 + [E.EAST] + [N] + [E.NORTH]
+                               + [N] * 2 + [E.WEST] + [N] * 2 + [E.NORTH] + [N] * 3)
+    # past the inner corner the tiles are flung west, against the internal border the
+    # WEST square puts up on the inner side of the new edge, and settle in its band
+    after = slice(16, 19)
+    assert (records['traj'][after, 0, 0] < 0).all()
+    assert (records['traj'][after, 0, 1] == 0).all()
+    settled = records['xyz'][after, 0] - RELEASE_OFF
+    assert ((settled > 8 - BAND) & (settled < 8)).all()
+
+
+def test_outline_off_the_floor():
+    with pytest.raises(ValueError):
+        compile_border([(0, 22), (0, -8), (30, -8), (30, 22)], GROUT, BOUNDS)
+    # nor can it start anywhere but where path_end and path_bord meet
+    with pytest.raises(ValueError):
+        compile_border([(0, 20), (0, 14), (12, 14), (12, 20)], GROUT, BOUNDS)
+    # unbounded, as is, for a floor sized to fit
+    assert len(compile_border([(0, 22), (0, -8), (30, -8), (30, 22)], GROUT))
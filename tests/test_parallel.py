@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mod_key_move import MyApp
+from mod_parallel import lay_regions, split_regions, split_schedule
+from mod_tiles import SCHEDULE_DTYPE, T_Evt, TileDispenser
+
+
+def schedule(*tiles):
+    # tiles released at (x, y), flying down with the event given
+    records = np.zeros(len(tiles), dtype=SCHEDULE_DTYPE)
+    for record, (x, y, event) in zip(records, tiles):
+        record['xyz'] = (x, y, 1)
+        record['n'] = 1
+        record['traj'][0] = (0, -0.24, -0.24)
+        record['event'] = event.value
+    return records
+
+
+def test_zoo_border_split():
+    # its tiles' paths all meet those of the tiles either side, so it is cut at seams
+    schedule = TileDispenser(MyApp.top_limit).schedule
+    regions, seams = split_schedule(schedule, 2)
+    assert len(regions) == 2
+    assert sorted(sum(regions, [])) == list(range(len(schedule)))
+    assert not seams[0] and seams[1]
+
+    merged = lay_regions(schedule, regions, seams)
+    serial = lay_regions(schedule, [list(range(len(schedule)))], [{}])
+    assert sorted(merged) == sorted(serial)
+    # off by no more than the solver and the pusher differ
+    for ix, (pos, hpr) in serial.items():
+        assert np.allclose(merged[ix][0], pos, atol=0.002)
+        assert np.allclose(merged[ix][1], hpr)
+
+
+def test_apart_columns_split():
+    regions = split_regions(schedule((0, 10, T_Evt.NONE), (5, 10, T_Evt.NONE), (0, 20, T_Evt.NONE)))
+    assert regions == [[0, 2], [1]]
+
+
+def test_border_across_joins():
+    # the internal border the third throws up, along y = const, crosses both columns
+    regions = split_regions(schedule((0, 10, T_Evt.NONE), (5, 10, T_Evt.NONE), (9, 0, T_Evt.NORTH)))
+    assert regions == [[0, 1, 2]]
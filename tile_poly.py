@@ -1,5 +1,8 @@
 from panda3d.core import *
+from collections import OrderedDict
+from functools import lru_cache
 import math
+import numpy as np
 
 
 class Tile():
@@ -19,40 +22,58 @@ class Tile():
         self.phase = phase
         self.name = p_tag
 
-        if isinstance(face_color, tuple):
-            # if it is a tuple, then it is an RGBA
-            self.gNode = TilePoly(shape, face_color)
-            self.np = render.attachNewNode(self.gNode.node)
-            self.np.setScale(scale, scale, zscale)
-        else:
-            # otherwise assume it is a texture string path
-            white = (1, 1, 1, 1)
-            self.gNode = TilePoly(shape, white)
-            self.np = render.attachNewNode(self.gNode.node)
-            self.np.setScale(scale, scale, zscale)
-            tex1 = loader.loadTexture(face_color)
-            self.np.setTexture(tex1)
+        # The prism geometry (and its texture) is shared between all tiles of the
+        # same kind, so each tile only instances the cached prototype
+        self.gNode, self.prototype = prism_cache.fetch(shape, face_color)
+        self.np = render.attachNewNode("prism")
+        self.np.setScale(scale, scale, zscale)
+        self.prototype.instanceTo(self.np)
         self.np.setPos(pos)
         self.np.setH(phase)
+        # the corners, in the prism's own units (see SettledTile)
+        self.shape = shape
+
+        # The collider of a tile settled earlier, with the same solids, if there is one
+        self.collider_key = (tuple(tuple(xy) for xy in shape), tip_rad, name, tuple(cg), cg_rad, scale, hopper)
+        self.collider = collider_pool.fetch(self.collider_key, self.make_collider)
+        self.collider.reparentTo(self.np)
+        self.collider.setPythonTag("owner", self)
 
+    @staticmethod
+    def make_collider(shape, tip_rad, name, cg, cg_rad, scale, hopper):
         colliderNode = CollisionNode("collider" + name)
         # Add central collider node
         if hopper:
             colliderNode.addSolid(CollisionSphere(*cg, 0, (cg_rad + tip_rad)/scale))
-        # Add the satellite collision solids and location identifier nodes
-        # at the corners, compensating for scale so that the collision solids
-        # are the same size regardless of tile scale
-        for i, corner in enumerate(shape):
+        # Add the satellite collision solids at the corners, compensating for scale so
+        # that the collision solids are the same size regardless of tile scale
+        for corner in shape:
             colliderNode.addSolid(CollisionSphere(*corner, 0, tip_rad/scale))
-            corner_node = self.np.attachNewNode('cnr' + str(i))
-            corner_node.setPos(*corner, 0)
+        collider = NodePath(colliderNode)
+        collider.show()
+        return collider
 
-        self.collider = self.np.attachNewNode(colliderNode)
-        self.collider.setPythonTag("owner", self)
-        self.collider.show()
 
-    def corner_nodes(self):
-        return sorted(self.np.findAllMatches('cnr*'), key=lambda np: np.name)
+class SettledTile():
+    """
+    What is kept of a Tile once it has settled: its NodePath, which holds its transform
+    and instances its prototype, its kind and name, and where its corners ended up,
+    transformed once into render's space, rather than kept as a node per corner to be
+    found and sorted each time they are wanted
+    """
+    __slots__ = ('name', 'kind', 'np', 'corners')
+
+    def __init__(self, tile):
+        self.name = tile.name
+        self.kind = tile.np.getTag('kind')
+        self.np = tile.np
+        mat = tile.np.getMat(render)
+        self.corners = [mat.xformPoint(Point3(x, y, 0)) for x, y in tile.shape]
+
+    def corners_in(self, other_np):
+        """ The corners relative to other_np """
+        to_other = render.getMat(other_np)
+        return [to_other.xformPoint(corner) for corner in self.corners]
 
 
 class TilePoly():
@@ -63,112 +84,244 @@ class TilePoly():
     def __init__(self, shape, face_color):
         # 2D Polygon and its 2D normals
         self.xys = shape[:]
-        xy_normals = calcNormals(self.xys)
-
-        """
-        Coverage triangle indices for the top polygonal face (counter clockwise - illustrated) and
-        bottom polygonal face (clockwise - not shown). Fails for some concave polygons like the cross.
-    
-                    .4        
-                   .  \
-                  .   .3
-                 .  .  |                        
-                . .   .2
-               .. .   /
-              0 --- 1
-        """
-        tri_top = [[0, vix + 1, vix + 2] for vix in range(len(self.xys) - 2)]
-        tri_bot = [[0, vix - 1, vix - 2] for vix in range(len(self.xys), 2, -1)]
-
-        # To hold vertex numbers belonging to the rectangular faces whose normals are xy normals
-        rects = {}
-
-        """
-        Forward (counter clockwise) and back (clockwise) triangle indices for covering rectangular faces
-             2 --------- 3
-             |  b     f  |
-             |     x     |
-             |  f     b  |
-             0 --------- 1
-        """
-        tri_fwd = [[0, 1, 3], [0, 3, 2]]
-        tri_back = [[1, 0, 2], [1, 2, 3]]
-
-        # Bottom face then top face
-        zs = [-1, 1]
-
-        # To hold vertex numbers belonging to the bottom and top faces
-        polys = {}
-
-        # All the vertex positions of the solid
-        xyzs = [xy + [z] for z in zs for xy in self.xys]
-
-        # There must be 3 separate vertices at each vertex position, each with a different normal,
-        # which always points outwards from the solid
-        format = GeomVertexFormat.getV3n3c4()
-        vertexData = GeomVertexData('prism', format, Geom.UHStatic)
-        vertexData.setNumRows(3 * len(xyzs))
-
-        vertices = GeomVertexWriter(vertexData, 'vertex')
-        normals = GeomVertexWriter(vertexData, 'normal')
-        colors = GeomVertexWriter(vertexData, 'color')
-
-        # sat is saturated 8 bits (+ 1) to use as denominator
-        sat = 256
-        white = (1, 1, 1, 1)
-        brown = (0xa0 / sat, 0x98 / sat, 0x7c / sat, 1)
-
-        for pos_num, xyz in enumerate(xyzs):
-            edge_fwd = pos_num % len(self.xys)
-            edge_back = (edge_fwd - 1) % len(self.xys)
-            edge_nums = [edge_back, edge_fwd]
-            for i in range(3):
-                vertices.addData3f(*xyz)
-                vnum = pos_num * 3 + i
-                if i in [0, 1]:
-                    edge_num = edge_nums[i]
-                    normal = xy_normals[edge_num] + [0]
-                    rects.setdefault(edge_num, []).append(vnum)
-                else:
-                    z_vec = xyz[2]
-                    normal = [0, 0, z_vec]
-                    polys.setdefault(z_vec, []).append(vnum)
-
-                normals.addData3f(*normal)
-                color = white if normal[2] == -1 else face_color
-                colors.addData4f(color)
-
-        # Store the tessellation triangles, counter clockwise from front.
-        # Each vertex assigned to a triangle must have a normal vector that
-        # points outwards from the triangle face, which thus determines which
-        # of the 3 possible vertexes to chose at any given vertex position.
-        # Each triangle's vertices should be specified in counter clockwise
-        # order from the perspective of the vertices' normals (i.e. looking at the
-        # outside of the face).
+        xys = np.asarray(self.xys)
+        n = len(self.xys)
+        sources, nexts, indices = prism_template(n)
+
+        # The table the vertex rows are gathered from (see prism_template): the vertex
+        # positions, bottom face then top face, the edge normals, then the face normals
+        table = np.empty((3 * n + 2, 3), dtype=np.float32)
+        table[:2 * n, :2] = np.concatenate([xys, xys])
+        table[:2 * n, 2] = np.repeat([-1, 1], n)
+        diffs = xys[nexts] - xys
+        hyp = np.sqrt(diffs[:, 0] * diffs[:, 0] + diffs[:, 1] * diffs[:, 1])
+        # right hand normal circulating counter clockwise
+        table[2 * n:3 * n, 0] = diffs[:, 1] / hyp
+        table[2 * n:3 * n, 1] = -diffs[:, 0] / hyp
+        table[2 * n:3 * n, 2] = 0
+        table[3 * n:] = FACE_NORMALS
+
+        # Written in bulk into rows with their colours already filled in, rather than a
+        # row at a time through GeomVertexWriters
+        rows = colored_rows(n, face_color).copy()
+        rows[:, :VERTEX_NORMAL_BYTES] = table[sources].reshape(len(rows), 6).view(np.uint8)
+        vertexData = GeomVertexData('prism', PRISM_FORMAT, Geom.UHStatic)
+        vertexData.modifyArrayHandle(0).copyDataFrom(rows)
         primitive = GeomTriangles(Geom.UHStatic)
-
-        # Cover the rectangular faces around the edges
-        for edge_num in rects:
-            # cater for wrap around back to the zeroth edge number
-            tri_ix_pairs = tri_back if edge_num == (len(self.xys) - 1) else tri_fwd
-            for tri_ixs in tri_ix_pairs:
-                vnums = [rects[edge_num][tri_ix] for tri_ix in tri_ixs]
-                primitive.addVertices(*vnums)
-
-        # Cover the polygonal faces on the top and bottom
-        for poly in polys:
-            # Use clockwise indexing on the bottom (negative normal) face and
-            # counter clockwise on the top (positive normal) face
-            faces = tri_bot if poly < 0 else tri_top
-            for tri_ixs in faces:
-                vnums = [polys[poly][tri_ix] for tri_ix in tri_ixs]
-                primitive.addVertices(*vnums)
+        # the same index width that adding them one at a time would have upgraded it to
+        primitive.setIndexType(Geom.NT_uint16 if indices.dtype == np.uint16 else Geom.NT_uint32)
+        primitive.modifyVertices().modifyHandle().copyDataFrom(indices)
 
         geom = Geom(vertexData)
         geom.addPrimitive(primitive)
 
         self.node = GeomNode('prism gnode')
         self.node.addGeom(geom)
+        # for clipping the prism to a part of its polygon (see mod_clip)
+        self.node.setPythonTag('xys', [tuple(xy) for xy in self.xys])
+        self.node.setPythonTag('face_color', face_color)
+
+
+PRISM_FORMAT = GeomVertexFormat.getV3n3c4()
+# the vertex and normal columns lead each row, ahead of the colour
+VERTEX_NORMAL_BYTES = 24
+FACE_NORMALS = [[0, 0, -1], [0, 0, 1]]
+
+
+@lru_cache(maxsize=None)
+def prism_template(n):
+    """
+    What every prism of an n sided polygon shares: the rows of the table TilePoly
+    gathers each vertex's position and normal from, the vertex after each vertex, and
+    the triangles' vertex indices
+    """
+    """
+    Coverage triangle indices for the top polygonal face (counter clockwise - illustrated) and
+    bottom polygonal face (clockwise - not shown). Fails for some concave polygons like the cross.
+    
+                .4        
+               .  \
+              .   .3
+             .  .  |                        
+            . .   .2
+           .. .   /
+          0 --- 1
+    """
+    fan = np.arange(n - 2)
+    tri_top = np.column_stack([np.zeros_like(fan), fan + 1, fan + 2])
+    tri_bot = np.column_stack([np.zeros_like(fan), fan[::-1] + 2, fan[::-1] + 1])
+
+    """
+    Forward (counter clockwise) and back (clockwise) triangle indices for covering rectangular faces
+         2 --------- 3
+         |  b     f  |
+         |     x     |
+         |  f     b  |
+         0 --------- 1
+    """
+    tri_fwd = [[0, 1, 3], [0, 3, 2]]
+
+    # Bottom face then top face
+    zs = [-1, 1]
+
+    # The table rows of all the vertex positions of the solid (the first 2n) and their
+    # normals (the edge normals from row 2n, then the face normals from row 3n). There
+    # must be 3 separate vertices at each vertex position, each with a different normal,
+    # which always points outwards from the solid: the normals of the edges behind and
+    # in front, then the face normal.
+    pos_nums = np.arange(2 * n)
+    pos_edge = pos_nums % n
+    normal_rows = np.empty(6 * n, dtype=int)
+    normal_rows[0::3] = 2 * n + (pos_edge - 1) % n
+    normal_rows[1::3] = 2 * n + pos_edge
+    normal_rows[2::3] = 3 * n + pos_nums // n
+    sources = np.column_stack([np.repeat(pos_nums, 3), normal_rows])
+
+    # Store the tessellation triangles, counter clockwise from front.
+    # Each vertex assigned to a triangle must have a normal vector that
+    # points outwards from the triangle face, which thus determines which
+    # of the 3 possible vertexes to chose at any given vertex position.
+    # Each triangle's vertices should be specified in counter clockwise
+    # order from the perspective of the vertices' normals (i.e. looking at the
+    # outside of the face).
+
+    # Cover the rectangular faces around the edges, starting with the edge which
+    # wraps around back to the zeroth vertex. Taking the vertices of each face in
+    # the order back, forward, back top, forward top makes tri_fwd apply to all
+    # of them, including the wrap around edge which would need the back triangles
+    # if its vertices were taken in vertex number order.
+    edge_nums = np.roll(np.arange(n), 1)
+    rects = np.column_stack([3 * edge_nums + 1,
+                             3 * ((edge_nums + 1) % n),
+                             3 * (n + edge_nums) + 1,
+                             3 * (n + (edge_nums + 1) % n)])
+    rect_tris = rects[:, tri_fwd].reshape(-1, 3)
+
+    # Cover the polygonal faces on the top and bottom, using clockwise indexing on the
+    # bottom (negative normal) face and counter clockwise on the top (positive normal) face
+    polys = {z: 3 * (np.arange(n) + n * zi) + 2 for zi, z in enumerate(zs)}
+    poly_tris = [polys[z][tri_bot if z < 0 else tri_top] for z in zs]
+
+    indices = np.concatenate([rect_tris] + poly_tris).ravel()
+    nexts = (np.arange(n) + 1) % n
+    return sources, nexts, indices.astype(np.uint16 if 6 * n <= 0xffff else np.uint32)
+
+
+@lru_cache(maxsize=256)
+def colored_rows(n, face_color):
+    """
+    The vertex rows of an n sided prism with only their colours written: white on the
+    bottom face and face_color elsewhere. The two colours are packed once by a
+    GeomVertexWriter, so that their bytes are exactly what a row by row write would
+    have produced.
+    """
+    swatch = GeomVertexData('swatch', PRISM_FORMAT, Geom.UHStream)
+    colors = GeomVertexWriter(swatch, 'color')
+    for color in [face_color, (1, 1, 1, 1)]:
+        colors.addData4f(color)
+    stride = PRISM_FORMAT.getArray(0).getStride()
+    swatch_rows = np.frombuffer(memoryview(swatch.getArray(0)), dtype=np.uint8).reshape(2, stride)
+    column = PRISM_FORMAT.getArray(0).getColumn('color')
+    color_bytes = slice(column.getStart(), column.getStart() + column.getTotalBytes())
+    # the face normal vertices of the bottom face
+    is_white = np.zeros(6 * n, dtype=int)
+    is_white[2:3 * n:3] = 1
+    rows = np.zeros((6 * n, stride), dtype=np.uint8)
+    rows[:, color_bytes] = swatch_rows[is_white, color_bytes]
+    return rows
+
+
+class PrismCache():
+    """
+    Least recently used cache of prototype prisms, keyed by shape and face colour
+    (an RGBA tuple) or texture (a string path). Every tile of a given kind instances
+    the same prototype rather than building its own vertex data and triangles.
+    The z scale is not part of the key because it is applied to each tile's own
+    node path, which also carries its collider while it is in flight.
+    Evicting a prototype only drops it from the cache; tiles which already
+    instance it keep it alive in the scene graph.
+    """
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.prototypes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fetch(self, shape, face_color):
+        key = (tuple(tuple(xy) for xy in shape), face_color)
+        if key in self.prototypes:
+            self.hits += 1
+            self.prototypes.move_to_end(key)
+            return self.prototypes[key]
+
+        self.misses += 1
+        if isinstance(face_color, tuple):
+            # if it is a tuple, then it is an RGBA
+            poly = TilePoly(shape, face_color)
+            prototype = NodePath(poly.node)
+        else:
+            # otherwise assume it is a texture string path
+            white = (1, 1, 1, 1)
+            poly = TilePoly(shape, white)
+            prototype = NodePath(poly.node)
+            tex1 = loader.loadTexture(face_color)
+            prototype.setTexture(tex1)
+
+        self.prototypes[key] = (poly, prototype)
+        while len(self.prototypes) > self.max_size:
+            self.prototypes.popitem(last=False)
+            self.evictions += 1
+        return poly, prototype
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    size=len(self.prototypes))
+
+    def clear(self):
+        self.prototypes.clear()
+
+
+prism_cache = PrismCache()
+
+
+class ColliderPool():
+    """
+    Colliders taken off tiles once they have settled, for tiles flung later to reuse
+    rather than making their own, keyed by the tile's shape and the sizes of its
+    collision solids. A settled tile is walled in by the cushions its corners put up
+    (see Surface.tile_wall), so its own collider is no longer needed.
+    """
+
+    def __init__(self):
+        self.free = {}
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, key, make):
+        free = self.free.get(key)
+        if free:
+            self.hits += 1
+            return free.pop()
+        self.misses += 1
+        return make(*key)
+
+    def recycle(self, tile):
+        tile.collider.clearPythonTag("owner")
+        tile.collider.detachNode()
+        self.free.setdefault(tile.collider_key, []).append(tile.collider)
+        tile.collider = None
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    free=sum(len(free) for free in self.free.values()))
+
+    def clear(self):
+        self.free.clear()
+
+
+collider_pool = ColliderPool()
 
 
 class Vector2D():
@@ -208,6 +361,54 @@ class Vector2D():
         return math.sqrt(d2x * d2x + d2y * d2y)
 
 
+def xy_array(points):
+    """ (n, 2) array of the x and y of points with x and y attributes (eg. Vec3 or Point3) """
+    return np.array([[p.x, p.y] for p in points], dtype=float).reshape(-1, 2)
+
+
+def closest_on_segments(ps, p1s, p2s, infinite=False):
+    """
+    Closest points to each of the (n, 2) points ps on each of the m line segments, or
+    lines if infinite, through the (m, 2) points p1s and p2s, as an (n, m, 2) array.
+    Works just the same with 3D (n, 3) and (m, 3) points.
+    """
+    dxy = p2s - p1s
+    hyp2 = (dxy * dxy).sum(axis=-1)
+    rel = ps[:, None, :] - p1s[None, :, :]
+    t = (rel * dxy).sum(axis=-1) / hyp2
+    # closest is a projection onto the line
+    closest = p1s + t[..., None] * dxy
+    if not infinite:
+        # or p1 or p2 beyond the ends of the segment
+        closest = np.where((t < 0)[..., None], p1s, closest)
+        closest = np.where((t > 1)[..., None], p2s, closest)
+    return closest
+
+
+def dist_from_segments(ps, p1s, p2s, infinite=False):
+    """
+    Batched Vector2D.dist_from_2D. Distances of each of the (n, 2) points ps from each
+    of the m line segments, or lines if infinite, through the (m, 2) points p1s and p2s.
+    Returns an (n, m) distance matrix.
+    """
+    d2 = ps[:, None, :] - closest_on_segments(ps, p1s, p2s, infinite)
+    return np.sqrt((d2 * d2).sum(axis=-1))
+
+
+def norms_2D(p1s, p2s):
+    """ Batched Vector2D.norm_2D, as an (m, 2) array """
+    dxy = p2s - p1s
+    hyp = np.sqrt(dxy[:, 0] * dxy[:, 0] + dxy[:, 1] * dxy[:, 1])
+    return np.column_stack([dxy[:, 1] / hyp, -dxy[:, 0] / hyp])
+
+
+def tans_2D(p1s, p2s):
+    """ Batched Vector2D.tan_2D, as an (m, 2) array """
+    dxy = p2s - p1s
+    hyp = np.sqrt(dxy[:, 0] * dxy[:, 0] + dxy[:, 1] * dxy[:, 1])
+    return dxy / hyp[:, None]
+
+
 def normal_2D(p1, p2):
     """
     2D working in x-y plane with points represented as 2 element lists.